@@ -108,6 +108,23 @@ int maxTries = 0x10;
 // on PC/Raspberry-side
 // you can replace the photoresistors with any component having a HIGH tension when an object is present or a switch is activated
 int photoInputs[] = {8, 7, 2};
+// set to 1 to send sensor messages as compact binary frames instead of text lines (see python/main.py docstring)
+// other messages are still sent as text, and are ignored by the program on PC/Raspberry-side
+#define BINARY_PROTOCOL 0
+
+/* MODIFICATION: compact binary sensor messages, framed as [FRAME_START, type, payload length, payload] */
+#define FRAME_START          (0xA5)
+#define FRAME_RFID_DETECTED  (0x01)
+#define FRAME_RFID_LOST      (0x02)
+#define FRAME_PHOTO_DETECTED (0x03)
+#define FRAME_PHOTO_LOST     (0x04)
+
+void sendFrame(uint8_t type, const uint8_t *payload, uint8_t length) {
+  Serial.write(FRAME_START);
+  Serial.write(type);
+  Serial.write(length);
+  Serial.write(payload, length);
+}
 
 void setup(void) {
 
@@ -225,9 +242,13 @@ void loop(void) {
       // Display some basic information about the card
       Serial.println("Found an ISO14443A card");
       Serial.print("  UID Length: ");Serial.print(uidLength, DEC);Serial.println(" bytes");
+#if BINARY_PROTOCOL
+      sendFrame(FRAME_RFID_DETECTED, uid, uidLength);
+#else
       Serial.print("  UID Value: ");
       nfc.PrintHex(uid, uidLength);
       Serial.println("");
+#endif
 
       if (uidLength == 4)
       {
@@ -307,9 +328,13 @@ void loop(void) {
   {
     /* MODIFICATION: lost track of RFID tag previously detected; notify through serial port */
     if (rfidDetected) {
+#if BINARY_PROTOCOL
+      sendFrame(FRAME_RFID_LOST, lastRfidUid, lastUidLength);
+#else
       Serial.print("Lost UID Value: ");
       nfc.PrintHex(lastRfidUid, uidLength);  // optional info since we are supposed to know the previous tag UID
       Serial.println("");
+#endif
       rfidDetected = false;
       // keeping old UID in lastRfidUid is fine, but remember its value is meaningless until next RFID tag is detected
     }
@@ -317,14 +342,23 @@ void loop(void) {
 
   /* MODIFICATION: presence check of object covering PHOTORESISTOR */
   for (int i = 0; i < 3; ++i) {
+    uint8_t photoId = i + 1;
     if (photoDetected[i] && digitalRead(photoInputs[i]) == LOW) {
       photoDetected[i] = false;
+#if BINARY_PROTOCOL
+      sendFrame(FRAME_PHOTO_LOST, &photoId, 1);
+#else
       Serial.print("Lost Photo: ");
-      Serial.println(i+1);
+      Serial.println(photoId);
+#endif
     } else if (!photoDetected[i] && digitalRead(photoInputs[i]) == HIGH) {
       photoDetected[i] = true;
+#if BINARY_PROTOCOL
+      sendFrame(FRAME_PHOTO_DETECTED, &photoId, 1);
+#else
       Serial.print("Photo: ");
-      Serial.println(i+1);
+      Serial.println(photoId);
+#endif
     }
   }
 
@@ -1,10 +1,27 @@
 # -*- coding: utf-8 -*-
-import cv2
-import re
-import serial
-import serial.tools.list_ports
-
+import os
+
+from capture_pool import CapturePool
+from asset_manifest import AssetManifest
+from background_log import flush_log, log
+from compositor import Compositor
+from crossfade import CrossfadeVideo
+from decode_backend import AUTO_BACKEND, FRAME_CACHE_BACKEND, OPENCV_BACKEND, get_capture_factory, \
+    select_decode_backend
+from display import WindowDisplay
+from event_log import EventRecorder
+from frame_cache import warm_up_frame_caches
+from keyframe_index import KeyframeIndex
+from metrics import MetricsServer, record_duration, registry
+import path
+from path import get_full_path, get_video_path
+from prefetcher import Prefetcher, TransitionModel
+from presentation_clock import PresentationClock, get_time
+from sensor_debouncer import SensorDebouncer
+from sensor_state import SensorStateSpace
+from serial_reader import SensorEvent, SerialReader, RFID_DETECTED, RFID_LOST, PHOTO_DETECTED, PHOTO_LOST
 from video import Video
+from video_variants import find_variant_directory, transcode_videos
 
 
 class App(object):
@@ -13,97 +30,401 @@ class App(object):
 
     Attributes:
         rfid_uids              [list(string)] UIDs of the RFID tags, in the format '0x44 0xDE 0xE7 0x53'
+        rfid_uid_to_idx        [dict(string, int)] index of each RFID tag in rfid_uids, per UID
         sensor_state_to_video_name
                                [list(string)] name of the videos associated to the RFID/Photo combinations (sensor_state)
+                                (without the videos that cannot be played, once validated)
+        sensor_value_to_clip_name
+                               [list(dict(int, string))] in compositing mode, name of the clip to play in the cell of each
+                                sensor, per sensor value (no clip for a value means an empty cell), None else
+        sensor_cells           [list((int, int))] (row, column) of the grid cell of each sensor, in compositing mode
         transmission_rate      [int] baud rate
-        fps                    [int] frame rate of the update loop, and also of the videos
+        fps                    [int] frame rate of the videos when they do not provide it
+        clock                  [function] function returning the current time in s, which frame deadlines and debounce
+                                windows are based on (get_time, or the virtual clock of a replay, see event_log.py)
+        presentation_clock     [PresentationClock] clock scheduling video frames against wall-clock deadlines
         fullscreen             [int] should the window be fullscreen?
-        serial                 [Serial] serial configuration to receive Arduino signal
-        video                  [Video] video wrapper for an
+        display                [WindowDisplay or NullDisplay] where videos are shown, the window by default
+        display_size           [(int, int)] (width, height) of the display videos are downscaled to, None to show videos
+                                at their own size (scaling is then done by the window at every frame)
+        source_video_directory [string] directory of the original videos, the videos being played from the variant
+                                directory for display_size instead if it is complete (see select_video_variants),
+                                unless the caller already selected it (see run_panels in main.py)
+        decode_backend         [string] backend decoding the videos (see decode_backend.py), chosen by a decoding
+                                throughput probe at startup if AUTO_BACKEND was passed
+        use_frame_cache        [bool] should videos be played from raw frame caches on disk instead of being decoded?
+                                (always True with the frame cache backend)
+        asset_manifest         [AssetManifest] manifest of the metadata of the videos, used to check at startup that all
+                                videos can be played, None to skip the check
+        keyframe_index         [KeyframeIndex] index of the keyframes of the videos for frame-accurate seeking, None to
+                                let OpenCV seek
+        capture_pool           [CapturePool] pool of open video captures, bounded by capture_pool_size captures and
+                                capture_pool_memory_mb MB, None if videos are opened on each switch
+        serial_reader          [SerialReader] background reader of the sensor messages sent by Arduino to the serial port
+                                (the first serial port found, or serial_port if provided)
+        prefetch_count         [int] number of videos of the most likely next sensor states to prefetch into the capture
+                                pool after each switch
+        transition_model       [TransitionModel] frequencies of the transitions between sensor state codes
+        prefetcher             [Prefetcher] background opener of the likely next videos, None if not prefetching (no
+                                capture pool, compositing mode or prefetch_count is 0)
+        video                  [Video] video wrapper for an, [CrossfadeVideo] pair of video wrappers crossfading between
+                                videos if transition_frame_count > 0, or [Compositor] grid of clips in compositing mode
         running                [bool] should be application be running?
         last_input_keycode     [int] keycode of the last input received, -1 if no input received in last frame
         sensor_state           [list(int)] state of the RFID and photo sensors in the format [RFID, PHOTO1, PHOTO2, PHOTO3]
                                 with RFID = 0 (no RFID), 1, 2 or 3 and PHOTOX = 0 (nothing) or 1 (covered)
+                                (any number of photo sensors is supported, see sensor_value_counts)
+        state_code             [int] code of the sensor state of the video played, -1 if none
+        playing_video_name     [string] name of the video played, None if none
+        sensor_state_space     [SensorStateSpace] space of sensor states, packing each state into an integer code
+        video_name_table       [list(string)] name of the video per sensor state code, None for undefined states
+        nearest_state_codes    [list(int)] code of the closest state with a video, per sensor state code
+        sensor_debouncer       [SensorDebouncer] settling stage applying sensor value changes to sensor_state once stable
+        metrics_server         [MetricsServer] server exposing the durations of the main loop stages, video opens and seeks
+                                on localhost while running, None if not serving metrics (the frame and switch counters
+                                are only registered as gauges if serving or dumping metrics, so that with several
+                                panels, only the panel exposing metrics registers its own)
+        metrics_dump_path      [string] path of the file to dump the metrics to on exit, None to only print a summary
+        event_recorder         [EventRecorder] recorder of the sensor events received (from the serial port or simulated
+                                with debug keys) into an event log, to replay them offline, None if not recording
 
     """
 
     def __init__(self, rfid_uids, sensor_state_to_video_name, window_name='window', transmission_rate=9600, fps=25,
-                 fullscreen=False):
+                 fullscreen=False, capture_pool_size=0, threaded_decode=False, sensor_value_to_clip_name=None,
+                 sensor_cells=None, grid_shape=(3, 3), use_frame_cache=False, keyframe_seek=False,
+                 seek_latency_budget_ms=None, debounce_windows_ms=None, sensor_value_counts=(5, 2, 2, 2),
+                 display=None, serial_port=None, metrics_port=None, metrics_dump_path=None,
+                 decode_backend=OPENCV_BACKEND, scale_to_display=False, display_size=None, validate_videos=False,
+                 prefetch_count=0, transition_frame_count=0, decode_cpu_cores=None, event_log_path=None,
+                 clock=get_time, capture_pool_memory_mb=None, source_video_directory=None):
         self.rfid_uids = rfid_uids
+        self.rfid_uid_to_idx = {uid: rfid_idx for rfid_idx, uid in enumerate(rfid_uids)}
         self.sensor_state_to_video_name = sensor_state_to_video_name
+        self.sensor_value_to_clip_name = sensor_value_to_clip_name
+        self.sensor_cells = sensor_cells
         self.window_name = window_name
         self.transmission_rate = transmission_rate
         self.fps = fps
+        self.clock = clock
+        self.presentation_clock = PresentationClock(fps)
         self.fullscreen = fullscreen
-        self.serial = serial.Serial(baudrate=transmission_rate, timeout=0.006)  # timeout corresponds to sending 80 octal chars at 115200 baud rate
-        self.video = Video(window_name)  # create video wrapper in advance, we will load each video by name later
+        self.display = display if display is not None else WindowDisplay(window_name, fullscreen, display_size)
+        self.display_size = self.display.get_size() if scale_to_display else None
+        if source_video_directory is not None:
+            # path.VIDEO_DIRECTORY was already set to the variant directory, if any
+            self.source_video_directory = source_video_directory
+        else:
+            self.source_video_directory = path.VIDEO_DIRECTORY
+            if self.display_size is not None:
+                select_video_variants(self.get_video_names(), self.display_size)
+        if decode_backend == AUTO_BACKEND:
+            # the frame cache does not support compositing
+            decode_backend = self.probe_decode_backend(use_frame_cache=sensor_value_to_clip_name is None)
+        self.decode_backend = decode_backend
+        use_frame_cache = use_frame_cache or decode_backend == FRAME_CACHE_BACKEND
+        self.use_frame_cache = use_frame_cache
+        capture_factory = get_capture_factory(decode_backend, self.display_size)
+        self.serial_reader = SerialReader(transmission_rate, port=serial_port)
+        self.asset_manifest = AssetManifest(get_full_path('video_manifest.json')) if validate_videos else None
+        self.keyframe_index = KeyframeIndex(get_full_path('keyframe_index.json')) if keyframe_seek else None
+        # frame caches are already open, there is no need to pool captures
+        if capture_pool_size > 0 and not use_frame_cache:
+            max_memory_size = capture_pool_memory_mb * 1024 * 1024 if capture_pool_memory_mb is not None else None
+            self.capture_pool = CapturePool(capture_pool_size, keyframe_index=self.keyframe_index,
+                                            seek_latency_budget_ms=seek_latency_budget_ms,
+                                            capture_factory=capture_factory, max_memory_size=max_memory_size,
+                                            cpu_cores=decode_cpu_cores)
+        else:
+            self.capture_pool = None
+        if sensor_value_to_clip_name is not None:
+            self.video = Compositor(window_name, grid_shape, capture_pool=self.capture_pool, display=self.display,
+                                    capture_factory=capture_factory)
+        elif transition_frame_count > 0:
+            self.video = CrossfadeVideo(window_name, transition_frame_count, display=self.display,
+                                        capture_pool=self.capture_pool, threaded=threaded_decode,
+                                        use_frame_cache=use_frame_cache, keyframe_index=self.keyframe_index,
+                                        seek_latency_budget_ms=seek_latency_budget_ms,
+                                        capture_factory=capture_factory, target_size=self.display_size,
+                                        decode_cpu_cores=decode_cpu_cores)
+        else:
+            self.video = Video(window_name, capture_pool=self.capture_pool, threaded=threaded_decode,
+                               use_frame_cache=use_frame_cache, keyframe_index=self.keyframe_index,
+                               seek_latency_budget_ms=seek_latency_budget_ms, display=self.display,
+                               capture_factory=capture_factory, target_size=self.display_size,
+                               decode_cpu_cores=decode_cpu_cores)  # create video wrapper in advance, we will load each video by name later
+        self.prefetch_count = prefetch_count
+        self.transition_model = TransitionModel()
+        if prefetch_count > 0 and self.capture_pool is not None and sensor_value_to_clip_name is None:
+            self.prefetcher = Prefetcher(self.capture_pool, capture_factory, self.keyframe_index, fps=fps)
+            if capture_pool_size < prefetch_count + 1:
+                print 'WARNING: a capture pool of {} captures can only keep {} prefetched videos besides the one ' \
+                      'playing, set capture_pool_size to {} to prefetch {} videos'.format(
+                          capture_pool_size, capture_pool_size - 1, prefetch_count + 1, prefetch_count)
+        else:
+            self.prefetcher = None
+        self.state_code = -1
+        self.playing_video_name = None
         self.running = False
         self.last_input_keycode = -1
-        self.sensor_state = [0, False, False, False]
+        self.sensor_state_space = SensorStateSpace(sensor_value_counts)
+        self.video_name_table = self.sensor_state_space.build_table(sensor_state_to_video_name)
+        self.nearest_state_codes = self.sensor_state_space.build_nearest_table(self.video_name_table)
+        self.sensor_state = [0] * len(sensor_value_counts)
+        debounce_windows = [window_ms / 1000. for window_ms in debounce_windows_ms] if debounce_windows_ms else None
+        self.sensor_debouncer = SensorDebouncer(self.sensor_state, debounce_windows)
+        self.metrics_server = MetricsServer(registry, metrics_port) if metrics_port is not None else None
+        self.metrics_dump_path = metrics_dump_path
+        self.event_recorder = EventRecorder(event_log_path) if event_log_path is not None else None
+        if self.metrics_server is not None or self.metrics_dump_path is not None:
+            self.register_gauges()
+
+    def register_gauges(self):
+        """
+        Register the frame, switch and prefetch counters of the application as gauges of the global registry
+
+        """
+        registry.add_gauge('presented_frames', lambda: self.presentation_clock.presented_frame_count)
+        registry.add_gauge('dropped_frames', lambda: self.presentation_clock.dropped_frame_count)
+        registry.add_gauge('repeated_frames', lambda: self.presentation_clock.repeated_frame_count)
+        registry.add_gauge('video_switches', lambda: self.sensor_debouncer.switch_count)
+        if self.prefetcher is not None:
+            registry.add_gauge('prefetch_hits', lambda: self.prefetcher.hit_count)
+            registry.add_gauge('prefetch_misses', lambda: self.prefetcher.miss_count)
 
     def run(self):
         """
         Run application by opening window and listening to serial port while rendering videos
 
+        """
+        self.start()
+
+        while self.running:
+            delay_ms = self.step()
+            wait_start_time = get_time()
+            c = self.display.wait_key(delay_ms)  # Wait for a keypress, and let OpenCV display its GUI.
+            self.last_input_keycode = c & 0xFF
+            # time spent in waitKey beyond the requested delay, ie OpenCV GUI processing and scheduling latency
+            record_duration('wait_key_overrun', max((get_time() - wait_start_time) * 1000 - delay_ms, 0.))
+
+        self.stop()
+        # print summaries after the last messages logged
+        flush_log()
+        print 'Stage durations over the last frames:\n{}'.format(registry.format_summary())
+        self.print_summary()
+
+    def start(self):
+        """
+        Open window, check and preload videos, play the initial video and start listening to serial port
+
         """
         print 'Run app in window "{}"'.format(self.window_name)
-        # FPS1 = cvRound( cvGetCaptureProperty(capture1, CV_CAP_PROP_FPS)
-        fixed_tick_diff = 1. / self.fps * cv2.getTickFrequency()  # equivalent of delta time, in ticks
+
+        # index metadata of new or modified videos, and stop using videos that cannot be played, before any playback
+        if self.asset_manifest is not None:
+            self.validate_videos()
 
         # open main window in fullscreen mode
-        print 'Open fullscreen window'
-        cv2.namedWindow(self.window_name, cv2.WINDOW_NORMAL)
-        cv2.setWindowProperty(self.window_name, cv2.WND_PROP_FULLSCREEN, cv2.WINDOW_FULLSCREEN if self.fullscreen else cv2.WINDOW_NORMAL)
+        self.display.open()
+
+        # index keyframes of new or modified videos, before any seek
+        if self.keyframe_index is not None:
+            self.keyframe_index.update(get_video_path(video_name) for video_name in self.get_video_names())
+
+        # open captures in advance, starting with the initial video
+        if self.capture_pool is not None:
+            self.preload_videos()
+            self.capture_pool.start()
+
+        if self.prefetcher is not None:
+            self.prefetcher.start()
 
         # initial video
         self.on_sensor_state_changed()
+        self.presentation_clock.set_fps(self.video.fps)
 
         self.running = True
+        self.serial_reader.start()
+        if self.metrics_server is not None:
+            self.metrics_server.start()
+        if self.event_recorder is not None:
+            self.event_recorder.start(self.clock())
+        self.presentation_clock.start(self.clock())
+
+    def step(self):
+        """
+        Run one iteration of the main loop without waiting: process keyboard input (received by the last wait_key)
+        and sensor events, and present the frame due now if any.
+        Return the delay to wait for until the deadline of the next frame, in ms.
 
-        lag = 0
-        tick_end = cv2.getTickCount()
+        """
+        # durations of the stages of the loop, in ms
+        stage_start_time = get_time()
+
+        # KEYBOARD INPUT
+        # IMPROVE: we do not need to check input as fast as rendering, so use a different fps
+        self.process_input()
+        stage_end_time = get_time()
+        record_duration('input', (stage_end_time - stage_start_time) * 1000)
+        stage_start_time = stage_end_time
+
+        # SERIAL PORT INPUT (received in background, including port (re)connection)
+        self.process_serial_events()
+
+        # apply sensor changes that have settled, as a single video switch
+        self.apply_settled_sensor_state()
+        stage_end_time = get_time()
+        record_duration('serial', (stage_end_time - stage_start_time) * 1000)
+        stage_start_time = stage_end_time
+
+        # UPDATE / RENDER
+        # present the frame due now, dropping frames if late (or nothing if no new frame is due yet)
+        frame_step = self.presentation_clock.tick(self.clock())
+        if frame_step > 1:
+            self.video.skip_frames(frame_step - 1)
+        if frame_step > 0:
+            self.update()
+            stage_end_time = get_time()
+            record_duration('update', (stage_end_time - stage_start_time) * 1000)
+            stage_start_time = stage_end_time
+
+        # Wait until the deadline of the next frame, with at least some delay to allow OpenCV to do its internal
+        # processing (this includes the case of being late ie having a negative delay)
+        return self.presentation_clock.get_delay_ms(self.clock())
+
+    def stop(self):
+        """
+        Stop listening to serial port and close videos
 
-        while self.running:
-            tick_start = cv2.getTickCount()
-            lag += tick_start - tick_end
-
-            # KEYBOARD INPUT
-            # IMPROVE: we do not need to check input as fast as rendering, so use a different fps
-            self.process_input()
-
-            # SERIAL PORT INPUT
-            if not self.serial.is_open:
-                # no port device connected yet or previous device connection was lost
-                # detect any existing serial port
-                self.open_connected_port()
-            if self.serial.is_open:
-                self.read_serial()
-
-            # UPDATE / RENDER
-            while lag >= fixed_tick_diff:
-                self.update()
-                lag -= fixed_tick_diff
-
-            tick_end = cv2.getTickCount()
-            lag += tick_end - tick_start
-
-            # Some tricks from CombineVids.c http://www.shervinemami.info/combineVids.html
-            # Make sure the video runs at roughly the correct speed.
-            # Add a delay that would result in roughly the desired frames per second.
-            # Factor in how much time was used to process this frame already.
-            delay = fixed_tick_diff - lag
-            delay_ms = int(round(float(delay) * 1000 / cv2.getTickFrequency()))
-
-            # Make sure there is at least some delay, to allow OpenCV to do its internal processing.
-            # (this includes the case of being late ie having a negative delay)
-            if delay_ms < 1:
-                delay_ms = 1
-
-            c = cv2.waitKey(delay_ms)  # Wait for a keypress, and let OpenCV display its GUI.
-            self.last_input_keycode = c & 0xFF
+        """
+        self.running = False
+        self.serial_reader.stop()
+        if self.event_recorder is not None:
+            self.event_recorder.stop()
+        if self.prefetcher is not None:
+            self.prefetcher.stop()
+        self.video.close()
+        if self.capture_pool is not None:
+            self.capture_pool.close()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        if self.metrics_dump_path is not None:
+            registry.dump(self.metrics_dump_path)
+            print 'Dumped metrics to {}'.format(self.metrics_dump_path)
+
+    def print_summary(self):
+        """
+        Print counters of sensor debouncing, presentation and video playback since start
+
+        """
+        print 'Sensor debouncing: {} applied transitions, {} suppressed transitions, {} video switches'.format(
+            self.sensor_debouncer.applied_transition_count, self.sensor_debouncer.suppressed_transition_count,
+            self.sensor_debouncer.switch_count)
+        print 'Presentation: {} presented frames, {} dropped frames, {} repeated frames, {} resyncs'.format(
+            self.presentation_clock.presented_frame_count, self.presentation_clock.dropped_frame_count,
+            self.presentation_clock.repeated_frame_count, self.presentation_clock.resync_count)
+        print 'Presentation jitter histogram:\n{}'.format(self.presentation_clock.format_jitter_histogram())
+        if self.prefetcher is not None:
+            print 'Prefetch: {} hits, {} misses ({:.0%} hit rate), {} dropped prefetches'.format(
+                self.prefetcher.hit_count, self.prefetcher.miss_count, self.prefetcher.hit_rate,
+                self.prefetcher.dropped_count)
+        if isinstance(self.video, CrossfadeVideo):
+            print 'Crossfade: {} transitions, {} cut short'.format(self.video.transition_count, self.video.cut_count)
+        if isinstance(self.video, (Video, CrossfadeVideo)) and self.video.frame_reader is not None:
+            print 'Threaded decode: {} dropped frames, {} late frames'.format(
+                self.video.frame_reader.dropped_frame_count, self.video.frame_reader.late_frame_count)
+
+    def preload_videos(self):
+        """
+        Fill the capture pool with the video of the current sensor state, then the other videos by name
+        (when prefetching, only the former, the prefetcher opening the likely next videos instead)
+        In compositing mode, fill it with clips by name
+
+        """
+        video_names = self.get_video_names()
+        if self.sensor_value_to_clip_name is None:
+            initial_video_name = self.video_name_table[self.sensor_state_space.pack(self.sensor_state)]
+            if initial_video_name is not None:
+                video_names.remove(initial_video_name)
+                video_names.insert(0, initial_video_name)
+                if self.prefetcher is not None:
+                    video_names = [initial_video_name]
+        print 'Preload up to {} videos in capture pool'.format(self.capture_pool.max_size)
+        self.capture_pool.preload(get_video_path(video_name) for video_name in video_names)
+
+    def validate_videos(self):
+        """
+        Check that all videos of the sensor states (or all clips in compositing mode) can be played, using the asset
+        manifest. Sensor states whose video cannot be played fall back to the closest state with a playable video,
+        and clips that cannot be played leave their cell empty. Videos that cannot be played are not preloaded,
+        indexed nor prefetched either, since they are no longer listed by get_video_names.
+
+        """
+        video_names = self.get_video_names()
+        self.asset_manifest.update(get_video_path(video_name) for video_name in video_names)
+        errors = self.asset_manifest.validate([get_video_path(video_name) for video_name in video_names])
+        if not errors:
+            print 'All {} videos can be played'.format(len(video_names))
+            return
+
+        print 'WARNING: {} of {} videos cannot be played:'.format(len(errors), len(video_names))
+        for video_path, error in sorted(errors.iteritems()):
+            print '  {}: {}'.format(video_path, error)
+        invalid_video_names = set(os.path.basename(video_path) for video_path in errors)
+
+        if self.sensor_value_to_clip_name is not None:
+            for value_to_clip_name in self.sensor_value_to_clip_name:
+                for sensor_value, clip_name in value_to_clip_name.items():
+                    if clip_name in invalid_video_names:
+                        del value_to_clip_name[sensor_value]
+            return
+
+        self.sensor_state_to_video_name = {
+            sensor_state: video_name for sensor_state, video_name in self.sensor_state_to_video_name.iteritems()
+            if video_name not in invalid_video_names}
+        self.video_name_table = self.sensor_state_space.build_table(self.sensor_state_to_video_name)
+        self.nearest_state_codes = self.sensor_state_space.build_nearest_table(self.video_name_table)
+
+    def get_video_names(self):
+        """
+        Return sorted list of the names of all videos that can be played, or all clips in compositing mode
+
+        """
+        return get_video_names(self.sensor_state_to_video_name, self.sensor_value_to_clip_name)
+
+    def transcode_videos(self):
+        """
+        Transcode all videos to fit the display size, so that the next runs play them without downscaling
+
+        """
+        if self.display_size is None:
+            print 'Unknown display size, cannot transcode videos (set display_size and scale_to_display in main.py)'
+            return
+        print 'Transcode videos for display size {}x{}'.format(*self.display_size)
+        transcode_videos(self.source_video_directory, self.get_video_names(), self.display_size)
+
+    def probe_decode_backend(self, use_frame_cache=True):
+        """
+        Return the decoding backend with the highest throughput on the first video that exists, or the OpenCV backend
+        if there is no video to probe
 
-        if self.serial.is_open:
-            self.serial.close()
+        """
+        for video_name in self.get_video_names():
+            video_path = get_video_path(video_name)
+            if os.path.isfile(video_path):
+                print 'Probe decoding backends on video file {}'.format(video_path)
+                decode_backend = select_decode_backend(video_path, use_frame_cache=use_frame_cache)
+                print 'Use decoding backend {}'.format(decode_backend)
+                return decode_backend
+        return OPENCV_BACKEND
+
+    def warm_up_frame_caches(self):
+        """
+        Decode all videos into their frame caches, so that the first playback in frame cache mode is not slowed down
+
+        """
+        print 'Warm up frame caches'
+        warm_up_frame_caches(get_video_path(video_name) for video_name in self.get_video_names())
 
     def process_input(self):
         """
@@ -116,26 +437,23 @@ class App(object):
 
         # Toggle fullscreen on F press (may not work at times, do not overdo it)
         if self.last_input_keycode == ord('f'):
-            old_fullscreen_mode = cv2.getWindowProperty(self.window_name, cv2.WND_PROP_FULLSCREEN)
-            new_fullscreen_mode = cv2.WINDOW_FULLSCREEN if old_fullscreen_mode == cv2.WINDOW_NORMAL else cv2.WINDOW_NORMAL
-            print 'Switching fullscreen mode from {} to {}'.format(old_fullscreen_mode, new_fullscreen_mode)
-            cv2.setWindowProperty(self.window_name, cv2.WND_PROP_FULLSCREEN, new_fullscreen_mode)
+            self.display.toggle_fullscreen()
 
         # Stop current video on S press
         if self.last_input_keycode == ord('s'):
             self.stop_video()
 
-        # DEBUG: simulate sensors
+        # DEBUG: simulate sensor events, as if received from the serial port (so that they are recorded too)
         if self.last_input_keycode == ord('d'):
-            self.on_rfid_lost()
+            self.on_sensor_event(SensorEvent(RFID_LOST, self.rfid_uids[self.sensor_debouncer.raw_state[0]]))
         if self.last_input_keycode == ord('f'):
-            self.on_rfid_detected(1)
+            self.on_sensor_event(SensorEvent(RFID_DETECTED, self.rfid_uids[1]))
         if self.last_input_keycode == ord('g'):
-            self.on_rfid_detected(2)
+            self.on_sensor_event(SensorEvent(RFID_DETECTED, self.rfid_uids[2]))
         if self.last_input_keycode == ord('h'):
-            self.on_rfid_detected(3)
+            self.on_sensor_event(SensorEvent(RFID_DETECTED, self.rfid_uids[3]))
         if self.last_input_keycode == ord('j'):
-            self.on_rfid_detected(4)
+            self.on_sensor_event(SensorEvent(RFID_DETECTED, self.rfid_uids[4]))
         if self.last_input_keycode == ord('v'):
             self.toggle_photo_state(1)
         if self.last_input_keycode == ord('b'):
@@ -144,153 +462,184 @@ class App(object):
             self.toggle_photo_state(3)
 
     def update(self):
-        if self.video.is_open:
-            # to make things simple, we assume that the FPS of the app is the FPS of the video
-            self.video.play_next_frame()
+        self.video.update()
+        if self.prefetcher is not None:
+            # hand over the prefetched captures to the pool, which syncs them with the video
+            self.prefetcher.poll()
 
-    def open_connected_port(self):
+    def process_serial_events(self):
         """
-        Check if a new port was connected or seek a new serial port (often '/dev/ttyACM0' or '/dev/ttyACM1' on Unix)
-        if the current port is not valid, and start listening to this port
+        Trigger the events received by the serial reader since last frame, without blocking
 
         """
-        ports = list(serial.tools.list_ports.comports())
-
-        # DEBUG
-        # for p in ports:
-        #     print p
-
-        if len(ports) == 0:
-            # print 'No serial ports found'
-            return
-
-        if self.serial.is_open and self.serial.port in (p.device for p in ports):
-            # Current port device still in list, keep it (if possible, do not call this method if already a port!)
-            print 'Keep current serial port ({})'.format(self.serial.port)
-        else:
-            # No current port device or the current device was lost, choose an arbitrary one
-            self.serial.port = ports[0].device
-            self.serial.open()
-            print 'Open serial port: {}'.format(self.serial.port)
+        for event in self.serial_reader.poll_events():
+            self.on_sensor_event(event)
 
-    def read_serial(self):
+    def on_sensor_event(self, event):
         """
-        Read data received at serial port and trigger corresponding events
+        Trigger the state change corresponding to a sensor event received from the serial port
 
         """
-        # try-catch adapted from http://stackoverflow.com/questions/28509398/handle-exception-in-pyserial-during-disconnection
-        try:
-            line = self.serial.readline()  # ensure short timeout to continue looping quickly if no signal
-        except serial.SerialException as e:
-            # Lost connection with Arduino
-            print 'Lost connection with Arduino'
-            # close port (port does not seem to close when plugging Arduino out); you can keep last port in self.serial.port
-            self.serial.close()
-            return
-        except TypeError as e:
-            # We lost connection with Arduino, cancel serial port device and wait for next frame to detect another
-            # port if possible
-            print 'Disconnect of USB->UART occured'
-            # self.serial.port = ''
-            # DEBUG
-            print 'error: {}'.format(e.message)
-            print 'Serial is open? {}'.format(serial.is_open)
-            # self.serial.close()  # close port (would be done anyway?)
-            return
-
-        if not line:
-            return
-
-        # Some data was received
-        line = line.strip()
-
-        # DEBUG
-        # print 'line: {}'.format(line)
-
-        # Detect RFID detected
-        if line.startswith('UID Value'):
-            # RFID found, parse UID in 'UID Value: 0x44 0xDE 0xE7 0x53' for instance (keep string value)
-            uid = re.findall('^UID Value: ([0-9xA-F\s]+)$', line)[0]
-            if uid not in self.rfid_uids:
-                print 'Found unknown UID {0}, cannot choose output video'.format(uid)
+        if self.event_recorder is not None:
+            # record invalid events too, to reproduce the errors they cause
+            self.event_recorder.record(event, self.clock())
+
+        if event.kind == RFID_DETECTED:
+            uid = event.value
+            rfid_idx = self.rfid_uid_to_idx.get(uid)
+            if rfid_idx is None:
+                log('Found unknown UID {0}, cannot choose output video'.format(uid))
                 return
 
-            rfid_idx = self.rfid_uids.index(uid)
             if rfid_idx == 0:
-                print 'Found dummy UID {0}, probably an error on Arduino side'.format(uid)
+                log('Found dummy UID {0}, probably an error on Arduino side'.format(uid))
                 return
 
-            print 'RFID #{0} detected (UID {1})'.format(rfid_idx, uid)
+            log('RFID #{0} detected (UID {1})'.format(rfid_idx, uid))
             self.on_rfid_detected(rfid_idx)
 
-        # Detect RFID lost
-        if line.startswith('Lost UID Value'):
-            # RFID lost
-            print 'RFID lost'
+        elif event.kind == RFID_LOST:
+            log('RFID lost')
 
-            # OPTIONAL: parse UID and check we lost the previous RFID detected
-            uid = re.findall('^Lost UID Value: ([0-9xA-F\s]+)$', line)[0]
+            # OPTIONAL: check we lost the previous RFID detected
+            uid = event.value
             # photo ID is from 1 to 5 but we added dummy ID 0, so it is really like an index
-            rfid_idx = self.rfid_uids.index(uid)
-            if rfid_idx == self.sensor_state[0]:
-                print '(#{0} (UID {1}))'.format(rfid_idx, uid)
+            rfid_idx = self.rfid_uid_to_idx.get(uid)
+            if rfid_idx is None:
+                log('Warning: lost unknown UID {0}'.format(uid))
+            elif rfid_idx == self.sensor_state[0]:
+                log('(#{0} (UID {1}))'.format(rfid_idx, uid))
             else:
                 # mismatch error coming from Arduino, but clear current RFID anyway
-                print 'Warning: lost #{0} (UID {1}) whereas last RFID detected was #{2} (UID {3})'\
-                    .format(rfid_idx, uid, self.sensor_state[0], self.rfid_uids[self.sensor_state[0]])
+                log('Warning: lost #{0} (UID {1}) whereas last RFID detected was #{2} (UID {3})'
+                    .format(rfid_idx, uid, self.sensor_state[0], self.rfid_uids[self.sensor_state[0]]))
 
             self.on_rfid_lost()
 
-        # Detect PHOTO detected
-        if line.startswith('Photo'):
-            # Photo found, parse ID from 1 to 3
-            photo_id = int(re.findall('^Photo: ([0-9]+)$', line)[0])
-            print 'Photoresistor #{0} detected'.format(photo_id)
+        elif event.kind == PHOTO_DETECTED:
+            photo_id = event.value
+            if not self.is_valid_photo_id(photo_id):
+                return
+            log('Photoresistor #{0} detected'.format(photo_id))
             self.on_photo_detected(photo_id)
 
-        # Detect PHOTO lost
-        if line.startswith('Lost Photo'):
-            # Photo found, parse ID from 1 to 3
-            photo_id = int(re.findall('^Lost Photo: ([0-9]+)$', line)[0])
-            print 'Photoresistor #{0} lost'.format(photo_id)
+        elif event.kind == PHOTO_LOST:
+            photo_id = event.value
+            if not self.is_valid_photo_id(photo_id):
+                return
+            log('Photoresistor #{0} lost'.format(photo_id))
             self.on_photo_lost(photo_id)
 
+    def is_valid_photo_id(self, photo_id):
+        """
+        Return True if the photoresistor ID is one of the photo sensors (from 1 to the number of photo sensors, the
+        sensor 0 being the RFID reader), log a warning else, so that a corrupt message is dropped
+
+        """
+        if 1 <= photo_id < len(self.sensor_state):
+            return True
+        log('Warning: unknown photoresistor #{0}, probably an error on Arduino side'.format(photo_id))
+        return False
+
     def on_rfid_detected(self, rfid_idx):
         assert rfid_idx
-        self.sensor_state[0] = rfid_idx  # from 1 to 5
-        self.on_sensor_state_changed()
+        self.set_sensor_value(0, rfid_idx)  # from 1 to 5
 
     def on_rfid_lost(self):
-        self.sensor_state[0] = 0
-        self.on_sensor_state_changed()
+        self.set_sensor_value(0, 0)
 
     def on_photo_detected(self, photo_id):
         # photo ID is from 1 to 3 so no need to offset index
-        self.sensor_state[photo_id] = True
-        self.on_sensor_state_changed()
+        self.set_sensor_value(photo_id, True)
 
     def on_photo_lost(self, photo_id):
-         # photo ID is from 1 to 3 so no need to offset index
-        self.sensor_state[photo_id] = False
-        self.on_sensor_state_changed()
+        # photo ID is from 1 to 3 so no need to offset index
+        self.set_sensor_value(photo_id, False)
+
+    def set_sensor_value(self, sensor_idx, value):
+        """Register new sensor value, to be applied to the sensor state once settled"""
+        self.sensor_debouncer.on_sensor_value(sensor_idx, value, self.clock())
+
+    def apply_settled_sensor_state(self):
+        """Apply sensor values that have settled to the sensor state, and play the corresponding video if changed"""
+        if self.sensor_debouncer.settle(self.clock()):
+            self.sensor_state[:] = self.sensor_debouncer.settled_state
+            self.on_sensor_state_changed()
+            # follow the frame rate of the new video, if it has changed
+            self.presentation_clock.set_fps(self.video.fps)
 
     def toggle_photo_state(self, photo_id):
-        if not self.sensor_state[photo_id]:
-            self.on_photo_detected(photo_id)
+        # toggle last value received, even if not settled yet
+        if not self.sensor_debouncer.raw_state[photo_id]:
+            self.on_sensor_event(SensorEvent(PHOTO_DETECTED, photo_id))
         else:
-            self.on_photo_lost(photo_id)
+            self.on_sensor_event(SensorEvent(PHOTO_LOST, photo_id))
 
     def on_sensor_state_changed(self):
+        if self.sensor_value_to_clip_name is not None:
+            log('Play clips for RFID/Photo combination: {}'.format(self.sensor_state))
+            self.play_cell_clips()
+            return
+
         # play video based on new state (OpenCV VideoCapture interface will also release previous video automatically)
-        video_key = tuple(self.sensor_state)
-        if video_key in self.sensor_state_to_video_name:
-            # lookup corresponding video in dictionary (convert list to tuple since we need hashable keys)
-            print 'Play video for RFID/Photo combination: {}'.format(self.sensor_state)
-            self.play_video(self.sensor_state_to_video_name[video_key], looping=True, same_frame=True)
+        # lookup corresponding video in table indexed by packed state code
+        code = self.sensor_state_space.pack(self.sensor_state)
+        if code >= 0 and self.video_name_table[code] is not None:
+            log('Play video for RFID/Photo combination: {}'.format(self.sensor_state))
+            self.play_state_video(code, self.video_name_table[code])
+        elif code >= 0 and self.nearest_state_codes[code] >= 0:
+            # play video with closest sensor state
+            nearest_code = self.nearest_state_codes[code]
+            log('WARNING: undefined RFID/Photo combination: {}, play closest combination: {}'.format(
+                self.sensor_state, list(self.sensor_state_space.unpack(nearest_code))))
+            self.play_state_video(code, self.video_name_table[nearest_code])
         else:
-            # if possible, play video with closest sensor state; else
-            print 'WARNING: undefined RFID/Photo combination: {}'.format(self.sensor_state)
+            log('WARNING: undefined RFID/Photo combination: {}'.format(self.sensor_state))
             self.stop_video()
+            self.state_code = -1
+            self.playing_video_name = None
+
+    def play_state_video(self, code, video_name):
+        """
+        Play video of the sensor state of the given code at the same frame, then prefetch the videos of the most
+        likely next states
+
+        """
+        is_switch = self.playing_video_name is not None and video_name != self.playing_video_name
+        if self.prefetcher is not None and is_switch:
+            self.prefetcher.record_switch(get_video_path(video_name))
+        if self.state_code >= 0 and code != self.state_code:
+            self.transition_model.record(self.state_code, code)
+        self.state_code = code
+        self.playing_video_name = video_name
+
+        self.play_video(video_name, looping=True, same_frame=True)
+
+        if self.prefetcher is not None:
+            self.prefetch_next_videos()
+
+    def prefetch_next_videos(self):
+        """
+        Prefetch the videos of the most likely next sensor states, which differ from the current state by one sensor
+
+        """
+        next_codes = self.transition_model.predict(
+            self.state_code, self.sensor_state_space.get_neighbour_codes(self.state_code), self.prefetch_count)
+        video_names = []
+        for next_code in next_codes:
+            nearest_code = self.nearest_state_codes[next_code]
+            video_name = self.video_name_table[nearest_code] if nearest_code >= 0 else None
+            if video_name is not None and video_name != self.playing_video_name and video_name not in video_names:
+                video_names.append(video_name)
+        self.prefetcher.fps = self.video.fps or self.fps
+        self.prefetcher.prefetch([get_video_path(video_name) for video_name in video_names], self.video.frame_counter)
+
+    def play_cell_clips(self):
+        """Play in the cell of each sensor the clip corresponding to its value, or clear the cell"""
+        for sensor_idx, sensor_value in enumerate(self.sensor_state):
+            row, column = self.sensor_cells[sensor_idx]
+            clip_name = self.sensor_value_to_clip_name[sensor_idx].get(int(sensor_value))
+            self.video.set_cell_clip(row, column, clip_name)
 
     def play_video(self, filename, looping=False, same_frame=False):
         if same_frame:
@@ -302,3 +651,26 @@ class App(object):
         """Stop current video and show white frame"""
         self.video.close()
 
+
+def get_video_names(sensor_state_to_video_name, sensor_value_to_clip_name=None):
+    """
+    Return sorted list of the names of all videos that can be played, or all clips in compositing mode
+
+    """
+    if sensor_value_to_clip_name is not None:
+        return sorted(set(clip_name for value_to_clip_name in sensor_value_to_clip_name
+                          for clip_name in value_to_clip_name.itervalues()))
+    return sorted(set(sensor_state_to_video_name.values()))
+
+
+def select_video_variants(video_names, display_size):
+    """
+    Play videos from the variant directory transcoded for the display size, if it has all the videos, by changing
+    path.VIDEO_DIRECTORY, which must be done before opening any video
+
+    """
+    variant_directory = find_variant_directory(path.VIDEO_DIRECTORY, video_names, display_size)
+    if variant_directory is not None:
+        print 'Play videos transcoded for display size {}x{} from {}'.format(
+            display_size[0], display_size[1], variant_directory)
+        path.VIDEO_DIRECTORY = variant_directory
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import multiprocessing
+import os
+
+import cv2
+
+from path import get_video_key
+
+# size of the chunks read to hash video files, in bytes
+HASH_CHUNK_SIZE = 1 << 20
+
+
+class AssetManifest(object):
+    """
+    Manifest of the metadata of the video files (frame rate, frame count, resolution, codec and content hash),
+    persisted to a JSON file so that only new or modified videos are probed at startup
+
+    Attributes:
+        manifest_path   [string] path to the JSON file the manifest is persisted to
+        entries         [dict(string, dict)] entry per video key (see get_video_key), with the modification time and
+                        size of the video ('mtime', 'size') and either its metadata ('fps', 'frame_count', 'width',
+                        'height', 'codec', 'hash') or the reason it cannot be played ('error')
+        process_count   [int] number of processes probing videos in parallel, None for the number of CPUs
+    """
+
+    def __init__(self, manifest_path, process_count=None):
+        self.manifest_path = manifest_path
+        self.process_count = process_count
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        if not os.path.isfile(self.manifest_path):
+            return
+        try:
+            with open(self.manifest_path, 'r') as manifest_file:
+                self.entries = json.load(manifest_file)
+        except ValueError:
+            print 'Invalid asset manifest {}, it will be rebuilt'.format(self.manifest_path)
+            self.entries = {}
+
+    def save(self):
+        with open(self.manifest_path, 'w') as manifest_file:
+            json.dump(self.entries, manifest_file, indent=1, sort_keys=True)
+
+    def update(self, video_paths):
+        """
+        Probe the given videos that are not in the manifest yet or have changed, in parallel, and save the manifest.
+        Missing videos are skipped, they have no entry.
+
+        """
+        changed_video_paths = []
+        for video_path in video_paths:
+            if not os.path.isfile(video_path):
+                continue
+            entry = self.entries.get(get_video_key(video_path))
+            if entry is None or (entry['mtime'], entry['size']) != get_file_stamp(video_path):
+                changed_video_paths.append(video_path)
+
+        if not changed_video_paths:
+            return
+
+        print 'Index metadata of {} video files'.format(len(changed_video_paths))
+        if len(changed_video_paths) == 1:
+            # not worth starting processes
+            new_entries = [probe_video(changed_video_paths[0])]
+        else:
+            pool = multiprocessing.Pool(self.process_count)
+            try:
+                new_entries = pool.map(probe_video, changed_video_paths, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+
+        for video_path, entry in zip(changed_video_paths, new_entries):
+            self.entries[get_video_key(video_path)] = entry
+        self.save()
+
+    def get_metadata(self, video_path):
+        """
+        Return the manifest entry of a video, None if the video is not indexed
+
+        """
+        return self.entries.get(get_video_key(video_path))
+
+    def validate(self, video_paths):
+        """
+        Return dictionary of the reason each of the given videos cannot be played, per video path (empty if all videos
+        can be played), and print a warning if the playable videos differ in frame rate, frame count or resolution
+
+        """
+        errors = {}
+        formats = {}
+        for video_path in video_paths:
+            entry = self.get_metadata(video_path)
+            if not os.path.isfile(video_path):
+                errors[video_path] = 'file not found'
+            elif entry is None:
+                errors[video_path] = 'not indexed'
+            elif 'error' in entry:
+                errors[video_path] = entry['error']
+            else:
+                video_format = (entry['fps'], entry['frame_count'], entry['width'], entry['height'])
+                formats.setdefault(video_format, []).append(video_path)
+
+        if len(formats) > 1:
+            # videos are switched at the same frame, so they should all have the same format
+            print 'WARNING: videos have different formats (fps, frame count, width, height):'
+            for video_format, format_video_paths in sorted(formats.iteritems()):
+                print '  {}: {} videos, e.g. {}'.format(video_format, len(format_video_paths), format_video_paths[0])
+        return errors
+
+
+def get_file_stamp(file_path):
+    """
+    Return (modification time, size) of a file, which change when the file is modified
+
+    """
+    stat = os.stat(file_path)
+    return stat.st_mtime, stat.st_size
+
+
+def probe_video(video_path):
+    """
+    Return the manifest entry of a video file, with its metadata if it can be decoded, or the error else.
+    Run in worker processes, so it must be a module-level function.
+
+    """
+    mtime, size = get_file_stamp(video_path)
+    entry = {'mtime': mtime, 'size': size}
+
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        entry['error'] = 'cannot open file'
+        return entry
+    # decode the first frame, a file with a valid header may still be truncated or use an unsupported codec
+    ret, _ = capture.read()
+    if not ret:
+        capture.release()
+        entry['error'] = 'cannot decode first frame'
+        return entry
+
+    fourcc = int(capture.get(cv2.CAP_PROP_FOURCC))
+    entry.update({
+        'fps': capture.get(cv2.CAP_PROP_FPS),
+        'frame_count': int(capture.get(cv2.CAP_PROP_FRAME_COUNT)),
+        'width': int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        'height': int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        'codec': ''.join(chr((fourcc >> shift) & 0xFF) for shift in (0, 8, 16, 24)).strip('\0 '),
+        'hash': hash_file(video_path),
+    })
+    capture.release()
+    return entry
+
+
+def hash_file(file_path):
+    """
+    Return SHA-1 hex digest of the content of a file, read by chunks
+
+    """
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as file_to_hash:
+        while True:
+            chunk = file_to_hash.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            sha1.update(chunk)
+    return sha1.hexdigest()
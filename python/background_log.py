@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+import sys
+import threading
+from Queue import Queue
+
+# messages to print, consumed by the log thread
+_messages = Queue()
+_thread = None
+_thread_lock = threading.Lock()
+
+
+def log(message):
+    """
+    Print message from a background thread, so that a slow console (e.g. a serial console on a Raspberry Pi)
+    never blocks the render thread. Messages are printed in order.
+
+    """
+    global _thread
+    if _thread is None:
+        with _thread_lock:
+            if _thread is None:
+                _thread = threading.Thread(target=_print_loop, name='BackgroundLog')
+                _thread.daemon = True
+                _thread.start()
+    _messages.put(message)
+
+
+def flush_log():
+    """
+    Wait until all messages logged so far are printed (e.g. before printing a summary at exit)
+
+    """
+    if _thread is not None:
+        _messages.join()
+
+
+def _print_loop():
+    while True:
+        message = _messages.get()
+        sys.stdout.write(message + '\n')
+        sys.stdout.flush()
+        _messages.task_done()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Headless benchmark of the application, playing generated clips without window while a simulated Arduino replays
+a scripted trace of sensor messages on a pseudo-terminal, as a real Arduino would on its serial port.
+Enter the python directory and run `python benchmark.py` to print the switch latency (from the sensor message sent
+to the first frame of the new video shown, including the debounce window), the sustained frame rate, the CPU time
+per frame and the peak memory.
+
+A trace file has one sensor message per line, preceded by the time to send it in seconds since the start, e.g.
+    0.5 UID Value: 0xB4 0xE2 0xE7 0x53
+    1.2 Photo: 2
+Empty lines and lines starting with '#' are ignored, so event logs recorded by the application (see event_log_path
+in main.py) can be replayed as traces. Without trace file, a trace cycling through RFID tags and photos
+is generated.
+
+Run `python benchmark.py --help` for the other options.
+
+"""
+import argparse
+import os
+import resource
+import shutil
+import tempfile
+import threading
+import time
+import tty
+
+import cv2
+import numpy as np
+
+import main
+import path
+from app import App
+from display import NullDisplay
+from event_log import SwitchLatencyMixin, load_event_log
+
+# time to wait after the last message of the trace before stopping, so that the last switch is measured, in s
+trace_tail_duration = 1.
+
+
+class BenchmarkApp(SwitchLatencyMixin, App):
+    """
+    Application measuring the latency of each video switch, from the time the simulated Arduino sent the last
+    sensor message (last_event_time, set by the trace thread) to the time the first frame of the new video is shown
+    """
+
+    def get_show_time(self):
+        # the trace thread sends messages on the wall clock
+        return self.display.last_show_time
+
+
+def generate_clips(video_names, directory, size, frame_count, fps):
+    """
+    Write one synthetic clip per video name in directory, each with its own colour and a moving bar,
+    so that frames do not compress to nothing
+
+    """
+    width, height = size
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+    frame = np.empty((height, width, 3), np.uint8)
+    for video_idx, video_name in enumerate(sorted(video_names)):
+        writer = cv2.VideoWriter(os.path.join(directory, video_name), fourcc, fps, size)
+        colour = ((video_idx * 53) % 256, (video_idx * 97) % 256, (video_idx * 151) % 256)
+        for frame_idx in xrange(frame_count):
+            frame[:] = colour
+            bar_x = frame_idx * width // frame_count
+            frame[:, bar_x:bar_x + width // 16] = 255
+            cv2.putText(frame, '{} {}'.format(video_name, frame_idx), (10, height // 2),
+                        cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 0), 2)
+            writer.write(frame)
+        writer.release()
+
+
+def generate_trace(duration, interval):
+    """
+    Return list of (time in s, message) cycling through RFID tags and photos, one message per interval, only using
+    the RFID tags that have videos (see sensor_value_counts in main.py)
+
+    """
+    messages = []
+    for rfid_idx in xrange(1, min(len(main.rfid_uids), main.sensor_value_counts[0])):
+        uid = main.rfid_uids[rfid_idx]
+        messages.append('UID Value: {}'.format(uid))
+        for photo_id in xrange(1, len(main.sensor_value_counts)):
+            messages.append('Photo: {}'.format(photo_id))
+        for photo_id in xrange(1, len(main.sensor_value_counts)):
+            messages.append('Lost Photo: {}'.format(photo_id))
+        messages.append('Lost UID Value: {}'.format(uid))
+
+    message_count = int(duration / interval)
+    return [((message_idx + 1) * interval, messages[message_idx % len(messages)])
+            for message_idx in xrange(message_count)]
+
+
+def replay_trace(app, trace, write):
+    """
+    Send the messages of the trace on schedule like Arduino (text lines ending with CR LF), then stop the app
+
+    """
+    # wait for the app to start reading the serial port
+    while not app.running:
+        time.sleep(0.01)
+    start_time = time.time()
+    for message_time, message in trace:
+        delay = start_time + message_time - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        if not app.running:
+            return
+        app.last_event_time = time.time()
+        write(message + '\r\n')
+    time.sleep(trace_tail_duration)
+    app.running = False
+
+
+def format_stat(values, scale=1000., unit='ms'):
+    if not values:
+        return 'n/a'
+    values = sorted(values)
+    return 'mean {:.1f} {unit}, median {:.1f} {unit}, max {:.1f} {unit}'.format(
+        scale * sum(values) / len(values), scale * values[len(values) // 2], scale * values[-1], unit=unit)
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description='Headless benchmark with a simulated Arduino')
+    parser.add_argument('--duration', type=float, default=20., help='duration of the generated trace, in s')
+    parser.add_argument('--interval', type=float, default=0.5, help='time between generated messages, in s')
+    parser.add_argument('--trace', help='trace file to replay instead of a generated trace')
+    parser.add_argument('--width', type=int, default=1280, help='width of the generated clips')
+    parser.add_argument('--height', type=int, default=720, help='height of the generated clips')
+    parser.add_argument('--frame-count', type=int, default=100, help='number of frames of the generated clips')
+    parser.add_argument('--video-directory', help='play videos of this directory instead of generated clips')
+    parser.add_argument('--decode-backend', default=main.decode_backend,
+                        help="backend decoding the videos: 'opencv', 'pyav', 'frame_cache' or 'auto' (see main.py)")
+    parser.add_argument('--transition-frame-count', type=int, default=main.transition_frame_count,
+                        help='number of frames of the crossfade between videos, 0 to cut')
+    parser.add_argument('--display-size', help="size of the simulated display to downscale videos to, e.g. '1920x1080'")
+    parser.add_argument('--loop', action='store_true',
+                        help="use pySerial 'loop://' port instead of a pseudo-terminal (no serial driver involved)")
+    args = parser.parse_args()
+
+    temporary_directory = None
+    if args.video_directory is not None:
+        path.VIDEO_DIRECTORY = args.video_directory
+    else:
+        temporary_directory = tempfile.mkdtemp(prefix='benchmark_videos_')
+        path.VIDEO_DIRECTORY = temporary_directory
+        video_names = main.generate_sensor_state_to_video_name().values()
+        print 'Generate {} clips of {}x{} in {}'.format(len(video_names), args.width, args.height, temporary_directory)
+        generate_clips(video_names, temporary_directory, (args.width, args.height), args.frame_count, main.fps)
+
+    master_fd = slave_fd = None
+    if args.loop:
+        serial_port = 'loop://'
+    else:
+        master_fd, slave_fd = os.openpty()
+        # no echo nor line translation, like a USB serial device
+        tty.setraw(slave_fd)
+        serial_port = os.ttyname(slave_fd)
+
+    display_size = tuple(int(length) for length in args.display_size.split('x')) if args.display_size else None
+    display = NullDisplay(size=display_size)
+    # no keyframe seek: the keyframe index of generated clips would be written to the project directory
+    app = BenchmarkApp(main.rfid_uids, main.generate_sensor_state_to_video_name(), 'benchmark', main.transmission_rate,
+                       main.fps, capture_pool_size=main.capture_pool_size,
+                       capture_pool_memory_mb=main.capture_pool_memory_mb,
+                       prefetch_count=main.prefetch_count, transition_frame_count=args.transition_frame_count,
+                       threaded_decode=main.threaded_decode,
+                       seek_latency_budget_ms=main.seek_latency_budget_ms,
+                       debounce_windows_ms=main.debounce_windows_ms, sensor_value_counts=main.sensor_value_counts,
+                       display=display, serial_port=serial_port, decode_backend=args.decode_backend,
+                       scale_to_display=display_size is not None)
+
+    if args.loop:
+        write = app.serial_reader.serial.write
+    else:
+        write = lambda data: os.write(master_fd, data)
+    trace = load_event_log(args.trace) if args.trace else generate_trace(args.duration, args.interval)
+    trace_thread = threading.Thread(target=replay_trace, args=(app, trace, write))
+    trace_thread.daemon = True
+    trace_thread.start()
+
+    start_times = os.times()
+    start_time = time.time()
+    try:
+        app.run()
+    finally:
+        if master_fd is not None:
+            os.close(master_fd)
+            os.close(slave_fd)
+        if temporary_directory is not None:
+            shutil.rmtree(temporary_directory)
+    duration = time.time() - start_time
+    end_times = os.times()
+
+    cpu_time = (end_times[0] - start_times[0]) + (end_times[1] - start_times[1])
+    frame_count = max(display.frame_count, 1)
+    print
+    print 'Benchmark results:'
+    print '  Messages sent: {}, video switches: {}, stopped videos: {}'.format(
+        len(trace), len(app.switch_latencies), app.stopped_switch_count)
+    print '  Switch latency: {}'.format(format_stat(app.switch_latencies))
+    print '  Sustained frame rate: {:.1f} fps ({} frames in {:.1f} s)'.format(
+        display.frame_count / duration, display.frame_count, duration)
+    print '  CPU time per frame: {:.2f} ms ({:.0f}% of one core)'.format(
+        1000 * cpu_time / frame_count, 100 * cpu_time / duration)
+    # ru_maxrss is in KB on Linux
+    print '  Peak RSS: {:.1f} MB'.format(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.)
+
+
+if __name__ == '__main__':
+    main_benchmark()
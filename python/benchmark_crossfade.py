@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark of the crossfade renderer, i.e. the work added to each frame of a transition on the render thread:
+copying the outgoing and incoming frames into their frame sinks and blending them into the preallocated buffer.
+Enter the python directory and run `python benchmark_crossfade.py` on the target device (e.g. a Raspberry Pi)
+to print the time per transition frame for each resolution, as a share of the frame budget at the video frame rate,
+with the allocating and floating-point NumPy blends as a reference.
+
+Decoding the second video during a transition comes on top of this, measure it with `python benchmark.py`.
+
+"""
+import argparse
+import timeit
+
+import cv2
+import numpy as np
+
+import main
+from crossfade import blend_frames
+from display import FrameSink
+
+# number of transition frames rendered per run
+repeat_count = 50
+
+
+def generate_frame(width, height, seed):
+    """
+    Return a frame of random noise, which does not let the blend take shortcuts on uniform areas
+
+    """
+    return np.random.RandomState(seed).randint(0, 256, (height, width, 3)).astype(np.uint8)
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description='Micro-benchmark of the crossfade renderer')
+    parser.add_argument('--sizes', nargs='+', default=['1280x720', '1920x1080'],
+                        help="frame sizes to benchmark, e.g. '1920x1080'")
+    parser.add_argument('--fps', type=float, default=main.fps, help='frame rate giving the frame budget')
+    args = parser.parse_args()
+
+    frame_budget_ms = 1000. / args.fps
+    print 'Frame budget at {:g} fps: {:.1f} ms'.format(args.fps, frame_budget_ms)
+    for size in args.sizes:
+        width, height = (int(length) for length in size.split('x'))
+        outgoing_frame = generate_frame(width, height, 0)
+        incoming_frame = generate_frame(width, height, 1)
+        outgoing_sink = FrameSink()
+        incoming_sink = FrameSink()
+        blend_frame = np.empty_like(incoming_frame)
+
+        def render_transition_frame():
+            outgoing_sink.show(outgoing_frame)
+            incoming_sink.show(incoming_frame)
+            blend_frames(outgoing_sink.frame, incoming_sink.frame, 0.5, blend_frame)
+
+        def blend_allocating():
+            cv2.addWeighted(outgoing_frame, 0.5, incoming_frame, 0.5, 0)
+
+        def blend_float():
+            (outgoing_frame * 0.5 + incoming_frame * 0.5).astype(np.uint8)
+
+        print '{}x{}:'.format(width, height)
+        for name, render in (('transition frame (sink copies + in-place blend)', render_transition_frame),
+                             ('allocating addWeighted blend', blend_allocating),
+                             ('floating-point NumPy blend', blend_float)):
+            # keep the best of several runs to limit the noise of other processes
+            duration_ms = 1000. * min(timeit.repeat(render, number=repeat_count, repeat=3)) / repeat_count
+            print '  {}: {:.2f} ms ({:.0f}% of the frame budget)'.format(
+                name, duration_ms, 100 * duration_ms / frame_budget_ms)
+
+
+if __name__ == '__main__':
+    main_benchmark()
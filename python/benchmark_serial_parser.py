@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark of the serial message parser, including the lookup of RFID indices.
+Enter the python directory and run `python benchmark_serial_parser.py` to print the number of messages parsed
+per second, for text lines, binary frames and the former parser (prefix checks, uncompiled regular expressions
+and linear UID search) as a reference.
+
+"""
+import re
+import timeit
+
+from main import rfid_uids
+from serial_reader import parse_sensor_frame, parse_sensor_line, SensorEvent, RFID_DETECTED, RFID_LOST, \
+    PHOTO_DETECTED, PHOTO_LOST
+
+# number of times each message sample is parsed
+repeat_count = 20000
+
+# sensor messages in the order of a typical sequence, photos changing more often than RFID tags
+sample_lines = [
+    'UID Value: 0x24 0xDD 0xE7 0x53',
+    'Photo: 1',
+    'Photo: 2',
+    'Lost Photo: 1',
+    'Photo: 3',
+    'Lost Photo: 2',
+    'Lost Photo: 3',
+    'Lost UID Value: 0x24 0xDD 0xE7 0x53',
+]
+sample_frames = [
+    (0x01, '\x24\xdd\xe7\x53'),
+    (0x03, '\x01'),
+    (0x03, '\x02'),
+    (0x04, '\x01'),
+    (0x03, '\x03'),
+    (0x04, '\x02'),
+    (0x04, '\x03'),
+    (0x02, '\x24\xdd\xe7\x53'),
+]
+
+UID_KINDS = frozenset((RFID_DETECTED, RFID_LOST))
+rfid_uid_to_idx = {uid: rfid_idx for rfid_idx, uid in enumerate(rfid_uids)}
+
+
+def parse_lines():
+    for line in sample_lines:
+        event = parse_sensor_line(line)
+        if event.kind in UID_KINDS:
+            rfid_uid_to_idx.get(event.value)
+
+
+def parse_frames():
+    for frame_type, payload in sample_frames:
+        event = parse_sensor_frame(frame_type, payload)
+        if event.kind in UID_KINDS:
+            rfid_uid_to_idx.get(event.value)
+
+
+def parse_lines_former():
+    for line in sample_lines:
+        if line.startswith('UID Value'):
+            event = SensorEvent(RFID_DETECTED, re.findall('^UID Value: ([0-9xA-F\s]+)$', line)[0])
+            rfid_uids.index(event.value)
+        if line.startswith('Lost UID Value'):
+            event = SensorEvent(RFID_LOST, re.findall('^Lost UID Value: ([0-9xA-F\s]+)$', line)[0])
+            rfid_uids.index(event.value)
+        if line.startswith('Photo'):
+            SensorEvent(PHOTO_DETECTED, int(re.findall('^Photo: ([0-9]+)$', line)[0]))
+        if line.startswith('Lost Photo'):
+            SensorEvent(PHOTO_LOST, int(re.findall('^Lost Photo: ([0-9]+)$', line)[0]))
+
+
+def main():
+    for name, parse, message_count in (('text lines', parse_lines, len(sample_lines)),
+                                       ('binary frames', parse_frames, len(sample_frames)),
+                                       ('text lines (former parser)', parse_lines_former, len(sample_lines))):
+        # keep the best of several runs to limit the noise of other processes
+        duration = min(timeit.repeat(parse, number=repeat_count, repeat=3))
+        print '{}: {:.0f} messages/s'.format(name, message_count * repeat_count / duration)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+import threading
+from collections import OrderedDict
+
+import cv2
+
+from cpu_affinity import pin_current_thread
+from keyframe_index import seek_frame
+from metrics import record_duration
+from presentation_clock import get_time
+
+# estimated number of frames an FFmpeg decoder keeps allocated per capture (reference frames, frame threads and the
+# output frame), to estimate the memory held by a capture from its frame size
+DECODER_FRAME_COUNT = 8
+
+
+class PooledCapture(object):
+    """
+    OpenCV video capture kept open by a CapturePool, with the index of the next frame it will read
+
+    Attributes:
+        filename        [string] path to video file
+        capture         [VideoCapture or PyAVCapture] opened video capture
+        frame_counter   [int] index of the next frame capture.read() or capture.grab() will return
+        frame_count     [int] total number of frames in the video
+        memory_size     [int] estimated memory held by the capture, in bytes (decoder frames in YUV 4:2:0)
+        lock            [Lock] lock held while the capture decodes, so that the pool can sync it in the background
+    """
+
+    def __init__(self, filename, capture):
+        self.filename = filename
+        self.capture = capture
+        self.frame_counter = 0
+        self.frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        width = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.memory_size = width * height * 3 // 2 * DECODER_FRAME_COUNT
+        self.lock = threading.Lock()
+
+    def is_behind(self, frame_counter):
+        """
+        Return True if the capture is a few frames before the given frame, in the same loop of the video (so that it
+        can reach it by decoding forward), False if it is at or after the given frame
+
+        """
+        if not self.frame_count:
+            return self.frame_counter < frame_counter
+        lag = (frame_counter - self.frame_counter) % self.frame_count
+        return 0 < lag <= self.frame_count // 2
+
+    def grab(self):
+        """
+        Decode next frame without retrieving it, looping back to the first frame at the end of the video
+
+        """
+        self.capture.grab()
+        self.frame_counter += 1
+        if self.frame_counter >= self.frame_count:
+            self.seek(0)
+
+    def seek(self, frame_counter, keyframes=None, latency_budget_ms=None):
+        """
+        Seek to frame, using keyframes if any (see seek_frame). The frame reached may be before the requested frame
+        if the latency budget was exceeded.
+
+        """
+        self.frame_counter = seek_frame(self.capture, self.frame_counter, frame_counter, keyframes, latency_budget_ms)
+
+    def release(self):
+        self.capture.release()
+
+
+class CapturePool(object):
+    """
+    Bounded pool of open video captures, so that switching video does not open a file and seek on the render thread
+
+    Idle captures are kept in least-recently-used order and the oldest ones are released when the pool exceeds
+    max_size captures or max_memory_size bytes (estimated, see PooledCapture.memory_size).
+    With sync_idle, a background thread decodes idle captures forward to the frame of the active video given by
+    sync(), so that a capture acquired at the current frame of the active video is already positioned and needs no
+    seek. Captures ahead of the active video (e.g. released while decoding ahead in threaded mode) wait for it.
+    Syncing costs one decode per idle capture per frame, on the sync thread, so keep max_size small on weak hardware.
+
+    Attributes:
+        max_size        [int] maximum number of open captures, including the ones in use
+        max_memory_size [int] maximum estimated memory of the open captures, including the ones in use, in bytes,
+                        None for no limit (the capture in use is always kept, even if it exceeds the limit alone)
+        sync_idle       [bool] should idle captures be advanced along with the active video in the background?
+        cpu_cores       [list(int)] CPU cores the sync thread is pinned to, None to let the system choose
+        idle_captures   [OrderedDict(string, PooledCapture)] idle captures per filename, least recently used first
+        in_use_count    [int] number of captures acquired and not released yet
+        in_use_memory_size
+                        [int] estimated memory of the captures acquired and not released yet, in bytes
+        frame_counter   [int] index of the next frame of the active video, idle captures are synced to
+        hit_count       [int] number of acquisitions served by an idle capture already at the requested frame
+        seek_count      [int] number of acquisitions served by an idle capture that had to seek
+        miss_count      [int] number of acquisitions that had to open the video file
+        keyframe_index  [KeyframeIndex] optional index of keyframes used for frame-accurate seeking
+        seek_latency_budget_ms
+                        [float] maximum time to spend decoding forward from a keyframe when seeking, None for no limit
+        capture_factory [function] function creating a video capture of the decoding backend from a filename,
+                        cv2.VideoCapture by default (see decode_backend.py)
+    """
+
+    def __init__(self, max_size=2, sync_idle=True, keyframe_index=None, seek_latency_budget_ms=None,
+                 capture_factory=cv2.VideoCapture, max_memory_size=None, cpu_cores=None):
+        assert max_size > 0
+        self.max_size = max_size
+        self.max_memory_size = max_memory_size
+        self.capture_factory = capture_factory
+        self.sync_idle = sync_idle
+        self.cpu_cores = cpu_cores
+        self.keyframe_index = keyframe_index
+        self.seek_latency_budget_ms = seek_latency_budget_ms
+        self.idle_captures = OrderedDict()
+        self.in_use_count = 0
+        self.in_use_memory_size = 0
+        self.frame_counter = 0
+        self.hit_count = 0
+        self.seek_count = 0
+        self.miss_count = 0
+        # guards idle_captures and frame_counter, shared with the sync thread
+        self._lock = threading.Lock()
+        self._sync_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Start syncing idle captures in the background, if sync_idle
+
+        """
+        if not self.sync_idle or self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._sync_loop, name='CapturePoolSync')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._sync_event.set()
+        self._thread.join()
+        self._thread = None
+
+    def preload(self, filenames):
+        """
+        Open captures for the given video files, in order, until the pool is full
+
+        """
+        for filename in filenames:
+            if len(self.idle_captures) + self.in_use_count >= self.max_size:
+                break
+            if filename in self.idle_captures:
+                continue
+            pooled = self._open(filename)
+            if pooled is None:
+                continue
+            if self._exceeds_budget(len(self.idle_captures) + 1, pooled.memory_size):
+                # keep the videos opened first (e.g. the initial video)
+                pooled.release()
+                break
+            with self._lock:
+                self.idle_captures[filename] = pooled
+        self._sync_event.set()
+
+    def acquire(self, filename, frame_counter=0):
+        """
+        Return a pooled capture for the video file positioned at the given frame, or None if it cannot be opened.
+        If seeking exceeds the latency budget, the capture may be positioned before the given frame.
+        The capture is removed from the idle captures until it is released.
+
+        """
+        with self._lock:
+            pooled = self.idle_captures.pop(filename, None)
+        opened = pooled is None
+        if opened:
+            self.miss_count += 1
+            with self._lock:
+                self._evict(self.max_size - 1)
+            pooled = self._open(filename)
+            if pooled is None:
+                return None
+
+        # wait for the sync thread to finish decoding this capture, if it is
+        with pooled.lock:
+            if pooled.frame_count:
+                # pooled videos loop, so a frame index beyond the end designates a frame of a later loop
+                frame_counter %= pooled.frame_count
+
+            if not opened:
+                if pooled.frame_counter == frame_counter:
+                    self.hit_count += 1
+                else:
+                    self.seek_count += 1
+
+            if pooled.frame_counter != frame_counter:
+                keyframes = self.keyframe_index.get_keyframes(filename) if self.keyframe_index is not None else None
+                pooled.seek(frame_counter, keyframes, self.seek_latency_budget_ms)
+
+        self.in_use_count += 1
+        self.in_use_memory_size += pooled.memory_size
+        with self._lock:
+            # make room for the capture in use within the memory budget
+            self._evict(self.max_size)
+        return pooled
+
+    def release(self, pooled, frame_counter):
+        """
+        Give back a capture acquired from this pool, telling the index of the next frame it will read
+
+        """
+        self.in_use_count -= 1
+        self.in_use_memory_size -= pooled.memory_size
+        pooled.frame_counter = frame_counter
+        with self._lock:
+            duplicate = self.idle_captures.pop(pooled.filename, None)
+            if duplicate is not None:
+                # another capture of the same video was added while this one was in use
+                with duplicate.lock:
+                    duplicate.release()
+            self.idle_captures[pooled.filename] = pooled
+            self._evict(self.max_size)
+        self._sync_event.set()
+
+    def add(self, pooled, kept_filenames=()):
+        """
+        Add a capture opened outside of the pool (e.g. prefetched in the background) as the most recently used idle
+        capture, releasing least recently used idle captures to make room for it, except the ones of kept_filenames
+        (e.g. the other videos predicted by the prefetcher). Return True if it was added, False if it was released
+        instead because the pool already has an idle capture of the same video, or no room could be made for it.
+
+        """
+        with self._lock:
+            if pooled.filename in self.idle_captures:
+                pooled.release()
+                return False
+            evictable_filenames = [filename for filename in self.idle_captures if filename not in kept_filenames]
+            while self._exceeds_budget(len(self.idle_captures) + 1, pooled.memory_size) and evictable_filenames:
+                evicted = self.idle_captures.pop(evictable_filenames.pop(0))
+                with evicted.lock:
+                    evicted.release()
+            if self._exceeds_budget(len(self.idle_captures) + 1, pooled.memory_size):
+                pooled.release()
+                return False
+            self.idle_captures[pooled.filename] = pooled
+        self._sync_event.set()
+        return True
+
+    def contains(self, filename):
+        """
+        Return True if the pool has an idle capture of the video file (safe to call while the sync thread runs)
+
+        """
+        with self._lock:
+            return filename in self.idle_captures
+
+    def get_idle_capacity(self):
+        """
+        Return the maximum number of idle captures the pool can keep besides the captures in use
+
+        """
+        with self._lock:
+            return max(self.max_size - self.in_use_count, 0)
+
+    def sync(self, frame_counter):
+        """
+        Tell the index of the next frame of the active video, so that the sync thread decodes idle captures up to it.
+        Call it on the render thread each time the active video advances, it does not decode anything.
+
+        """
+        with self._lock:
+            self.frame_counter = frame_counter
+        self._sync_event.set()
+
+    def close(self):
+        """
+        Stop syncing and release all idle captures
+
+        """
+        self.stop()
+        with self._lock:
+            for pooled in self.idle_captures.itervalues():
+                pooled.release()
+            self.idle_captures.clear()
+
+    def _sync_loop(self):
+        if self.cpu_cores:
+            pin_current_thread(self.cpu_cores)
+        while not self._stop_event.is_set():
+            self._sync_event.wait(0.05)
+            self._sync_event.clear()
+            with self._lock:
+                captures = list(self.idle_captures.itervalues())
+            for pooled in captures:
+                # decode one frame at a time, so that acquire() never waits for more than one frame
+                while not self._stop_event.is_set():
+                    with self._lock:
+                        if self.idle_captures.get(pooled.filename) is not pooled or \
+                                not pooled.is_behind(self.frame_counter):
+                            break
+                        pooled.lock.acquire()
+                    try:
+                        pooled.grab()
+                    finally:
+                        pooled.lock.release()
+
+    def _exceeds_budget(self, idle_count, extra_memory_size=0):
+        """
+        Return True if the given number of idle captures with an extra estimated memory (e.g. of a new capture) would
+        exceed the size or the memory budget of the pool
+
+        """
+        if idle_count + self.in_use_count > self.max_size:
+            return True
+        if self.max_memory_size is None:
+            return False
+        memory_size = self.in_use_memory_size + extra_memory_size + \
+            sum(pooled.memory_size for pooled in self.idle_captures.itervalues())
+        return memory_size > self.max_memory_size
+
+    def _open(self, filename):
+        start_time = get_time()
+        capture = self.capture_factory(filename)
+        record_duration('open', (get_time() - start_time) * 1000)
+        if not capture.isOpened():
+            print 'Could not open video file {} for capture pool'.format(filename)
+            return None
+        return PooledCapture(filename, capture)
+
+    def _evict(self, max_total_size):
+        """
+        Release least recently used idle captures until the total number of captures is at most max_total_size and
+        their estimated memory is within the budget. Call it with the lock held.
+
+        """
+        while self.idle_captures and (len(self.idle_captures) + self.in_use_count > max_total_size or
+                                      self._exceeds_budget(len(self.idle_captures))):
+            _, pooled = self.idle_captures.popitem(last=False)
+            with pooled.lock:
+                pooled.release()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers shared by the tests: a test case generating a short clip in a temporary directory, and a counter of the
+allocations made with NumPy.
+
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from benchmark import generate_clips
+
+# format of the generated clip
+CLIP_SIZE = (160, 120)
+CLIP_FRAME_COUNT = 30
+CLIP_FPS = 25
+
+# NumPy functions allocating arrays, counted by AllocationCounter
+ALLOCATING_FUNCTION_NAMES = ['empty', 'zeros', 'ones', 'full', 'empty_like', 'zeros_like', 'ones_like', 'full_like']
+
+
+class ClipTestCase(unittest.TestCase):
+    """
+    Test case generating a clip of CLIP_FRAME_COUNT frames of CLIP_SIZE at CLIP_FPS once for all its tests
+
+    Attributes:
+        video_directory     [string] temporary directory of the clip, removed after the tests
+        video_path          [string] path to the clip
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.video_directory = tempfile.mkdtemp(prefix='test_{}_'.format(cls.__name__))
+        generate_clips(['clip.mp4'], cls.video_directory, CLIP_SIZE, CLIP_FRAME_COUNT, CLIP_FPS)
+        cls.video_path = os.path.join(cls.video_directory, 'clip.mp4')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.video_directory)
+
+
+class AllocationCounter(object):
+    """
+    Counter of the calls to the allocating functions of NumPy, from any thread, while installed
+
+    Attributes:
+        count       [int] number of calls since installed
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._original_functions = {}
+
+    def install(self):
+        for name in ALLOCATING_FUNCTION_NAMES:
+            original_function = getattr(np, name)
+            self._original_functions[name] = original_function
+            setattr(np, name, self._wrap(original_function))
+
+    def uninstall(self):
+        for name, original_function in self._original_functions.iteritems():
+            setattr(np, name, original_function)
+        self._original_functions.clear()
+
+    def _wrap(self, original_function):
+        def counting_function(*args, **kwargs):
+            self.count += 1
+            return original_function(*args, **kwargs)
+        return counting_function
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+import cv2
+import numpy as np
+
+from background_log import log
+from display import WindowDisplay
+from metrics import record_duration
+from path import get_video_path
+from presentation_clock import get_time
+
+
+class CompositorCell(object):
+    """
+    Cell of the compositor grid, playing one looping clip into its region of the canvas
+
+    Attributes:
+        filename        [string] path to the clip file, None if the cell is empty (black)
+        capture         [VideoCapture or PyAVCapture] video capture of the clip
+        pooled_capture  [PooledCapture] capture acquired from the compositor's pool, None if not using the pool
+        frame           [ndarray] decoding buffer, reused by OpenCV as long as the clip size does not change
+        resized_frame   [ndarray] buffer of cell size, used only if the clip size differs from the cell size
+        frame_counter   [int] index of the next frame of the clip to play
+        frame_count     [int] total number of frames in the clip
+    """
+
+    def __init__(self, capture):
+        self.filename = None
+        self.capture = capture
+        self.pooled_capture = None
+        self.frame = None
+        self.resized_frame = None
+        self.frame_counter = 0
+        self.frame_count = 0
+
+    @property
+    def is_open(self):
+        return self.capture.isOpened()
+
+
+class Compositor(object):
+    """
+    Video player that renders a grid of cells live, each cell playing its own looping clip, into a single window.
+    Clips are decoded and copied into their region of one preallocated canvas, so no frame is allocated while playing.
+
+    All clips should have the same duration, so that cells stay synchronized when a clip is replaced.
+    Clips with a different size than the cell size are resized.
+
+    Attributes:
+        window_name     [string] name of the OpenCV window to show the canvas in
+        display         [WindowDisplay or NullDisplay] where the canvas is shown, the window of window_name by default
+        grid_shape      [(int, int)] number of rows and columns of the grid
+        cell_size       [(int, int)] width and height of a cell in pixels, None to use the size of the first clip opened
+        capture_pool    [CapturePool] optional pool of open captures used to switch clips, None to open files directly
+        capture_factory [function] function creating an empty video capture of the decoding backend, cv2.VideoCapture
+                        by default (see decode_backend.py)
+        cells           [dict((int, int), CompositorCell)] cells per (row, column)
+        canvas          [ndarray] preallocated frame of the whole grid, None until the cell size is known
+        frame_counter   [int] number of frames played since the first clip was opened, used to synchronize new clips
+    """
+
+    def __init__(self, window_name, grid_shape=(3, 3), cell_size=None, capture_pool=None, display=None,
+                 capture_factory=cv2.VideoCapture):
+        self.window_name = window_name
+        self.display = display if display is not None else WindowDisplay(window_name)
+        self.grid_shape = grid_shape
+        self.cell_size = cell_size
+        self.capture_pool = capture_pool
+        self.capture_factory = capture_factory
+        self.cells = {(row, column): CompositorCell(capture_factory())
+                      for row in xrange(grid_shape[0]) for column in xrange(grid_shape[1])}
+        self.canvas = None
+        self.frame_counter = 0
+        if cell_size is not None:
+            self.allocate_canvas(cell_size)
+
+    @property
+    def is_open(self):
+        return any(cell.is_open for cell in self.cells.itervalues())
+
+    @property
+    def fps(self):
+        """Frame rate of the clips, taken from the first open cell, 0 if unknown or no clip is open"""
+        for cell in self.cells.itervalues():
+            if cell.is_open:
+                return cell.capture.get(cv2.CAP_PROP_FPS)
+        return 0
+
+    def allocate_canvas(self, cell_size):
+        """
+        Allocate the canvas for the given cell size, in black
+
+        """
+        width, height = cell_size
+        self.cell_size = cell_size
+        self.canvas = np.zeros((self.grid_shape[0] * height, self.grid_shape[1] * width, 3), np.uint8)
+
+    def get_cell_view(self, row, column):
+        """
+        Return the region of the canvas of the given cell, as a view that can be written in place
+
+        """
+        width, height = self.cell_size
+        return self.canvas[row * height:(row + 1) * height, column * width:(column + 1) * width]
+
+    def set_cell_clip(self, row, column, filename):
+        """
+        Play clip in cell at the current frame of the grid, or clear the cell if filename is None.
+        Do nothing if the cell is already playing this clip.
+
+        """
+        cell = self.cells[(row, column)]
+        if filename is not None:
+            filename = get_video_path(filename)
+        if filename == cell.filename and (filename is None or cell.is_open):
+            return
+
+        self.release_cell(cell)
+
+        if filename is None:
+            if self.canvas is not None:
+                self.get_cell_view(row, column)[:] = 0
+            return
+
+        log('Open clip file {} in cell {}'.format(filename, (row, column)))
+        if self.capture_pool is not None:
+            cell.pooled_capture = self.capture_pool.acquire(filename, self.frame_counter)
+            if cell.pooled_capture is None:
+                log('Could not open clip file')
+                return
+            cell.capture = cell.pooled_capture.capture
+            cell.frame_count = cell.pooled_capture.frame_count
+            cell.frame_counter = cell.pooled_capture.frame_counter
+        else:
+            start_time = get_time()
+            success = cell.capture.open(filename)
+            record_duration('open', (get_time() - start_time) * 1000)
+            if not success:
+                log('Could not open clip file')
+                return
+            cell.frame_count = int(cell.capture.get(cv2.CAP_PROP_FRAME_COUNT))
+            # warp at same time as the other cells
+            cell.frame_counter = self.frame_counter % cell.frame_count if cell.frame_count else 0
+            cell.capture.set(cv2.CAP_PROP_POS_FRAMES, cell.frame_counter)
+        cell.filename = filename
+
+        if self.canvas is None:
+            self.allocate_canvas((int(cell.capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                                  int(cell.capture.get(cv2.CAP_PROP_FRAME_HEIGHT))))
+
+    def release_cell(self, cell):
+        """
+        Close the clip of a cell, giving back its capture to the pool if any
+
+        """
+        if cell.pooled_capture is not None:
+            self.capture_pool.release(cell.pooled_capture, cell.frame_counter)
+            cell.pooled_capture = None
+            cell.capture = self.capture_factory()
+        elif cell.is_open:
+            cell.capture.release()
+        cell.filename = None
+
+    def close(self):
+        """
+        Close all clips and show a black canvas
+
+        """
+        for cell in self.cells.itervalues():
+            self.release_cell(cell)
+        if self.canvas is not None:
+            self.canvas[:] = 0
+            self.display.show(self.canvas)
+        self.frame_counter = 0
+
+    def update(self):
+        if self.is_open:
+            self.play_next_frame()
+            if self.capture_pool is not None:
+                # keep idle captures at the same frame as the cells
+                self.capture_pool.sync(self.frame_counter)
+
+    def skip_frames(self, frame_count):
+        """
+        Advance all cells by frame_count frames without showing them, to catch up when presentation is late
+
+        """
+        for _ in xrange(frame_count):
+            if not self.is_open:
+                return
+            self.play_next_frame(show=False)
+        if self.capture_pool is not None:
+            self.capture_pool.sync(self.frame_counter)
+
+    def play_next_frame(self, show=True):
+        """
+        Decode next frame of each cell into the canvas, and show the canvas
+        If show is False, only advance each cell to its next frame
+
+        """
+        width, height = self.cell_size
+        for (row, column), cell in self.cells.iteritems():
+            if not cell.is_open:
+                continue
+
+            if not show:
+                cell.capture.grab()
+            else:
+                ret, cell.frame = cell.capture.read(cell.frame)
+            if show and ret:
+                if cell.frame.shape[:2] != (height, width):
+                    if cell.resized_frame is None:
+                        cell.resized_frame = np.empty((height, width, 3), np.uint8)
+                    cv2.resize(cell.frame, (width, height), cell.resized_frame, interpolation=cv2.INTER_AREA)
+                    np.copyto(self.get_cell_view(row, column), cell.resized_frame)
+                else:
+                    np.copyto(self.get_cell_view(row, column), cell.frame)
+
+            cell.frame_counter += 1
+            if cell.frame_counter >= cell.frame_count:
+                cell.frame_counter = 0
+                cell.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+        if show:
+            self.display.show(self.canvas)
+        self.frame_counter += 1
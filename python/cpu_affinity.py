@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import ctypes
+import ctypes.util
+import multiprocessing
+import platform
+import sys
+
+# number of the gettid system call per machine architecture, on Linux
+# (Python 2 has no os.sched_setaffinity and no way to get the kernel ID of a thread)
+GETTID_SYSCALL_NUMBERS = {
+    'x86_64': 186,
+    'i386': 224,
+    'i686': 224,
+    'armv6l': 224,
+    'armv7l': 224,
+    'aarch64': 178,
+}
+
+# C library, loaded on first use
+_libc = None
+
+
+def pin_current_thread(cpu_cores):
+    """
+    Restrict the calling thread to the given CPU core indices, so that the kernel does not migrate it across cores.
+    Return True on success, False if pinning is not supported (only Linux on the architectures above) or failed.
+
+    """
+    global _libc
+    syscall_number = GETTID_SYSCALL_NUMBERS.get(platform.machine())
+    if not sys.platform.startswith('linux') or syscall_number is None:
+        return False
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+    mask = ctypes.c_ulong(0)
+    for cpu_core in cpu_cores:
+        mask.value |= 1 << cpu_core
+    thread_id = _libc.syscall(syscall_number)
+    if _libc.sched_setaffinity(thread_id, ctypes.sizeof(mask), ctypes.byref(mask)) != 0:
+        print 'Could not pin thread to CPU cores {}: error {}'.format(list(cpu_cores), ctypes.get_errno())
+        return False
+    return True
+
+
+def assign_cpu_cores(worker_count, cpu_count=None):
+    """
+    Return (render cores, list of cores per worker) sharing the CPU cores between one render thread and worker_count
+    workers (e.g. the decoding threads of each panel): core 0 is left to the render thread and the workers share the
+    other cores evenly, or all cores are shared if there is only one.
+
+    """
+    if cpu_count is None:
+        cpu_count = multiprocessing.cpu_count()
+    render_cores = [0]
+    worker_cores = range(1, cpu_count) if cpu_count > 1 else [0]
+    if worker_count <= len(worker_cores):
+        return render_cores, [worker_cores[worker_idx::worker_count] for worker_idx in xrange(worker_count)]
+    return render_cores, [[worker_cores[worker_idx % len(worker_cores)]] for worker_idx in xrange(worker_count)]
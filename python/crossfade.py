@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+import cv2
+
+from display import FrameSink, WindowDisplay
+from frame_buffers import FrameBuffers
+from metrics import record_duration
+from presentation_clock import get_time
+from video import Video
+
+
+def blend_frames(outgoing_frame, incoming_frame, weight, blend_frame):
+    """
+    Write the blend of two frames of the same size into blend_frame, in place, the incoming frame having the given
+    weight (0 to 1) and the outgoing frame the rest
+
+    """
+    cv2.addWeighted(outgoing_frame, 1 - weight, incoming_frame, weight, 0, blend_frame)
+
+
+class CrossfadeVideo(object):
+    """
+    Video player that crossfades from the current video to the next one when switching at the same frame, instead of
+    cutting. The outgoing video keeps playing while the incoming one warms up (until its first frame is decoded),
+    then both are blended over transition_frame_count frames into a preallocated buffer.
+
+    Outside of transitions, the active video shows its frames directly, so crossfading costs nothing. During a
+    transition, both videos show their frames into frame sinks, which are blended and shown.
+
+    Attributes:
+        window_name             [string] name of the OpenCV window to play the videos in
+        display                 [WindowDisplay or NullDisplay] where frames are shown, the window of window_name by
+                                default
+        transition_frame_count  [int] number of frames of a crossfade, the last one showing the incoming video only
+        videos                  [list(Video)] two videos sharing the display, alternately incoming and outgoing
+        active_video            [Video] video playing, or video fading in during a transition
+        outgoing_video          [Video] video fading out during a transition, None if there is no transition
+        transition_frame_index  [int] number of blended frames shown in the current transition
+        frame_buffers           [FrameBuffers] preallocated blending buffer per resolution
+        transition_count        [int] number of transitions started
+        cut_count               [int] number of transitions cut short (frames of different sizes, or late presentation)
+    """
+
+    def __init__(self, window_name, transition_frame_count=10, display=None, **video_kwargs):
+        """
+        video_kwargs are passed to both videos (see Video)
+
+        """
+        assert transition_frame_count > 0
+        self.window_name = window_name
+        self.display = display if display is not None else WindowDisplay(window_name)
+        self.transition_frame_count = transition_frame_count
+        self.videos = [Video(window_name, display=self.display, **video_kwargs) for _ in xrange(2)]
+        self.active_video = self.videos[0]
+        self.outgoing_video = None
+        self.transition_frame_index = 0
+        self.frame_buffers = FrameBuffers()
+        self.transition_count = 0
+        self.cut_count = 0
+        self._outgoing_sink = FrameSink()
+        self._incoming_sink = FrameSink()
+
+    @property
+    def is_open(self):
+        return self.active_video.is_open
+
+    @property
+    def fps(self):
+        """Frame rate of the active video, 0 if unknown or no video is open"""
+        return self.active_video.fps
+
+    @property
+    def frame_counter(self):
+        """Next frame index to play of the active video"""
+        return self.active_video.frame_counter
+
+    @property
+    def frame_reader(self):
+        """Background decoder of the active video in threaded mode, None else"""
+        return self.active_video.frame_reader
+
+    def open(self, filename, looping=False):
+        """
+        Open video at the beginning, without transition
+
+        """
+        self.end_transition()
+        self.active_video.open(filename, looping)
+
+    def open_same_frame(self, filename, looping=False):
+        """
+        Open video at same frame as the current video and crossfade to it, or open it directly if no video is open.
+        Switching again during a transition ends it, the video fading in becoming the outgoing video.
+
+        """
+        if not self.active_video.is_open:
+            self.end_transition()
+            self.active_video.open_same_frame(filename, looping)
+            return
+
+        self.end_transition()
+        incoming_video = self.videos[1] if self.active_video is self.videos[0] else self.videos[0]
+        incoming_video.open_same_frame(filename, looping, self.active_video.frame_counter)
+        if not incoming_video.is_open:
+            # keep playing the current video
+            return
+
+        self.outgoing_video = self.active_video
+        self.active_video = incoming_video
+        self._outgoing_sink.reset()
+        self._incoming_sink.reset()
+        self.outgoing_video.display = self._outgoing_sink
+        self.active_video.display = self._incoming_sink
+        self.transition_frame_index = 0
+        self.transition_count += 1
+
+    def end_transition(self):
+        """
+        Stop the current transition if any, closing the outgoing video and showing the active video directly
+
+        """
+        if self.outgoing_video is None:
+            return
+        self.outgoing_video.close(clear=False)
+        self.outgoing_video.display = self.display
+        self.outgoing_video = None
+        self.active_video.display = self.display
+
+    def close(self):
+        """
+        Close video and show blank image
+
+        """
+        self.end_transition()
+        self.active_video.close()
+
+    def update(self):
+        if self.outgoing_video is None:
+            self.active_video.update()
+            return
+
+        # the idle captures of the pool are synced once per frame, with the active video
+        self.outgoing_video.update(sync_pool=False)
+        self.active_video.update()
+        self.show_transition_frame()
+
+    def skip_frames(self, frame_count):
+        """
+        Advance video by frame_count frames without showing them, to catch up when presentation is late
+        A transition in progress is cut, since blending costs more than showing a single video
+
+        """
+        if self.outgoing_video is not None:
+            self.cut_count += 1
+            self.end_transition()
+        self.active_video.skip_frames(frame_count)
+
+    def show_transition_frame(self):
+        """
+        Show the outgoing frame while the incoming video warms up, then the blend of the outgoing and incoming frames
+
+        """
+        outgoing_frame = self._outgoing_sink.frame
+        incoming_frame = self._incoming_sink.frame
+        if incoming_frame is None or outgoing_frame is None:
+            # the incoming video is warming up, keep the outgoing video playing
+            # (if the first outgoing frame is late instead, keep showing the last frame)
+            if outgoing_frame is not None:
+                self.display.show(outgoing_frame)
+            return
+
+        self.transition_frame_index += 1
+        if self.transition_frame_index >= self.transition_frame_count or outgoing_frame.shape != incoming_frame.shape:
+            if self.transition_frame_index < self.transition_frame_count:
+                # cannot blend frames of different sizes
+                self.cut_count += 1
+            self.end_transition()
+            self.display.show(incoming_frame)
+            return
+
+        start_time = get_time()
+        height, width = incoming_frame.shape[:2]
+        blend_frame = self.frame_buffers.get_scratch_buffer('blend', height, width)
+        weight = float(self.transition_frame_index) / self.transition_frame_count
+        blend_frames(outgoing_frame, incoming_frame, weight, blend_frame)
+        record_duration('blend', (get_time() - start_time) * 1000)
+        self.display.show(blend_frame)
+
+    def show_blank(self):
+        self.active_video.show_blank()
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+import cv2
+import numpy as np
+
+from frame_buffers import get_fitting_size
+from frame_cache import get_frame_cache_path, is_frame_cache_up_to_date, open_frame_cache
+from presentation_clock import get_time
+
+try:
+    import av
+except ImportError:
+    # PyAV is optional, the OpenCV backend is used without it
+    av = None
+
+# backends decoding the videos, see get_capture_factory
+OPENCV_BACKEND = 'opencv'
+PYAV_BACKEND = 'pyav'
+# frames decoded once into a raw frame cache on disk (see frame_cache.py), played by Video without capture
+FRAME_CACHE_BACKEND = 'frame_cache'
+# choose the fastest available backend with a probe at startup (see select_decode_backend)
+AUTO_BACKEND = 'auto'
+
+
+class PyAVCapture(object):
+    """
+    Video capture decoding with PyAV (FFmpeg) with threaded decoding, exposing the subset of the OpenCV VideoCapture
+    interface used by the application, so that it can replace a VideoCapture anywhere
+
+    Frames are converted to BGR into the buffer passed to read(), so that callers reusing their buffers (e.g. the
+    ring of FrameReader) keep them. Like VideoCapture, a new array is returned instead if the buffer is missing or its
+    size does not match. PyAV cannot convert into an existing buffer, so YUV 4:2:0 frames (the usual pixel format of
+    MP4 videos) are copied into a reused I420 buffer through views of their planes, then converted by OpenCV into the
+    buffer, without any allocation.
+    Frames bigger than max_frame_size are downscaled by FFmpeg during the conversion to BGR instead, so they are never
+    copied at full size, and the capture reports the downscaled size as its frame size. This conversion, also used for
+    other pixel formats, allocates a new frame in FFmpeg at each read, whose plane is then copied into the buffer.
+
+    Attributes:
+        max_frame_size  [(int, int)] maximum (width, height) of the frames returned, None to keep the video size
+        filename        [string] path to the video file, empty if no video is open
+        container       [InputContainer] PyAV container of the video, None if no video is open
+        stream          [VideoStream] first video stream of the container
+        fps             [float] frame rate of the video, 0 if unknown
+        frame_count     [int] total number of frames in the video, estimated from its duration if not stored
+        frame_counter   [int] index of the next frame read() or grab() will return
+        frame_size      [(int, int)] (width, height) of the frames returned
+    """
+
+    def __init__(self, filename='', max_frame_size=None):
+        self.max_frame_size = max_frame_size
+        self.filename = ''
+        self.container = None
+        self.stream = None
+        self.fps = 0.
+        self.frame_count = 0
+        self.frame_counter = 0
+        self.frame_size = (0, 0)
+        # generator of the decoded frames of the stream, restarted on each seek
+        self._frames = None
+        # frame decoded while seeking, to be returned by the next read or grab
+        self._pending_frame = None
+        # I420 buffer the planes of YUV 4:2:0 frames are copied into, and views of its (Y, U, V) planes
+        self._i420_buffer = None
+        self._i420_planes = None
+        if filename:
+            self.open(filename)
+
+    def open(self, filename):
+        """
+        Open video file, releasing the previous one if any. Return True on success.
+
+        """
+        self.release()
+        try:
+            container = av.open(filename)
+        except (av.AVError, EnvironmentError):
+            return False
+        if not container.streams.video:
+            container.close()
+            return False
+
+        self.filename = filename
+        self.container = container
+        self.stream = container.streams.video[0]
+        # decode several frames in parallel (frame and slice threading), as the FFmpeg command line does
+        self.stream.thread_type = 'AUTO'
+        self.fps = float(self.stream.average_rate) if self.stream.average_rate else 0.
+        self.frame_count = self.stream.frames
+        if not self.frame_count and self.stream.duration is not None and self.fps:
+            self.frame_count = int(round(self.stream.duration * self.stream.time_base * self.fps))
+        self.frame_counter = 0
+        self.frame_size = get_fitting_size((self.stream.codec_context.width, self.stream.codec_context.height),
+                                           self.max_frame_size)
+        self._frames = container.decode(self.stream)
+        self._pending_frame = None
+        return True
+
+    def isOpened(self):
+        return self.container is not None
+
+    def release(self):
+        if self.container is not None:
+            self.container.close()
+            self.container = None
+            self.stream = None
+            self._frames = None
+            self._pending_frame = None
+            self.filename = ''
+            self.frame_size = (0, 0)
+
+    def read(self, frame=None):
+        """
+        Decode next frame and return (True, BGR frame), or (False, frame) at the end of the video
+
+        """
+        av_frame = self._next_frame()
+        if av_frame is None:
+            return False, frame
+        self.frame_counter += 1
+        width, height = self.frame_size
+        if frame is None or frame.shape != (height, width, 3):
+            frame = np.empty((height, width, 3), np.uint8)
+        if (av_frame.width, av_frame.height) == self.frame_size and av_frame.format.name == 'yuv420p' \
+                and width % 2 == 0 and height % 2 == 0:
+            self._convert_i420_frame(av_frame, frame)
+        else:
+            # convert and downscale in one pass
+            self._convert_frame(av_frame.reformat(width, height, 'bgr24'), frame)
+        return True, frame
+
+    def grab(self):
+        """
+        Decode next frame without converting it. Return False at the end of the video.
+
+        """
+        if self._next_frame() is None:
+            return False
+        self.frame_counter += 1
+        return True
+
+    def get(self, property_id):
+        if property_id == cv2.CAP_PROP_FPS:
+            return self.fps
+        if property_id == cv2.CAP_PROP_FRAME_COUNT:
+            return self.frame_count
+        if property_id == cv2.CAP_PROP_POS_FRAMES:
+            return self.frame_counter
+        if property_id == cv2.CAP_PROP_FRAME_WIDTH:
+            return self.frame_size[0]
+        if property_id == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self.frame_size[1]
+        return 0
+
+    def set(self, property_id, value):
+        """
+        Only support seeking with CAP_PROP_POS_FRAMES. Return True on success.
+
+        """
+        if property_id != cv2.CAP_PROP_POS_FRAMES or self.container is None:
+            return False
+        self._seek(int(value))
+        return True
+
+    def _convert_i420_frame(self, av_frame, frame):
+        """
+        Convert a YUV 4:2:0 frame of the frame size to BGR into frame, through the I420 buffer
+
+        """
+        width, height = self.frame_size
+        if self._i420_buffer is None or self._i420_buffer.shape != (height * 3 // 2, width):
+            self._i420_buffer = np.empty((height * 3 // 2, width), np.uint8)
+            pixels = self._i420_buffer.reshape(-1)
+            luma_size = width * height
+            chroma_size = luma_size // 4
+            self._i420_planes = (pixels[:luma_size].reshape(height, width),
+                                 pixels[luma_size:luma_size + chroma_size].reshape(height // 2, width // 2),
+                                 pixels[luma_size + chroma_size:].reshape(height // 2, width // 2))
+        for plane, i420_plane in zip(av_frame.planes, self._i420_planes):
+            copy_plane(plane, i420_plane)
+        cv2.cvtColor(self._i420_buffer, cv2.COLOR_YUV2BGR_I420, frame)
+
+    def _convert_frame(self, bgr_av_frame, frame):
+        """
+        Copy a BGR frame converted by FFmpeg into frame
+
+        """
+        copy_plane(bgr_av_frame.planes[0], frame.reshape(frame.shape[0], -1))
+
+    def _next_frame(self):
+        if self._pending_frame is not None:
+            av_frame = self._pending_frame
+            self._pending_frame = None
+            return av_frame
+        if self._frames is None:
+            return None
+        try:
+            return next(self._frames, None)
+        except av.AVError:
+            return None
+
+    def _seek(self, frame_idx):
+        """
+        Seek to the keyframe before the frame, then decode forward to the frame so that seeking is frame-accurate
+
+        """
+        time_base = self.stream.time_base
+        start_pts = self.stream.start_time or 0
+        target_pts = start_pts + (int(round(frame_idx / self.fps / time_base)) if self.fps else 0)
+        self.container.seek(target_pts, backward=True, any_frame=False, stream=self.stream)
+        self._frames = self.container.decode(self.stream)
+        self._pending_frame = None
+        # tolerate timestamps rounded to the time base
+        half_frame_pts = 0.5 / self.fps / time_base if self.fps else 0
+        try:
+            for av_frame in self._frames:
+                if av_frame.pts is None or av_frame.pts >= target_pts - half_frame_pts:
+                    self._pending_frame = av_frame
+                    break
+        except av.AVError:
+            pass
+        self.frame_counter = frame_idx
+
+
+def copy_plane(plane, destination):
+    """
+    Copy the pixels of a PyAV frame plane into a 2D array of bytes, through a view of the plane whose rows may be
+    padded, so that the plane is not copied into an intermediate array
+
+    """
+    height, row_size = destination.shape
+    rows = np.frombuffer(plane, np.uint8, count=plane.line_size * height).reshape(height, plane.line_size)
+    np.copyto(destination, rows[:, :row_size])
+
+
+def get_available_backends():
+    """
+    Return list of the backends that can decode videos in this environment, OpenCV first
+
+    """
+    backends = [OPENCV_BACKEND]
+    if av is not None:
+        backends.append(PYAV_BACKEND)
+    return backends
+
+
+def get_capture_factory(backend, max_frame_size=None):
+    """
+    Return the function creating a video capture for the given decoding backend, called with an optional filename
+    (the frame cache backend does not use captures, its videos are decoded with OpenCV when building the caches).
+    If the backend can decode at reduced size, its captures return frames fitting in max_frame_size.
+
+    """
+    if backend == PYAV_BACKEND:
+        assert av is not None, 'PyAV is not installed, cannot use the PyAV decoding backend'
+        return lambda filename='': PyAVCapture(filename, max_frame_size)
+    # OpenCV always decodes at the video size, frames are downscaled by Video
+    return cv2.VideoCapture
+
+
+def measure_decode_throughput(backend, video_path, frame_count=50):
+    """
+    Return the number of frames per second the backend can decode (or read from the frame cache) from the start
+    of the video, None if it cannot play the video at all
+
+    """
+    if backend == FRAME_CACHE_BACKEND:
+        frame_cache = open_frame_cache(get_frame_cache_path(video_path))
+        if frame_cache is None:
+            return None
+        # reading from the cache is a copy of the frame when it is shown, copy them into a buffer to compare
+        frame = np.empty(frame_cache.frames.shape[1:], np.uint8)
+        frame_count = min(frame_count, frame_cache.frame_count)
+        start_time = get_time()
+        for frame_idx in xrange(frame_count):
+            np.copyto(frame, frame_cache.frames[frame_idx])
+    else:
+        capture = get_capture_factory(backend)(video_path)
+        if not capture.isOpened():
+            return None
+        # the first frame includes decoder initialization, which happens once per video and not per frame
+        ret, frame = capture.read()
+        if not ret:
+            capture.release()
+            return None
+        start_time = get_time()
+        decoded_frame_count = 0
+        while decoded_frame_count < frame_count:
+            ret, frame = capture.read(frame)
+            if not ret:
+                break
+            decoded_frame_count += 1
+        capture.release()
+        frame_count = decoded_frame_count
+
+    duration = get_time() - start_time
+    if frame_count == 0:
+        return None
+    return frame_count / max(duration, 1e-6)
+
+
+def select_decode_backend(video_path, frame_count=50, use_frame_cache=True):
+    """
+    Return the backend decoding the video with the highest throughput, measuring each available backend on its
+    first frames. The frame cache is only a candidate if use_frame_cache is True and the cache of the video is already
+    built (see 'python main.py --warm-up'), since building it takes a long time and a lot of disk space.
+    Return the OpenCV backend if the video cannot be decoded.
+
+    """
+    backends = get_available_backends()
+    if use_frame_cache and is_frame_cache_up_to_date(video_path, get_frame_cache_path(video_path)):
+        backends.append(FRAME_CACHE_BACKEND)
+
+    best_backend = OPENCV_BACKEND
+    best_throughput = 0
+    for backend in backends:
+        throughput = measure_decode_throughput(backend, video_path, frame_count)
+        if throughput is None:
+            print 'Decoding backend {}: cannot play video file {}'.format(backend, video_path)
+            continue
+        print 'Decoding backend {}: {:.0f} frames/s'.format(backend, throughput)
+        if throughput > best_throughput:
+            best_backend = backend
+            best_throughput = throughput
+    return best_backend
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+import time
+
+import cv2
+import numpy as np
+
+from metrics import record_duration
+from presentation_clock import get_time
+
+try:
+    import Tkinter
+except ImportError:
+    # Tkinter is optional, the screen size must then be given to the display
+    Tkinter = None
+
+
+def get_screen_size():
+    """
+    Return (width, height) of the primary screen in pixels, None if it cannot be found (no Tkinter or no screen)
+
+    """
+    if Tkinter is None:
+        return None
+    try:
+        root = Tkinter.Tk()
+    except Tkinter.TclError:
+        return None
+    root.withdraw()
+    size = root.winfo_screenwidth(), root.winfo_screenheight()
+    root.destroy()
+    return size
+
+
+class WindowDisplay(object):
+    """
+    OpenCV window where video frames are shown
+
+    Attributes:
+        window_name     [string] name of the OpenCV window
+        fullscreen      [bool] should the window be fullscreen when opened?
+        size            [(int, int)] (width, height) of the screen the window is shown on, None to find it on first use
+    """
+
+    def __init__(self, window_name, fullscreen=False, size=None):
+        self.window_name = window_name
+        self.fullscreen = fullscreen
+        self.size = size
+
+    def get_size(self):
+        """
+        Return (width, height) of the screen, None if unknown
+
+        """
+        if self.size is None:
+            self.size = get_screen_size()
+        return self.size
+
+    def open(self):
+        print 'Open fullscreen window'
+        cv2.namedWindow(self.window_name, cv2.WINDOW_NORMAL)
+        cv2.setWindowProperty(self.window_name, cv2.WND_PROP_FULLSCREEN,
+                              cv2.WINDOW_FULLSCREEN if self.fullscreen else cv2.WINDOW_NORMAL)
+
+    def show(self, frame):
+        start_time = get_time()
+        cv2.imshow(self.window_name, frame)
+        record_duration('imshow', (get_time() - start_time) * 1000)
+
+    def wait_key(self, delay_ms):
+        """
+        Wait for a keypress for delay_ms, and let OpenCV display its GUI. Return keycode, -1 if no key was pressed.
+
+        """
+        return cv2.waitKey(delay_ms)
+
+    def toggle_fullscreen(self):
+        # may not work at times, do not overdo it
+        old_fullscreen_mode = cv2.getWindowProperty(self.window_name, cv2.WND_PROP_FULLSCREEN)
+        new_fullscreen_mode = cv2.WINDOW_FULLSCREEN if old_fullscreen_mode == cv2.WINDOW_NORMAL else cv2.WINDOW_NORMAL
+        print 'Switching fullscreen mode from {} to {}'.format(old_fullscreen_mode, new_fullscreen_mode)
+        cv2.setWindowProperty(self.window_name, cv2.WND_PROP_FULLSCREEN, new_fullscreen_mode)
+
+
+class NullDisplay(object):
+    """
+    Display sink that discards frames, to run the application headless (benchmarks, servers without monitor)
+
+    Attributes:
+        realtime        [bool] should wait_key sleep for the requested delay, so that playback runs in real time?
+        frame_count     [int] number of frames shown
+        last_show_time  [float] wall-clock time of the last frame shown, in s, None if no frame was shown
+        frame_shape     [tuple(int)] shape of the last frame shown, None if no frame was shown
+        size            [(int, int)] (width, height) of the simulated screen, None to show frames at any size
+    """
+
+    def __init__(self, realtime=True, size=None):
+        self.realtime = realtime
+        self.size = size
+        self.frame_count = 0
+        self.last_show_time = None
+        self.frame_shape = None
+
+    def open(self):
+        pass
+
+    def get_size(self):
+        return self.size
+
+    def show(self, frame):
+        self.frame_count += 1
+        self.last_show_time = time.time()
+        self.frame_shape = frame.shape
+
+    def wait_key(self, delay_ms):
+        if self.realtime:
+            time.sleep(delay_ms / 1000.)
+        return -1
+
+    def toggle_fullscreen(self):
+        pass
+
+
+class VideoFileDisplay(object):
+    """
+    Display sink that writes the frames shown to a video file, one video frame per frame presented, to render the
+    application offline (see replay.py). The video has the size of the first frame shown, later frames of another
+    size being resized to it.
+
+    Attributes:
+        output_path     [string] path of the video file to write, overwritten on the first frame shown
+        get_fps         [function] function returning the frame rate of the video file, called when the first frame is
+                        shown (e.g. the frame rate the application presents the first video at)
+        size            [(int, int)] (width, height) of the simulated screen, None to show frames at any size
+        frame_count     [int] number of frames written
+        last_show_time  [float] wall-clock time of the last frame shown, in s, None if no frame was shown
+    """
+
+    def __init__(self, output_path, get_fps, size=None, fourcc='mp4v'):
+        self.output_path = output_path
+        self.get_fps = get_fps
+        self.size = size
+        self.frame_count = 0
+        self.last_show_time = None
+        self._fourcc = cv2.VideoWriter_fourcc(*fourcc)
+        self._writer = None
+        self._frame_size = None
+
+    def open(self):
+        pass
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.release()
+            self._writer = None
+
+    def get_size(self):
+        return self.size
+
+    def show(self, frame):
+        height, width = frame.shape[:2]
+        if self._writer is None:
+            self._frame_size = (width, height)
+            self._writer = cv2.VideoWriter(self.output_path, self._fourcc, self.get_fps(), self._frame_size)
+        if (width, height) != self._frame_size:
+            frame = cv2.resize(frame, self._frame_size)
+        start_time = get_time()
+        self._writer.write(frame)
+        record_duration('write', (get_time() - start_time) * 1000)
+        self.frame_count += 1
+        self.last_show_time = time.time()
+
+    def wait_key(self, delay_ms):
+        return -1
+
+    def toggle_fullscreen(self):
+        pass
+
+
+class FrameSink(object):
+    """
+    Display that keeps a copy of the last frame shown instead of showing it, so that it can be composed with other
+    frames (e.g. blended during a crossfade). The copy is made into a buffer reused as long as the frame size does
+    not change, since the frame shown may be recycled by its video right after.
+
+    Attributes:
+        frame           [ndarray] copy of the last frame shown, None if no frame was shown since the last reset
+    """
+
+    def __init__(self):
+        self.frame = None
+        self._buffer = None
+
+    def show(self, frame):
+        if self._buffer is None or self._buffer.shape != frame.shape:
+            self._buffer = np.empty(frame.shape, np.uint8)
+        np.copyto(self._buffer, frame)
+        self.frame = self._buffer
+
+    def reset(self):
+        self.frame = None
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+import datetime
+import time
+
+from presentation_clock import get_time
+from serial_reader import format_sensor_line, parse_sensor_line
+
+
+class EventRecorder(object):
+    """
+    Recorder of the sensor events received by the application (from the serial port or simulated with debug keys)
+    into an event log, to reproduce a session offline (see replay.py).
+
+    An event log has one sensor message per line, in the text format of the serial port, preceded by the time it was
+    received in s since the start, e.g.
+        0.512 UID Value: 0xB4 0xE2 0xE7 0x53
+        1.208 Photo: 2
+    Empty lines and lines starting with '#' are ignored, so event logs are also benchmark traces (see benchmark.py).
+
+    Attributes:
+        log_path        [string] path of the event log file, overwritten on start
+        start_time      [float] time of the start of the recording, in s
+    """
+
+    def __init__(self, log_path):
+        self.log_path = log_path
+        self.start_time = 0.
+        self._log_file = None
+
+    def start(self, start_time):
+        self.start_time = start_time
+        self._log_file = open(self.log_path, 'w')
+        self._log_file.write('# Sensor events recorded on {:%Y-%m-%d %H:%M:%S}\n'.format(datetime.datetime.now()))
+
+    def stop(self):
+        if self._log_file is None:
+            return
+        self._log_file.close()
+        self._log_file = None
+
+    def record(self, event, event_time):
+        """
+        Write a sensor event received at the given time, in s. The log is flushed at each event, which is rare
+        compared to frames, so that events are not lost if the application crashes.
+
+        """
+        if self._log_file is None:
+            return
+        self._log_file.write('{:.3f} {}\n'.format(event_time - self.start_time, format_sensor_line(event)))
+        self._log_file.flush()
+
+
+def load_event_log(log_path):
+    """
+    Return list of (time in s, message) from an event log file
+
+    """
+    events = []
+    with open(log_path) as log_file:
+        for line in log_file:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            event_time, message = line.split(' ', 1)
+            events.append((float(event_time), message))
+    return events
+
+
+class SwitchLatencyMixin(object):
+    """
+    Mixin of App measuring the latency of each video switch, from the time of the last sensor event to the time the
+    first frame of the new video is shown (see benchmark.py and replay.py). Subclasses set last_event_time when a sensor
+    event is sent or received, and may override get_show_time to measure on another clock than the application's.
+    The display must count the frames it shows (see NullDisplay and VideoFileDisplay).
+
+    Switches to a sensor state without video stop the video, so no frame is waited for: they are only counted.
+    The duration of each switch on the render thread (opening and seeking the new video) is also measured on the
+    wall clock, since on a virtual clock (see ReplayClock) the latency does not include it.
+
+    Attributes:
+        last_event_time         [float] time of the last sensor event, in s
+        switch_start_time       [float] time of the event that triggered the current switch, None if the first
+                                frame of the new video was already shown, or if the switch stopped the video
+        switch_latencies        [list(float)] latency of each video switch, in s
+        stopped_switch_count    [int] number of switches to a sensor state without video
+        switch_durations        [list(float)] wall-clock duration of each video switch on the render thread, in s
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(SwitchLatencyMixin, self).__init__(*args, **kwargs)
+        self.last_event_time = None
+        self.switch_start_time = None
+        self.switch_latencies = []
+        self.stopped_switch_count = 0
+        self.switch_durations = []
+
+    def get_show_time(self):
+        """
+        Return time the last frame was shown, in s, on the clock of last_event_time, None if no frame was shown
+
+        """
+        return self.clock()
+
+    def on_sensor_state_changed(self):
+        start_time = get_time()
+        super(SwitchLatencyMixin, self).on_sensor_state_changed()
+        if self.sensor_value_to_clip_name is None and self.playing_video_name is None:
+            self.stopped_switch_count += 1
+            self.switch_start_time = None
+        else:
+            self.switch_start_time = self.last_event_time
+            # the initial video is not a switch
+            if self.last_event_time is not None:
+                self.switch_durations.append(get_time() - start_time)
+
+    def update(self):
+        shown_frame_count = self.display.frame_count
+        super(SwitchLatencyMixin, self).update()
+        if self.switch_start_time is None or self.display.frame_count == shown_frame_count:
+            return
+        # a frame of the new video was shown during this update (the blank frame of a stopped video is shown before)
+        show_time = self.get_show_time()
+        if show_time is not None and show_time >= self.switch_start_time:
+            self.switch_latencies.append(show_time - self.switch_start_time)
+            self.switch_start_time = None
+
+
+class ReplayClock(object):
+    """
+    Virtual clock of a replay, only advanced by the replay loop, so that frame deadlines and debounce windows do not
+    depend on how long decoding and rendering actually take. Call it to get the current time, like get_time.
+
+    Attributes:
+        time        [float] current virtual time, in s
+    """
+
+    def __init__(self, start_time=0.):
+        self.time = start_time
+
+    def __call__(self):
+        return self.time
+
+    def advance(self, duration):
+        self.time += duration
+
+
+def replay_event_log(app, events, clock, tail_duration=1., realtime=False):
+    """
+    Feed the events of an event log to an application created with the given replay clock, running its main loop
+    until tail_duration after the last event. Each event is parsed like a serial message and triggered at the first
+    frame at or after its time.
+
+    The clock jumps to the deadline of the next frame after each frame, so the replay runs as fast as the application
+    renders, unless realtime is True, in which case the replay also waits for each deadline. The time the application
+    spends on each frame, e.g. opening and seeking videos, is therefore not visible on the clock.
+    Keyboard input is ignored, and the application is expected not to receive any serial message. Messages that cannot
+    be parsed are skipped, as by the serial reader. The application is stopped even if an error interrupts the replay.
+
+    """
+    app.start()
+    try:
+        start_time = clock()
+        end_time = start_time + (events[-1][0] if events else 0.) + tail_duration
+        event_idx = 0
+        while app.running and clock() < end_time:
+            while event_idx < len(events) and start_time + events[event_idx][0] <= clock():
+                message = events[event_idx][1]
+                event_idx += 1
+                try:
+                    event = parse_sensor_line(message)
+                except (IndexError, ValueError):
+                    print 'Could not parse event: {}'.format(message)
+                    continue
+                if event is not None:
+                    app.on_sensor_event(event)
+            delay_ms = app.step()
+            if realtime:
+                time.sleep(delay_ms / 1000.)
+            clock.advance(delay_ms / 1000.)
+    finally:
+        app.stop()
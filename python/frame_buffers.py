@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+# colour of the blank frame shown when a video stops (BGR)
+BLANK_COLOUR = (255, 255, 255)
+
+
+def get_fitting_size(frame_size, max_size):
+    """
+    Return (width, height) of a frame of frame_size downscaled to fit in max_size, keeping its aspect ratio.
+    Frames are never upscaled, the window does it without cost. Return frame_size if max_size is None.
+
+    """
+    width, height = frame_size
+    if max_size is None or (width <= max_size[0] and height <= max_size[1]):
+        return width, height
+    scale = min(float(max_size[0]) / width, float(max_size[1]) / height)
+    return max(int(round(width * scale)), 1), max(int(round(height * scale)), 1)
+
+
+class FrameBuffers(object):
+    """
+    Output frame buffers of the video layer, allocated once per resolution and reused for every frame,
+    so that the steady-state render path does not allocate frames
+
+    Attributes:
+        blank_frames    [dict((int, int), ndarray)] read-only blank frame per (height, width), filled once
+        scratch_buffers [dict((string, int, int), ndarray)] writable buffer per (purpose, height, width), e.g. the
+                        decoding buffer of the current video or the blending buffers of a crossfade
+    """
+
+    def __init__(self):
+        self.blank_frames = {}
+        self.scratch_buffers = {}
+
+    def get_blank_frame(self, height, width):
+        """
+        Return the blank frame of the given size, allocating and filling it the first time only
+
+        """
+        blank_frame = self.blank_frames.get((height, width))
+        if blank_frame is None:
+            blank_frame = np.empty((height, width, 3), np.uint8)
+            blank_frame[:] = BLANK_COLOUR
+            # shared by all callers, make sure nobody draws on it
+            blank_frame.flags.writeable = False
+            self.blank_frames[(height, width)] = blank_frame
+        return blank_frame
+
+    def get_scratch_buffer(self, purpose, height, width):
+        """
+        Return the buffer of the given purpose and size, allocating it the first time only.
+        Its content is undefined, and is overwritten by the next user of the same purpose.
+
+        """
+        key = (purpose, height, width)
+        scratch_buffer = self.scratch_buffers.get(key)
+        if scratch_buffer is None:
+            scratch_buffer = np.empty((height, width, 3), np.uint8)
+            self.scratch_buffers[key] = scratch_buffer
+        return scratch_buffer
+
+    def clear(self):
+        """
+        Release all buffers, e.g. after switching to videos of another resolution for good
+
+        """
+        self.blank_frames.clear()
+        self.scratch_buffers.clear()
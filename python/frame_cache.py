@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+import os
+import struct
+
+import cv2
+import numpy as np
+
+from path import get_cache_path, get_video_key
+
+# header of a frame cache file, followed by the raw frames in BGR uint8 format
+# magic, format version, frame height, frame width, channels, fps, frame count
+HEADER_FORMAT = '<4sHHHHdI'
+HEADER_MAGIC = 'PMFC'
+HEADER_VERSION = 1
+# header is padded so that frames start at a fixed offset
+HEADER_SIZE = 64
+
+
+class FrameCache(object):
+    """
+    Decoded frames of a video, memory-mapped from a raw frame cache file on disk.
+    Frames are read as zero-copy views, so seeking to any frame is just indexing.
+
+    Attributes:
+        cache_path      [string] path to the frame cache file
+        fps             [float] frame rate of the original video
+        frames          [memmap] read-only array of frames, of shape (frame count, height, width, channels)
+    """
+
+    def __init__(self, cache_path, fps, frames):
+        self.cache_path = cache_path
+        self.fps = fps
+        self.frames = frames
+
+    @property
+    def frame_count(self):
+        return len(self.frames)
+
+
+def get_frame_cache_path(video_path):
+    """
+    Return path to the frame cache file of a video, in the subfolder of its video directory in the 'cache' folder
+
+    """
+    return get_cache_path(get_video_key(video_path) + '.frames')
+
+
+def is_frame_cache_up_to_date(video_path, cache_path):
+    return os.path.isfile(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(video_path)
+
+
+def load_frame_cache(video_path):
+    """
+    Return the FrameCache of a video, building it first if it is missing or older than the video.
+    Return None if the video cannot be decoded.
+
+    """
+    if not os.path.isfile(video_path):
+        return None
+
+    cache_path = get_frame_cache_path(video_path)
+    if not is_frame_cache_up_to_date(video_path, cache_path):
+        if not build_frame_cache(video_path, cache_path):
+            return None
+
+    return open_frame_cache(cache_path)
+
+
+def open_frame_cache(cache_path):
+    """
+    Memory-map a frame cache file and return the FrameCache, or None if the file is not a valid frame cache
+
+    """
+    with open(cache_path, 'rb') as cache_file:
+        header = cache_file.read(struct.calcsize(HEADER_FORMAT))
+    if len(header) < struct.calcsize(HEADER_FORMAT):
+        print 'Invalid frame cache file {}'.format(cache_path)
+        return None
+
+    magic, version, height, width, channels, fps, frame_count = struct.unpack(HEADER_FORMAT, header)
+    if magic != HEADER_MAGIC or version != HEADER_VERSION or frame_count == 0:
+        print 'Invalid frame cache file {}'.format(cache_path)
+        return None
+
+    frames = np.memmap(cache_path, np.uint8, 'r', HEADER_SIZE, (frame_count, height, width, channels))
+    return FrameCache(cache_path, fps, frames)
+
+
+def build_frame_cache(video_path, cache_path):
+    """
+    Decode all frames of a video once into a raw frame cache file. Return True on success.
+    The file is written next to its final path and renamed at the end, so a partial cache is never used.
+
+    Raw frames take a lot of disk space (about 6 MB per frame in 1080p), so prefer this for short clips.
+
+    """
+    print 'Build frame cache {} for video file {}'.format(cache_path, video_path)
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        print 'Could not open video file'
+        return False
+
+    cache_directory = os.path.dirname(cache_path)
+    if not os.path.isdir(cache_directory):
+        os.makedirs(cache_directory)
+
+    fps = capture.get(cv2.CAP_PROP_FPS)
+    temp_cache_path = cache_path + '.tmp'
+    frame_count = 0
+    frame = None
+    with open(temp_cache_path, 'wb') as cache_file:
+        # reserve header space, written at the end when the frame count is known
+        cache_file.write('\0' * HEADER_SIZE)
+        while True:
+            ret, frame_buffer = capture.read(frame)
+            if not ret:
+                break
+            frame = frame_buffer
+            cache_file.write(frame.tobytes())
+            frame_count += 1
+
+        if frame_count > 0:
+            height, width, channels = frame.shape
+            cache_file.seek(0)
+            cache_file.write(struct.pack(HEADER_FORMAT, HEADER_MAGIC, HEADER_VERSION, height, width, channels,
+                                         fps, frame_count))
+    capture.release()
+
+    if frame_count == 0:
+        print 'Could not decode any frame of video file'
+        os.remove(temp_cache_path)
+        return False
+
+    if os.path.isfile(cache_path):
+        # os.rename does not replace existing files on Windows
+        os.remove(cache_path)
+    os.rename(temp_cache_path, cache_path)
+    return True
+
+
+def warm_up_frame_caches(video_paths):
+    """
+    Build missing or outdated frame caches for the given videos, so that the first playback does not decode them
+
+    """
+    for video_path in video_paths:
+        if not os.path.isfile(video_path):
+            print 'Video file {} not found, cannot cache its frames'.format(video_path)
+            continue
+        cache_path = get_frame_cache_path(video_path)
+        if not is_frame_cache_up_to_date(video_path, cache_path):
+            build_frame_cache(video_path, cache_path)
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+import threading
+from Queue import Queue, Empty
+
+import cv2
+import numpy as np
+
+from cpu_affinity import pin_current_thread
+
+
+class FrameReader(object):
+    """
+    Background decoder that reads the frames of a video capture into a bounded ring of preallocated frame buffers,
+    so that the render thread only has to take the next ready frame and show it.
+    Frames can be downscaled in the background too, the capture decoding into a separate buffer in this case.
+
+    Attributes:
+        ring_size               [int] number of frame buffers, i.e. how many frames decoding can be ahead of display
+        buffers                 [list(ndarray)] preallocated frame buffers, indexed by slot
+        frame_size              [(int, int)] (width, height) of the frames in the buffers, None to keep the video size
+        cpu_cores               [list(int)] CPU cores the decoding thread is pinned to, None to let the system choose
+        capture                 [VideoCapture] OpenCV video capture being decoded, None if not started
+        looping                 [bool] should decoding restart from the first frame at the end of the video?
+        frame_count             [int] total number of frames in the video
+        decode_frame_counter    [int] index of the next frame the capture will decode
+        ended                   [bool] has the end of a non-looping video been reached and all its frames taken?
+        dropped_frame_count     [int] number of decoded frames discarded without being shown (when stopping the reader)
+        late_frame_count        [int] number of times a frame was requested before decoding could provide it
+    """
+
+    def __init__(self, ring_size=4, cpu_cores=None):
+        assert ring_size > 0
+        self.ring_size = ring_size
+        self.cpu_cores = cpu_cores
+        self.buffers = []
+        self.frame_size = None
+        self.capture = None
+        self.looping = False
+        self.frame_count = 0
+        self.decode_frame_counter = 0
+        self.ended = False
+        self.dropped_frame_count = 0
+        self.late_frame_count = 0
+        # decoding buffer at video size when frames are downscaled, None else
+        self._decode_buffer = None
+        self._free_slots = Queue()
+        self._ready_slots = Queue()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def is_running(self):
+        return self._thread is not None
+
+    def start(self, capture, frame_counter, looping, frame_size=None):
+        """
+        Start decoding an opened capture from the given frame, which must be the current position of the capture.
+        If frame_size is given and differs from the video size, frames are resized to frame_size after decoding.
+
+        """
+        assert not self.is_running, 'Frame reader already started, stop it first'
+        self.capture = capture
+        self.looping = looping
+        self.frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.decode_frame_counter = frame_counter
+        self.ended = False
+        video_size = (int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        if frame_size is None or frame_size == video_size:
+            self.frame_size = video_size
+            self._decode_buffer = None
+        else:
+            self.frame_size = frame_size
+            if self._decode_buffer is None or self._decode_buffer.shape[:2] != video_size[::-1]:
+                self._decode_buffer = np.empty((video_size[1], video_size[0], 3), np.uint8)
+        self._allocate_buffers(self.frame_size[1], self.frame_size[0])
+
+        for slot in xrange(self.ring_size):
+            self._free_slots.put(slot)
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._decode_loop, name='FrameReader')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop decoding and discard frames that were decoded but not taken. The capture is left open.
+
+        """
+        if not self.is_running:
+            return
+
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+
+        while True:
+            try:
+                slot, _ = self._ready_slots.get_nowait()
+            except Empty:
+                break
+            if slot is not None:
+                self.dropped_frame_count += 1
+
+        while True:
+            try:
+                self._free_slots.get_nowait()
+            except Empty:
+                break
+
+    def take(self):
+        """
+        Return (slot, frame index) of the next decoded frame without blocking, or None if no frame is ready.
+        The frame is self.buffers[slot] and the slot must be given back with recycle() once the frame has been shown.
+        After the end of a non-looping video, return None and set ended to True.
+
+        """
+        if self.ended:
+            return None
+
+        try:
+            slot, frame_counter = self._ready_slots.get_nowait()
+        except Empty:
+            if self.is_running:
+                self.late_frame_count += 1
+            return None
+
+        if slot is None:
+            # end of video marker
+            self.ended = True
+            return None
+
+        return slot, frame_counter
+
+    def recycle(self, slot):
+        """
+        Give back a frame buffer slot to the decoding thread
+
+        """
+        self._free_slots.put(slot)
+
+    def _allocate_buffers(self, height, width):
+        if self.buffers and self.buffers[0].shape[:2] == (height, width):
+            return
+        self.buffers = [np.empty((height, width, 3), np.uint8) for _ in xrange(self.ring_size)]
+
+    def _decode_loop(self):
+        if self.cpu_cores:
+            pin_current_thread(self.cpu_cores)
+        while not self._stop_event.is_set():
+            try:
+                slot = self._free_slots.get(timeout=0.05)
+            except Empty:
+                # all buffers are full, display is behind
+                continue
+
+            if self._decode_buffer is not None:
+                ret, frame = self.capture.read(self._decode_buffer)
+            else:
+                ret, frame = self.capture.read(self.buffers[slot])
+            if not ret:
+                self._free_slots.put(slot)
+                self._ready_slots.put((None, -1))
+                return
+
+            if self._decode_buffer is not None:
+                if frame is not self._decode_buffer:
+                    self._decode_buffer = frame
+                # downscale once into the ring buffer (bilinear is fast and good enough for moderate ratios)
+                cv2.resize(frame, self.frame_size, self.buffers[slot], interpolation=cv2.INTER_LINEAR)
+            elif frame is not self.buffers[slot]:
+                # OpenCV reallocated the buffer because the frame size did not match, keep the new one
+                self.buffers[slot] = frame
+
+            self._ready_slots.put((slot, self.decode_frame_counter))
+            self.decode_frame_counter += 1
+
+            if self.decode_frame_counter >= self.frame_count:
+                if self.looping:
+                    self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    self.decode_frame_counter = 0
+                else:
+                    self._ready_slots.put((None, -1))
+                    return
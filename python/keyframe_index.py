@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import subprocess
+from bisect import bisect_right
+
+import cv2
+
+from metrics import record_duration
+from path import get_video_key
+from presentation_clock import get_time
+
+
+class KeyframeIndex(object):
+    """
+    Index of the keyframes of each video, built once with ffprobe and persisted to a JSON file,
+    so that seeking can jump to a keyframe and decode forward to the exact target frame
+
+    Attributes:
+        index_path      [string] path to the JSON file the index is persisted to
+        entries         [dict(string, dict)] entry per video key (see get_video_key), with the modification time of
+                        the video ('mtime') and the sorted indices of its keyframes in presentation order ('keyframes')
+        ffprobe_path    [string] path or command name of the ffprobe executable used to build the index
+    """
+
+    def __init__(self, index_path, ffprobe_path='ffprobe'):
+        self.index_path = index_path
+        self.ffprobe_path = ffprobe_path
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        if not os.path.isfile(self.index_path):
+            return
+        try:
+            with open(self.index_path, 'r') as index_file:
+                self.entries = json.load(index_file)
+        except ValueError:
+            print 'Invalid keyframe index {}, it will be rebuilt'.format(self.index_path)
+            self.entries = {}
+
+    def save(self):
+        with open(self.index_path, 'w') as index_file:
+            json.dump(self.entries, index_file)
+
+    def update(self, video_paths):
+        """
+        Index the keyframes of the given videos that are not indexed yet or have changed, and save the index.
+        This decodes the videos with ffprobe, so call it at startup, not on the render thread.
+
+        """
+        changed = False
+        for video_path in video_paths:
+            if not os.path.isfile(video_path):
+                continue
+            mtime = os.path.getmtime(video_path)
+            entry = self.entries.get(get_video_key(video_path))
+            if entry is not None and entry['mtime'] == mtime:
+                continue
+
+            keyframes = self.probe_keyframes(video_path)
+            if keyframes is None:
+                # ffprobe is not available or failed, do not try the other videos
+                break
+            self.entries[get_video_key(video_path)] = {'mtime': mtime, 'keyframes': keyframes}
+            changed = True
+
+        if changed:
+            self.save()
+
+    def probe_keyframes(self, video_path):
+        """
+        Return sorted list of the indices of the keyframes of a video, or None if ffprobe could not be run
+
+        """
+        print 'Index keyframes of video file {}'.format(video_path)
+        command = [self.ffprobe_path, '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'frame=key_frame',
+                   '-of', 'csv=p=0', video_path]
+        try:
+            output = subprocess.check_output(command)
+        except (OSError, subprocess.CalledProcessError) as e:
+            print 'Could not index keyframes with ffprobe: {}'.format(e)
+            return None
+
+        key_frame_flags = [line.strip() for line in output.splitlines() if line.strip()]
+        return [frame_idx for frame_idx, flag in enumerate(key_frame_flags) if flag.startswith('1')]
+
+    def get_keyframes(self, video_path):
+        """
+        Return sorted list of the keyframes of a video, or None if the video is not indexed
+
+        """
+        entry = self.entries.get(get_video_key(video_path))
+        if entry is None:
+            return None
+        return entry['keyframes']
+
+
+def seek_frame(capture, current_frame, target_frame, keyframes=None, latency_budget_ms=None):
+    """
+    Move an opened capture from the current frame to the target frame, and return the index of the next frame
+    the capture will read.
+
+    With keyframes, seek to the last keyframe before the target (unless the capture is already between it and
+    the target) and decode forward to the target, which is frame-accurate. If a latency budget is given, stop
+    decoding forward when it is exceeded, so the returned frame may be before the target.
+    Without keyframes, let the backend seek directly to the target frame.
+
+    """
+    start_time = get_time()
+    if not keyframes:
+        capture.set(cv2.CAP_PROP_POS_FRAMES, target_frame)
+        record_duration('seek', (get_time() - start_time) * 1000)
+        return target_frame
+
+    start_tick = cv2.getTickCount()
+    budget_ticks = latency_budget_ms * cv2.getTickFrequency() / 1000 if latency_budget_ms is not None else None
+
+    keyframe = keyframes[max(bisect_right(keyframes, target_frame) - 1, 0)]
+    if not keyframe <= current_frame <= target_frame:
+        capture.set(cv2.CAP_PROP_POS_FRAMES, keyframe)
+        current_frame = keyframe
+
+    while current_frame < target_frame:
+        if budget_ticks is not None and cv2.getTickCount() - start_tick > budget_ticks:
+            break
+        if not capture.grab():
+            break
+        current_frame += 1
+
+    record_duration('seek', (get_time() - start_time) * 1000)
+    return current_frame
@@ -7,11 +7,34 @@ send messages starting with "UID Value: ", "Lost UID Value: ", "Photo: " or "Los
 identifier of an RFID tag UID (listed in rfid_uids) assumed to be detected or the ID of the photoresistor (1 to 3)
 assumed to be covered by an object.
 
+The connected device may also send compact binary messages instead, framed as [0xA5, type, payload length, payload]
+where type is 0x01 for "UID Value", 0x02 for "Lost UID Value", 0x03 for "Photo" and 0x04 for "Lost Photo",
+and payload is the UID bytes of the RFID tag or the ID byte of the photoresistor (see BINARY_PROTOCOL in the
+Arduino sketch).
+
 Then, the application will play a video corresponding to the combination code of the state of those 4 sensors
 (see generate_sensor_state_to_video_name function docstring).
 
+In compositing mode, the application will instead play one clip per sensor in the grid cell of that sensor,
+composing the grid live (see generate_sensor_value_to_clip_name function docstring).
+
+With several panels (see panels), one process drives all of them, each panel having its own connected device, sensor
+state and window.
+
+Run with --warm-up to decode all videos into frame caches (see decode_backend) and exit.
+Run with --transcode to transcode all videos to the display size (see scale_to_display) and exit.
+
 """
-from app import App
+import itertools
+import os
+import sys
+
+import path
+from app import App, get_video_names, select_video_variants
+from cpu_affinity import assign_cpu_cores
+from display import get_screen_size
+from multi_panel import MultiPanelApp
+from path import get_full_path
 
 __author__ = "Long Nguyen Huu"
 __copyright__ = "Copyright 2016, Team Portraits Animés"
@@ -24,9 +47,89 @@ __email__ = "n.huu.long@gmail.com"
 # Arduino parameters
 transmission_rate = 115200  # serial baud rate
 
+# time a sensor value must stay unchanged before switching video, in ms, per sensor [RFID, PHOTO1, PHOTO2, PHOTO3]
+# photoresistors may flicker under room lighting, increase their window if videos switch back and forth
+debounce_windows_ms = [0, 100, 100, 100]
+# number of values of each sensor, in the same order (RFID 0 to 4, photos 0 or 1)
+# add photo sensors by adding values here, in debounce_windows_ms and in sensor_cells
+sensor_value_counts = [5, 2, 2, 2]
+
 # Video parameters
-# if the videos have different FPS, use fps = self.capture.get(cv2.CAP_PROP_FPS) in the Video class instead
+# frame rate used until a video is opened, and for videos that do not provide their frame rate
+# (videos are presented at their own frame rate, even if they have different FPS)
 fps = 25
+# number of video captures kept open to switch videos without opening files (e.g. 2), 0 to disable
+# idle captures are decoded along with the video played in a background thread, which costs one decode per capture
+# per frame, so only enable it on devices with spare CPU cores
+capture_pool_size = 0
+# estimated memory the open captures may hold, in MB (each capture holds decoder buffers, about 11 MB at 1280x720),
+# None for no limit
+capture_pool_memory_mb = 64
+# number of videos of the most likely next sensor states (learnt from the previous sensor changes) to open and seek
+# in the background after each switch, so that switching to them is immediate (e.g. 3, requires the capture pool with
+# one idle capture per prefetched video, ie capture_pool_size >= prefetch_count + 1), 0 to disable
+prefetch_count = 0
+# number of frames of the crossfade from a video to the next when sensors change, the previous video playing until the
+# next one is decoded (e.g. 10, check that the device can afford it with benchmark_crossfade.py), 0 to cut
+transition_frame_count = 0
+# decode videos in a background thread, so that slow frames do not delay input and serial reading (True on devices
+# with several CPU cores)
+threaded_decode = False
+# backend decoding the videos: 'opencv', 'pyav' (FFmpeg with threaded decoding, requires PyAV), 'frame_cache' to play
+# videos from raw frames decoded once into the 'cache' folder instead of decoding them at every loop (this saves CPU
+# for short clips but takes a lot of disk space), or 'auto' to choose the backend decoding the first video the fastest
+# at startup, which costs a probe decoding at every startup (the frame cache is only a candidate once built with
+# --warm-up)
+decode_backend = 'opencv'
+# downscale videos bigger than the display once instead of letting the window rescale full-size frames at every frame
+# (decoding directly at display size with the 'pyav' backend), and play the videos transcoded to the display size
+# with --transcode, if any (e.g. in 'videos_1920x1080'), True when the videos are bigger than the screen
+scale_to_display = False
+# (width, height) of the display, None to detect the size of the primary screen (requires Tkinter)
+display_size = None
+# check at startup that all videos can be played, indexing their metadata (fps, frame count, resolution, codec, hash)
+# in parallel into video_manifest.json (only new or modified videos are indexed again)
+# sensor states whose video cannot be played fall back to the closest state
+# (the first run decodes and hashes all videos, which takes a while with many videos)
+validate_videos = False
+# seek to the previous keyframe and decode forward to the exact frame when switching video, using a keyframe index
+# built with ffprobe at startup (if ffprobe is not installed, OpenCV seeks directly)
+# (the first run reads the keyframes of all videos with ffprobe, which takes a while with many videos)
+keyframe_seek = False
+# maximum time to spend decoding forward from a keyframe, in ms (None for no limit, always frame-accurate)
+seek_latency_budget_ms = 40
+
+# Metrics parameters
+# port to serve the durations of the main loop stages, video opens and seeks on localhost, in the Prometheus text format
+# (e.g. 9100, then run `curl http://127.0.0.1:9100/metrics`), None to disable
+metrics_port = None
+# file to dump the same metrics to on exit, None to only print a summary
+metrics_dump_path = None
+
+# Multi-panel parameters
+# list of panels driven by this process, each with its own serial port and window, e.g.
+# [{'serial_port': '/dev/ttyACM0'}, {'serial_port': '/dev/ttyACM1', 'window_name': 'right'}]
+# (window names default to 'panel0', 'panel1'...), None to drive a single panel from the first serial port found
+# all panels play the same videos, and only the first panel serves and dumps metrics
+panels = None
+# pin the background decoding threads of each panel (see threaded_decode and capture_pool_size) to their own share of
+# the CPU cores but the first one, left to the render loop, so that panels do not compete for the same cores (Linux
+# only). The render loop is not pinned, since the FFmpeg threads started when it opens videos inherit its cores, and
+# without threaded_decode nor capture pool, videos are decoded on the render loop, so nothing is pinned.
+pin_cpu_cores = True
+
+# Event log parameters
+# file to record the sensor events received (from the serial port or simulated with debug keys) to, relative to the
+# project directory (e.g. 'events.log'), to reproduce a session offline with replay.py, None to disable
+event_log_path = None
+
+# Compositing parameters
+# compose the grid live from one clip per sensor cell, instead of playing pre-combined videos
+compositing = False
+# number of rows and columns of the grid
+grid_shape = (3, 3)
+# (row, column) of the grid cell of each sensor, in the order of the sensor state [RFID, PHOTO1, PHOTO2, PHOTO3]
+sensor_cells = [(1, 1), (1, 0), (0, 1), (2, 2)]
 
 # UIDs of the RFID tags, their simplified IDs being their respective indices in the list
 # Find out the UIDs of your own RFID tags by reading your serial port in Arduino IDE and replace the values with yours
@@ -40,11 +143,72 @@ rfid_uids = [
 ]
 
 def main():
-    sensor_state_to_video_name = generate_sensor_state_to_video_name()
-    app = App(rfid_uids, sensor_state_to_video_name, 'window', transmission_rate, fps, fullscreen=False)
+    sensor_state_to_video_name = generate_sensor_state_to_video_name() if not compositing else {}
+    sensor_value_to_clip_name = generate_sensor_value_to_clip_name() if compositing else None
+    app_kwargs = dict(
+        fullscreen=False, capture_pool_size=capture_pool_size, capture_pool_memory_mb=capture_pool_memory_mb,
+        prefetch_count=prefetch_count,
+        transition_frame_count=transition_frame_count, threaded_decode=threaded_decode,
+        sensor_value_to_clip_name=sensor_value_to_clip_name, sensor_cells=sensor_cells, grid_shape=grid_shape,
+        decode_backend=decode_backend, scale_to_display=scale_to_display, display_size=display_size,
+        validate_videos=validate_videos, keyframe_seek=keyframe_seek, seek_latency_budget_ms=seek_latency_budget_ms,
+        debounce_windows_ms=debounce_windows_ms, sensor_value_counts=sensor_value_counts)
+    metrics_kwargs = dict(metrics_port=metrics_port,
+                          metrics_dump_path=get_full_path(metrics_dump_path) if metrics_dump_path else None)
+    event_log_full_path = get_full_path(event_log_path) if event_log_path else None
+    if panels:
+        run_panels(sensor_state_to_video_name, app_kwargs, metrics_kwargs, event_log_full_path)
+        return
+
+    app_kwargs.update(metrics_kwargs)
+    app_kwargs['event_log_path'] = event_log_full_path
+    app = App(rfid_uids, sensor_state_to_video_name, 'window', transmission_rate, fps, **app_kwargs)
+    if '--warm-up' in sys.argv[1:]:
+        app.warm_up_frame_caches()
+        return
+    if '--transcode' in sys.argv[1:]:
+        app.transcode_videos()
+        return
     app.run()
 
 
+def run_panels(sensor_state_to_video_name, app_kwargs, metrics_kwargs, event_log_full_path=None):
+    """
+    Create one App per panel and run them all in this process, the events of each panel being recorded to its own
+    event log (suffixed with the window name), and the metrics being served or dumped by the first panel
+
+    """
+    # all panels play the same videos at the same size, so the variant directory is selected once for all of them
+    source_video_directory = path.VIDEO_DIRECTORY
+    panel_display_size = (display_size if display_size is not None else get_screen_size()) if scale_to_display \
+        else None
+    if panel_display_size is not None:
+        select_video_variants(get_video_names(sensor_state_to_video_name, app_kwargs['sensor_value_to_clip_name']),
+                              panel_display_size)
+
+    if pin_cpu_cores and (threaded_decode or capture_pool_size > 0):
+        _, panel_cpu_cores = assign_cpu_cores(len(panels))
+    else:
+        panel_cpu_cores = [None] * len(panels)
+
+    panel_apps = []
+    for panel_idx, panel in enumerate(panels):
+        window_name = panel.get('window_name', 'panel{}'.format(panel_idx))
+        panel_kwargs = dict(app_kwargs, serial_port=panel['serial_port'], decode_cpu_cores=panel_cpu_cores[panel_idx],
+                            source_video_directory=source_video_directory)
+        if event_log_full_path is not None:
+            panel_kwargs['event_log_path'] = '{}_{}{}'.format(os.path.splitext(event_log_full_path)[0], window_name,
+                                                              os.path.splitext(event_log_full_path)[1])
+        if panel_apps:
+            # all panels play the same videos, so probing the decoding backend once is enough
+            panel_kwargs['decode_backend'] = panel_apps[0].decode_backend
+        else:
+            panel_kwargs.update(metrics_kwargs)
+        panel_apps.append(App(rfid_uids, sensor_state_to_video_name, window_name, transmission_rate, fps,
+                              **panel_kwargs))
+    MultiPanelApp(panel_apps).run()
+
+
 def generate_sensor_state_to_video_name():
     """
     Return dictionary of video filenames per sensor state tuple, in the format 'video_wxyz.mp4' where
@@ -55,11 +219,31 @@ def generate_sensor_state_to_video_name():
 
     Example: video_2010.mp4
 
-    Videos should be put in the 'videos' folder.
+    With more sensors (see sensor_value_counts), there is one more digit per sensor.
+    Videos should be put in the 'videos' folder. Missing combinations are replaced with the closest combination.
+
+    """
+    return {sensor_state: 'video_{}.mp4'.format(''.join(str(value) for value in sensor_state))
+            for sensor_state in itertools.product(*(xrange(value_count) for value_count in sensor_value_counts))}
+
+
+def generate_sensor_value_to_clip_name():
+    """
+    Return list of dictionaries of clip filenames per sensor value, one dictionary per sensor, for compositing mode.
+    Clips are named 'clip_[sensor]_[value].mp4' where
+    the sensor is 0 for the RFID reader, 1, 2 or 3 for the corresponding photoresistor
+    the value is 1, 2, 3 or 4 for the corresponding RFID tag, 1 for a photo on the photoresistor
+
+    Example: clip_0_2.mp4
+
+    Value 0 (no RFID, no photo) has no clip, and shows a black cell.
+    Each clip is played in the cell of its sensor (see sensor_cells), so only one clip is needed per sensor value.
+
+    Clips should be put in the 'videos' folder.
 
     """
-    return {(rfid_idx, photo1, photo2, photo3): 'video_{}{}{}{}.mp4'.format(rfid_idx, int(photo1), int(photo2), int(photo3))
-            for rfid_idx in xrange(5) for photo1 in (True, False) for photo2 in (True, False) for photo3 in (True, False)}
+    return [{value: 'clip_{}_{}.mp4'.format(sensor_idx, value) for value in xrange(1, value_count)}
+            for sensor_idx, value_count in enumerate(sensor_value_counts)]
 
 if __name__ == '__main__':
     main()
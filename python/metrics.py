@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+import threading
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from bisect import bisect_left
+from collections import deque
+
+# upper edges of the bins of the duration histograms, in ms, the last bin counting all greater durations
+DURATION_BIN_EDGES_MS = [0.5, 1, 2, 5, 10, 20, 40, 80, 160]
+
+
+class RollingHistogram(object):
+    """
+    Histogram of the last durations recorded, so that it reflects the current behaviour rather than the whole run
+
+    Attributes:
+        window_size     [int] number of durations kept, older durations being removed from the histogram
+        bin_counts      [list(int)] number of durations per bin (see DURATION_BIN_EDGES_MS), over the window
+        total_ms        [float] sum of the durations of the window, in ms
+        max_ms          [float] maximum duration recorded since the start, in ms
+        recorded_count  [int] number of durations recorded since the start
+    """
+
+    def __init__(self, window_size=1000):
+        self.window_size = window_size
+        self.bin_counts = [0] * (len(DURATION_BIN_EDGES_MS) + 1)
+        self.total_ms = 0.
+        self.max_ms = 0.
+        self.recorded_count = 0
+        # durations of the window with their bin index, oldest first
+        self._samples = deque()
+        self._lock = threading.Lock()
+
+    def record(self, duration_ms):
+        bin_idx = bisect_left(DURATION_BIN_EDGES_MS, duration_ms)
+        with self._lock:
+            if len(self._samples) == self.window_size:
+                old_duration_ms, old_bin_idx = self._samples.popleft()
+                self.bin_counts[old_bin_idx] -= 1
+                self.total_ms -= old_duration_ms
+            self._samples.append((duration_ms, bin_idx))
+            self.bin_counts[bin_idx] += 1
+            self.total_ms += duration_ms
+            self.max_ms = max(self.max_ms, duration_ms)
+            self.recorded_count += 1
+
+    def get_snapshot(self):
+        """
+        Return (bin counts, count, total in ms) of the window, consistent with each other
+
+        """
+        with self._lock:
+            return list(self.bin_counts), len(self._samples), self.total_ms
+
+
+class MetricsRegistry(object):
+    """
+    Registry of the duration histograms and values measured by the application, per metric name
+
+    Attributes:
+        histograms      [dict(string, RollingHistogram)] duration histograms per name, created on first record
+        gauges          [dict(string, function)] function returning the current value of each gauge, per name
+        window_size     [int] window size of the new histograms
+    """
+
+    def __init__(self, window_size=1000):
+        self.histograms = {}
+        self.gauges = {}
+        self.window_size = window_size
+        self._lock = threading.Lock()
+
+    def record_duration(self, name, duration_ms):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(name, RollingHistogram(self.window_size))
+        histogram.record(duration_ms)
+
+    def add_gauge(self, name, get_value):
+        self.gauges[name] = get_value
+
+    def format_prometheus(self):
+        """
+        Return metrics in the Prometheus text format, durations being in seconds as usual in Prometheus
+
+        """
+        lines = []
+        for name, histogram in sorted(self.histograms.items()):
+            metric_name = 'polaroid_movie_{}_seconds'.format(name)
+            bin_counts, count, total_ms = histogram.get_snapshot()
+            lines.append('# TYPE {} histogram'.format(metric_name))
+            cumulative_count = 0
+            for bin_edge_ms, bin_count in zip(DURATION_BIN_EDGES_MS, bin_counts):
+                cumulative_count += bin_count
+                lines.append('{}_bucket{{le="{:g}"}} {}'.format(metric_name, bin_edge_ms / 1000., cumulative_count))
+            lines.append('{}_bucket{{le="+Inf"}} {}'.format(metric_name, count))
+            lines.append('{}_sum {:.6f}'.format(metric_name, total_ms / 1000.))
+            lines.append('{}_count {}'.format(metric_name, count))
+            lines.append('# TYPE {0}_max gauge\n{0}_max {1:.6f}'.format(metric_name, histogram.max_ms / 1000.))
+        for name, get_value in sorted(self.gauges.items()):
+            metric_name = 'polaroid_movie_{}'.format(name)
+            lines.append('# TYPE {} gauge'.format(metric_name))
+            lines.append('{} {}'.format(metric_name, get_value()))
+        return '\n'.join(lines) + '\n'
+
+    def format_summary(self):
+        """
+        Return mean and maximum duration per histogram, one per line
+
+        """
+        lines = []
+        for name, histogram in sorted(self.histograms.items()):
+            bin_counts, count, total_ms = histogram.get_snapshot()
+            lines.append('  {:<16} mean {:6.2f} ms, max {:7.2f} ms ({} recorded)'.format(
+                name, total_ms / count if count else 0., histogram.max_ms, histogram.recorded_count))
+        return '\n'.join(lines)
+
+    def dump(self, dump_path):
+        with open(dump_path, 'w') as dump_file:
+            dump_file.write(self.format_prometheus())
+
+
+# registry of the whole application, so that any module can record durations without passing it around
+registry = MetricsRegistry()
+
+
+def record_duration(name, duration_ms):
+    registry.record_duration(name, duration_ms)
+
+
+class MetricsServer(object):
+    """
+    HTTP server exposing the metrics of a registry to Prometheus (or curl) on localhost, in a background thread
+
+    Attributes:
+        metrics_registry    [MetricsRegistry] registry of the metrics to expose
+        port                [int] port to listen to on localhost, the metrics being served at /metrics
+    """
+
+    def __init__(self, metrics_registry, port):
+        self.metrics_registry = metrics_registry
+        self.port = port
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        metrics_registry = self.metrics_registry
+
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics_registry.format_prometheus()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # do not print each scrape in the console
+                pass
+
+        # only listen to localhost, metrics are not meant to be public
+        self._server = HTTPServer(('127.0.0.1', self.port), MetricsRequestHandler)
+        self._thread = threading.Thread(target=self._server.serve_forever, name='MetricsServer')
+        self._thread.daemon = True
+        self._thread.start()
+        print 'Serve metrics at http://127.0.0.1:{}/metrics'.format(self.port)
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+            self._thread = None
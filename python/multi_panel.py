@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+from background_log import flush_log
+from metrics import record_duration, registry
+from presentation_clock import get_time
+
+
+class MultiPanelApp(object):
+    """
+    Application driving several panels from one process, each panel being an App with its own serial device, sensor
+    state and window.
+
+    Panels are rendered in turn by a single loop on the calling thread, which waits for the earliest frame deadline of
+    all panels, while each panel decodes its videos in its own background threads (see FrameReader). Since OpenCV
+    releases the GIL while decoding and resizing, pinning the decoding threads of each panel to their own CPU cores
+    (see assign_cpu_cores) lets a multi-core device decode all panels in parallel at full frame rate.
+    The render loop itself is not pinned: videos are opened on it, and the FFmpeg threads started when opening a video
+    inherit the CPU cores of the opening thread, so all panels would decode on the cores of the render loop.
+
+    Attributes:
+        panels              [list(App)] applications of the panels, created with their own serial port and window
+        running             [bool] should the panels be running?
+    """
+
+    def __init__(self, panels):
+        assert panels
+        self.panels = panels
+        self.running = False
+
+    def run(self):
+        """
+        Run all panels until one of them is quit (ESC quits all panels)
+
+        """
+        for panel in self.panels:
+            panel.start()
+        self.running = True
+
+        while self.running:
+            # the next wait ends at the earliest deadline, panels with no frame due yet present nothing
+            delay_ms = min(panel.step() for panel in self.panels)
+            wait_start_time = get_time()
+            # OpenCV receives the keys pressed in any of its windows
+            c = self.panels[0].display.wait_key(delay_ms)
+            record_duration('wait_key_overrun', max((get_time() - wait_start_time) * 1000 - delay_ms, 0.))
+            for panel in self.panels:
+                panel.last_input_keycode = c & 0xFF
+            self.running = all(panel.running for panel in self.panels)
+
+        for panel in self.panels:
+            panel.stop()
+        # print summaries after the last messages logged
+        flush_log()
+        print 'Stage durations over the last frames (all panels):\n{}'.format(registry.format_summary())
+        for panel in self.panels:
+            print 'Panel "{}":'.format(panel.window_name)
+            panel.print_summary()
@@ -1,10 +1,23 @@
-# -*- coding: utf-8 -*-
-import os
-PROJECT_DIRECTORY = os.path.dirname(os.path.dirname(__file__))
-
-
-def get_full_path(*path):
-    return os.path.join(PROJECT_DIRECTORY, *path)
-
-def get_video_path(*path):
-    return os.path.join(PROJECT_DIRECTORY, 'videos', *path)
+# -*- coding: utf-8 -*-
+import os
+PROJECT_DIRECTORY = os.path.dirname(os.path.dirname(__file__))
+# directory of the videos and clips, may be changed before opening any video (e.g. to play generated clips)
+VIDEO_DIRECTORY = os.path.join(PROJECT_DIRECTORY, 'videos')
+
+
+def get_full_path(*path):
+    return os.path.join(PROJECT_DIRECTORY, *path)
+
+def get_video_path(*path):
+    return os.path.join(VIDEO_DIRECTORY, *path)
+
+def get_cache_path(*path):
+    return os.path.join(PROJECT_DIRECTORY, 'cache', *path)
+
+def get_video_key(video_path):
+    """
+    Return identifier of a video file in caches and indices, made of the name of its directory and its file name,
+    so that the same video in the video directory and in a variant directory (see video_variants.py) do not collide
+
+    """
+    return os.path.join(os.path.basename(os.path.dirname(video_path)), os.path.basename(video_path))
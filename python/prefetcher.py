@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+import math
+import threading
+from Queue import Queue, Empty
+
+import cv2
+
+from background_log import log
+from capture_pool import PooledCapture
+from presentation_clock import get_time
+
+
+class TransitionModel(object):
+    """
+    Frequencies of the transitions between sensor states, to predict the next state from the current one
+
+    Attributes:
+        transition_counts   [dict(int, dict(int, int))] number of transitions to each next state code, per state code
+    """
+
+    def __init__(self):
+        self.transition_counts = {}
+
+    def record(self, from_code, to_code):
+        next_counts = self.transition_counts.setdefault(from_code, {})
+        next_counts[to_code] = next_counts.get(to_code, 0) + 1
+
+    def predict(self, code, candidate_codes, count):
+        """
+        Return up to count of the candidate codes, the most frequent transitions from code first.
+        Candidates with the same frequency (e.g. never seen) keep their order.
+
+        """
+        next_counts = self.transition_counts.get(code, {})
+        return sorted(candidate_codes, key=lambda candidate_code: -next_counts.get(candidate_code, 0))[:count]
+
+
+class Prefetcher(object):
+    """
+    Background opener of the videos likely to be played next, which positions them at the frame the current video
+    will have reached and hands them over to a capture pool, so that switching to them needs neither open nor seek.
+
+    Captures are opened and seeked in a background thread, then added to the pool on the render thread by poll(),
+    the pool keeping them in sync from then on (a capture ahead of the current video waits for it). Only as many
+    videos as the pool can keep idle are prefetched, and a prefetched capture never evicts the capture of another
+    predicted video, so that less likely videos do not push out the most likely one.
+
+    Attributes:
+        capture_pool        [CapturePool] pool the prefetched captures are added to (it should sync idle captures)
+        capture_factory     [function] function creating a video capture of the decoding backend from a filename
+        keyframe_index      [KeyframeIndex] optional index of keyframes used for frame-accurate seeking
+        lead_frames         [int] number of frames ahead of the current frame captures are positioned, i.e. estimated
+                            number of frames played while a video is opened and seeked (updated after each prefetch)
+        fps                 [float] frame rate of the current video, used to convert prefetch durations into frames
+        prefetched_filenames
+                            [set(string)] filenames of the captures prefetched into the pool and not acquired yet
+        hit_count           [int] number of video switches to a video that was prefetched into the pool
+        miss_count          [int] number of video switches to a video that was not prefetched (or was evicted)
+        dropped_count       [int] number of prefetched captures discarded because the prediction was outdated, or the
+                            pool had no room left for them
+    """
+
+    def __init__(self, capture_pool, capture_factory=cv2.VideoCapture, keyframe_index=None, lead_frames=5, fps=25):
+        self.capture_pool = capture_pool
+        self.capture_factory = capture_factory
+        self.keyframe_index = keyframe_index
+        self.lead_frames = lead_frames
+        self.fps = fps
+        self.prefetched_filenames = set()
+        self.hit_count = 0
+        self.miss_count = 0
+        self.dropped_count = 0
+        # current prediction, requests and results of older predictions are discarded
+        self._generation = 0
+        self._predicted_filenames = set()
+        # (generation, filename, target frame) to prefetch, consumed by the background thread
+        self._requests = Queue()
+        # PooledCapture prefetched, consumed by poll()
+        self._results = Queue()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._prefetch_loop, name='Prefetcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop prefetching and release the captures that were not added to the pool
+
+        """
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+        self._discard_results()
+
+    @property
+    def hit_rate(self):
+        """Ratio of video switches served by a prefetched capture, 0 if there was no switch"""
+        switch_count = self.hit_count + self.miss_count
+        return float(self.hit_count) / switch_count if switch_count else 0.
+
+    def prefetch(self, filenames, frame_counter):
+        """
+        Replace the current prediction with the given video files, most likely first, the current video being at the
+        given frame. Videos already idle in the pool are not opened again, since the pool keeps them in sync.
+        Only the most likely videos the pool has room for are prefetched.
+
+        """
+        filenames = filenames[:self.capture_pool.get_idle_capacity()]
+        self._generation += 1
+        self._predicted_filenames = set(filenames)
+        while True:
+            try:
+                self._requests.get_nowait()
+            except Empty:
+                break
+        for filename in filenames:
+            if not self.capture_pool.contains(filename):
+                self._requests.put((self._generation, filename, frame_counter + self.lead_frames))
+
+    def record_switch(self, filename):
+        """
+        Count a video switch to the given video file as a hit if it was prefetched, before acquiring it from the pool
+
+        """
+        if filename in self.prefetched_filenames and self.capture_pool.contains(filename):
+            self.hit_count += 1
+        else:
+            self.miss_count += 1
+        self.prefetched_filenames.discard(filename)
+
+    def poll(self):
+        """
+        Add the prefetched captures to the pool, which syncs them with the current video.
+        Call it on the render thread.
+
+        """
+        while True:
+            try:
+                pooled = self._results.get_nowait()
+            except Empty:
+                break
+            # a capture of an older prediction is still useful if its video is still likely
+            if pooled.filename in self._predicted_filenames:
+                added = self.capture_pool.add(pooled, kept_filenames=self._predicted_filenames)
+            else:
+                pooled.release()
+                added = False
+            if added:
+                self.prefetched_filenames.add(pooled.filename)
+            else:
+                self.dropped_count += 1
+
+    def _discard_results(self):
+        while True:
+            try:
+                pooled = self._results.get_nowait()
+            except Empty:
+                break
+            pooled.release()
+
+    def _prefetch_loop(self):
+        while not self._stop_event.is_set():
+            try:
+                generation, filename, target_frame = self._requests.get(timeout=0.05)
+            except Empty:
+                continue
+            if generation != self._generation:
+                continue
+
+            start_time = get_time()
+            capture = self.capture_factory(filename)
+            if not capture.isOpened():
+                log('Could not open video file {} for prefetch'.format(filename))
+                continue
+            pooled = PooledCapture(filename, capture)
+            if pooled.frame_count:
+                target_frame %= pooled.frame_count
+            keyframes = self.keyframe_index.get_keyframes(filename) if self.keyframe_index is not None else None
+            pooled.seek(target_frame, keyframes)
+
+            # position the next captures further ahead if this one took longer than expected
+            self.lead_frames = int(math.ceil((get_time() - start_time) * self.fps)) + 1
+            self._results.put(pooled)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+import math
+
+import cv2
+
+# upper edges of the bins of the jitter histogram, in ms, the last bin counting all greater jitters
+JITTER_BIN_EDGES_MS = [1, 2, 5, 10, 20, 40]
+
+
+def get_time():
+    """
+    Return current wall-clock time in s, from the OpenCV tick counter
+
+    """
+    return float(cv2.getTickCount()) / cv2.getTickFrequency()
+
+
+class PresentationClock(object):
+    """
+    Clock scheduling the presentation of video frames against wall-clock deadlines, frame n being due at
+    start_time + n / fps. Deadlines are computed from the start time rather than accumulated, so rounding errors
+    do not build up. When the render loop is late, frames are dropped to catch up with the deadline of the current
+    time; when it is early, the current frame is repeated.
+
+    Attributes:
+        fps                     [float] frame rate of the video being presented
+        max_dropped_frames      [int] maximum number of frames dropped at once to catch up, beyond which the clock is
+                                resynchronized so that the next frame is due now (e.g. after a long video switch)
+        start_time              [float] deadline of frame 0, in s
+        frame_index             [int] index of the last frame presented since start_time, -1 if none
+        presented_frame_count   [int] number of frames presented
+        dropped_frame_count     [int] number of frames skipped to catch up
+        repeated_frame_count    [int] number of ticks without a new frame due, the current frame staying on screen
+        resync_count            [int] number of times the clock was resynchronized instead of dropping frames
+        jitter_histogram        [list(int)] number of frames presented per lateness bin (see JITTER_BIN_EDGES_MS)
+    """
+
+    def __init__(self, fps, max_dropped_frames=5):
+        assert fps > 0
+        self.fps = float(fps)
+        self.max_dropped_frames = max_dropped_frames
+        self.start_time = 0.
+        self.frame_index = -1
+        self.presented_frame_count = 0
+        self.dropped_frame_count = 0
+        self.repeated_frame_count = 0
+        self.resync_count = 0
+        self.jitter_histogram = [0] * (len(JITTER_BIN_EDGES_MS) + 1)
+
+    def start(self, time):
+        """
+        Start presenting at given time, in s, with frame 0 due immediately
+
+        """
+        self.start_time = time
+        self.frame_index = -1
+
+    def set_fps(self, fps):
+        """
+        Change frame rate, keeping the deadline of the next frame (e.g. when switching to a video with another fps)
+
+        """
+        if fps <= 0 or fps == self.fps:
+            return
+        self.start_time = self.get_deadline(self.frame_index + 1)
+        self.frame_index = -1
+        self.fps = float(fps)
+
+    def get_deadline(self, frame_index):
+        return self.start_time + frame_index / self.fps
+
+    def tick(self, time):
+        """
+        Return number of frames to advance at given time, in s: 0 to repeat the current frame, 1 to present the next
+        frame, n > 1 to drop n - 1 frames and present the next one
+
+        """
+        due_frame_index = int(math.floor((time - self.start_time) * self.fps))
+        frame_step = due_frame_index - self.frame_index
+        if frame_step <= 0:
+            self.repeated_frame_count += 1
+            return 0
+
+        if frame_step - 1 > self.max_dropped_frames:
+            # too late to catch up, present the next frame now and shift the following deadlines
+            self.start_time = time - (self.frame_index + 1) / self.fps
+            self.resync_count += 1
+            frame_step = 1
+            due_frame_index = self.frame_index + 1
+
+        self.dropped_frame_count += frame_step - 1
+        self.presented_frame_count += 1
+        self.frame_index = due_frame_index
+        self.record_jitter((time - self.get_deadline(due_frame_index)) * 1000)
+        return frame_step
+
+    def record_jitter(self, jitter_ms):
+        for bin_idx, bin_edge_ms in enumerate(JITTER_BIN_EDGES_MS):
+            if jitter_ms < bin_edge_ms:
+                self.jitter_histogram[bin_idx] += 1
+                return
+        self.jitter_histogram[-1] += 1
+
+    def get_delay_ms(self, time):
+        """
+        Return time to wait until the deadline of the next frame, in ms, at least 1 ms to let OpenCV process its GUI
+
+        """
+        # ignore floating-point error, so that an exact 40 ms delay does not become 41 ms
+        delay_ms = int(math.ceil((self.get_deadline(self.frame_index + 1) - time) * 1000 - 1e-6))
+        return max(delay_ms, 1)
+
+    def format_jitter_histogram(self):
+        """
+        Return jitter histogram as a string, one bin per line
+
+        """
+        lines = []
+        lower_edge_ms = 0
+        for bin_edge_ms, count in zip(JITTER_BIN_EDGES_MS, self.jitter_histogram):
+            lines.append('  {:>3}-{:<3} ms: {}'.format(lower_edge_ms, bin_edge_ms, count))
+            lower_edge_ms = bin_edge_ms
+        lines.append('  {:>3}+    ms: {}'.format(lower_edge_ms, self.jitter_histogram[-1]))
+        return '\n'.join(lines)
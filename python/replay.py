@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Offline replay of an event log recorded by the application (see event_log_path in main.py): the sensor events are
+fed to the same state machine as serial messages, on a virtual clock, and the frames are rendered to a video file
+or discarded instead of being shown in a window. No Arduino nor screen is needed.
+
+Enter the python directory and run `python replay.py events.log --output replay.mp4` to reproduce a session, or
+`python replay.py events.log` to print the switch latency (from the sensor event to the first frame of the new
+video, on the virtual clock, including the debounce window), the switch duration and the rendering throughput only.
+Benchmark traces (see benchmark.py) can be replayed too.
+
+The virtual clock does not advance while videos are opened and seeked, so the switch latency only counts the
+debounce window and the frames waited for, and cannot be compared with the latency of live runs (see benchmark.py).
+The switch duration is the time actually spent opening and seeking the new video on the render thread, measured on
+the wall clock: add it to the latency to estimate the latency of a live run.
+
+By default, videos are decoded on the render thread, without capture pool and not prefetched, so that no background
+thread runs and the frames rendered and the switch latencies only depend on the event log and the videos: two
+replays give the same results, and can be compared to detect regressions. The replay runs as fast as frames are
+rendered, unless --realtime is passed.
+
+Run `python replay.py --help` for the other options.
+
+"""
+import argparse
+import time
+
+import main
+import path
+from app import App
+from background_log import flush_log
+from benchmark import format_stat
+from display import NullDisplay, VideoFileDisplay
+from event_log import ReplayClock, SwitchLatencyMixin, load_event_log, replay_event_log
+from metrics import registry
+
+
+class ReplayApp(SwitchLatencyMixin, App):
+    """
+    Application measuring the latency of each video switch on the replay clock, from the time of the last sensor
+    event to the time the first frame of the new video is shown
+    """
+
+    def on_sensor_event(self, event):
+        self.last_event_time = self.clock()
+        super(ReplayApp, self).on_sensor_event(event)
+
+
+def main_replay():
+    parser = argparse.ArgumentParser(description='Offline replay of an event log')
+    parser.add_argument('event_log', help='event log file to replay')
+    parser.add_argument('--output', help='video file to render the frames to, e.g. replay.mp4 (discarded by default)')
+    parser.add_argument('--realtime', action='store_true', help='wait for the deadline of each frame')
+    parser.add_argument('--threaded', action='store_true',
+                        help='decode videos in background threads, pool captures and prefetch them, as configured in '
+                             'main.py '
+                             '(the results then depend on thread scheduling)')
+    parser.add_argument('--tail', type=float, default=1., help='time to render after the last event, in s')
+    parser.add_argument('--video-directory', help='play videos of this directory instead of the videos folder')
+    parser.add_argument('--decode-backend', default='opencv',
+                        help="backend decoding the videos: 'opencv', 'pyav', 'frame_cache' or 'auto' (see main.py)")
+    parser.add_argument('--transition-frame-count', type=int, default=main.transition_frame_count,
+                        help='number of frames of the crossfade between videos, 0 to cut')
+    parser.add_argument('--display-size', help="size of the simulated display to downscale videos to, e.g. '1920x1080'")
+    args = parser.parse_args()
+
+    if args.video_directory is not None:
+        path.VIDEO_DIRECTORY = args.video_directory
+    events = load_event_log(args.event_log)
+
+    display_size = tuple(int(length) for length in args.display_size.split('x')) if args.display_size else None
+    if args.output is not None:
+        # the video file has the frame rate the first video is presented at, known once the application has started
+        display = VideoFileDisplay(args.output, lambda: app.presentation_clock.fps, size=display_size)
+    else:
+        display = NullDisplay(realtime=False, size=display_size)
+    clock = ReplayClock()
+    # nothing is sent on the loopback port, events only come from the log
+    # no keyframe seek: the keyframe index would be written to the project directory
+    app = ReplayApp(main.rfid_uids, main.generate_sensor_state_to_video_name(), 'replay', main.transmission_rate,
+                    main.fps, capture_pool_size=main.capture_pool_size if args.threaded else 0,
+                    capture_pool_memory_mb=main.capture_pool_memory_mb,
+                    prefetch_count=main.prefetch_count if args.threaded else 0,
+                    transition_frame_count=args.transition_frame_count, threaded_decode=args.threaded,
+                    seek_latency_budget_ms=main.seek_latency_budget_ms,
+                    debounce_windows_ms=main.debounce_windows_ms, sensor_value_counts=main.sensor_value_counts,
+                    display=display, serial_port='loop://', decode_backend=args.decode_backend,
+                    scale_to_display=display_size is not None, clock=clock)
+
+    start_time = time.time()
+    try:
+        replay_event_log(app, events, clock, args.tail, args.realtime)
+    finally:
+        if args.output is not None:
+            display.close()
+    duration = time.time() - start_time
+
+    # print summaries after the last messages logged
+    flush_log()
+    print 'Stage durations over the last frames:\n{}'.format(registry.format_summary())
+    app.print_summary()
+    print
+    print 'Replay results:'
+    print '  Events replayed: {}, video switches: {}, stopped videos: {}'.format(
+        len(events), len(app.switch_latencies), app.stopped_switch_count)
+    print '  Switch latency (replay clock): {}'.format(format_stat(app.switch_latencies))
+    print '  Switch duration (wall clock): {}'.format(format_stat(app.switch_durations))
+    print '  Rendered {} frames of {:.1f} s in {:.1f} s ({:.1f} fps, {:.1f}x real time)'.format(
+        display.frame_count, clock(), duration, display.frame_count / duration, clock() / duration)
+    if args.output is not None:
+        print '  Wrote {}'.format(args.output)
+
+
+if __name__ == '__main__':
+    main_replay()
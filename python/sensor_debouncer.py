@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+
+class SensorDebouncer(object):
+    """
+    Settling stage between sensor events and sensor state changes. A sensor value change is only applied once the
+    value has stayed the same for the debounce window of the sensor, so that flickering sensors do not trigger
+    video switches. All changes settled at the same time are applied together, as a single state change.
+
+    Attributes:
+        debounce_windows    [list(float)] time a new value must stay unchanged before being applied, per sensor, in s
+        raw_state           [list] last value received per sensor, settled or not
+        settled_state       [list] last value applied per sensor
+        change_times        [list(float)] time of the last raw value change per sensor, in s
+        applied_transition_count
+                            [int] number of sensor value changes applied
+        suppressed_transition_count
+                            [int] number of sensor value changes replaced or cancelled before settling
+        switch_count        [int] number of state changes applied, each one grouping one or more sensor value changes
+    """
+
+    def __init__(self, initial_state, debounce_windows=None):
+        self.debounce_windows = debounce_windows if debounce_windows is not None else [0.] * len(initial_state)
+        assert len(self.debounce_windows) == len(initial_state)
+        self.raw_state = list(initial_state)
+        self.settled_state = list(initial_state)
+        self.change_times = [0.] * len(initial_state)
+        self.applied_transition_count = 0
+        self.suppressed_transition_count = 0
+        self.switch_count = 0
+
+    def on_sensor_value(self, sensor_idx, value, time):
+        """
+        Register a new value received for a sensor at given time, in s
+
+        """
+        if value == self.raw_state[sensor_idx]:
+            return
+
+        if self.raw_state[sensor_idx] != self.settled_state[sensor_idx]:
+            # previous change has not settled and will never be applied
+            self.suppressed_transition_count += 1
+
+        self.raw_state[sensor_idx] = value
+        self.change_times[sensor_idx] = time
+
+    def settle(self, time):
+        """
+        Apply the sensor value changes that have been stable for their debounce window at given time, in s.
+        Return True if the settled state has changed.
+
+        """
+        changed = False
+        for sensor_idx, value in enumerate(self.raw_state):
+            if value != self.settled_state[sensor_idx] and \
+                    time - self.change_times[sensor_idx] >= self.debounce_windows[sensor_idx]:
+                self.settled_state[sensor_idx] = value
+                self.applied_transition_count += 1
+                changed = True
+
+        if changed:
+            self.switch_count += 1
+        return changed
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+from collections import deque
+
+
+class SensorStateSpace(object):
+    """
+    Space of the states of N sensors, each sensor having its own number of values, where each state is packed
+    into a single integer code (mixed radix, first sensor being the most significant). Codes index flat tables,
+    so mapping a state to its content is O(1).
+
+    Attributes:
+        value_counts    [list(int)] number of values of each sensor, values of sensor i being 0 to value_counts[i] - 1
+        weights         [list(int)] weight of each sensor value in the packed code
+        state_count     [int] number of states, codes being 0 to state_count - 1
+    """
+
+    def __init__(self, value_counts):
+        self.value_counts = list(value_counts)
+        self.weights = [1] * len(self.value_counts)
+        for sensor_idx in xrange(len(self.value_counts) - 2, -1, -1):
+            self.weights[sensor_idx] = self.weights[sensor_idx + 1] * self.value_counts[sensor_idx + 1]
+        self.state_count = self.weights[0] * self.value_counts[0] if self.value_counts else 1
+
+    def pack(self, state):
+        """
+        Return the code of a state (sequence of int or bool values), or -1 if a value is out of range
+
+        """
+        code = 0
+        for value, value_count, weight in zip(state, self.value_counts, self.weights):
+            value = int(value)
+            if not 0 <= value < value_count:
+                return -1
+            code += value * weight
+        return code
+
+    def unpack(self, code):
+        """
+        Return the state of a code, as a tuple of int values
+
+        """
+        return tuple((code // weight) % value_count for value_count, weight in zip(self.value_counts, self.weights))
+
+    def build_table(self, state_to_content):
+        """
+        Return list of contents indexed by state code, from a dictionary of contents per state tuple.
+        States without content have None.
+
+        """
+        table = [None] * self.state_count
+        for state, content in state_to_content.iteritems():
+            code = self.pack(state)
+            if code < 0:
+                print 'WARNING: sensor state {} is out of range, its content will never be played'.format(state)
+                continue
+            table[code] = content
+        return table
+
+    def get_neighbour_codes(self, code):
+        """
+        Yield codes of the states that differ from the state of the given code by the value of a single sensor
+
+        """
+        for value_count, weight in zip(self.value_counts, self.weights):
+            value = (code // weight) % value_count
+            base_code = code - value * weight
+            for other_value in xrange(value_count):
+                if other_value != value:
+                    yield base_code + other_value * weight
+
+    def build_nearest_table(self, table):
+        """
+        Return list of the code of the closest state with content, indexed by state code, -1 if no state has content.
+        The distance between two states is the number of sensors with different values, and ties are broken
+        deterministically. This is a breadth-first search starting from all states with content at once.
+
+        """
+        nearest_codes = [-1] * self.state_count
+        queue = deque()
+        for code, content in enumerate(table):
+            if content is not None:
+                nearest_codes[code] = code
+                queue.append(code)
+
+        while queue:
+            code = queue.popleft()
+            for neighbour_code in self.get_neighbour_codes(code):
+                if nearest_codes[neighbour_code] < 0:
+                    nearest_codes[neighbour_code] = nearest_codes[code]
+                    queue.append(neighbour_code)
+
+        return nearest_codes
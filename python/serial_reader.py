@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+import threading
+from collections import deque, namedtuple
+
+import serial
+import serial.tools.list_ports
+
+# kinds of sensor events, see main.py docstring for the corresponding messages
+RFID_DETECTED = 'rfid_detected'
+RFID_LOST = 'rfid_lost'
+PHOTO_DETECTED = 'photo_detected'
+PHOTO_LOST = 'photo_lost'
+
+# sensor event parsed from a serial message, value being the UID string for RFID events and the photoresistor ID
+# (1 to 3) for photo events
+SensorEvent = namedtuple('SensorEvent', ['kind', 'value'])
+
+
+# prefix of each text sensor message, followed by ': ' and the UID for RFID messages or the photoresistor ID
+# for photo messages
+LINE_PREFIX_TO_KIND = {
+    'UID Value': RFID_DETECTED,
+    'Lost UID Value': RFID_LOST,
+    'Photo': PHOTO_DETECTED,
+    'Lost Photo': PHOTO_LOST,
+}
+# prefix of the text message of each kind of sensor event, to write events in the same format (see event_log.py)
+KIND_TO_LINE_PREFIX = {kind: prefix for prefix, kind in LINE_PREFIX_TO_KIND.iteritems()}
+# kinds of the messages followed by a photoresistor ID, to be converted to int
+PHOTO_KINDS = frozenset((PHOTO_DETECTED, PHOTO_LOST))
+
+# compact binary sensor messages are framed as [FRAME_START, type, payload length, payload...]
+# payload being the UID bytes for RFID messages or the photoresistor ID byte for photo messages
+FRAME_START = '\xa5'
+FRAME_TYPE_TO_KIND = {
+    0x01: RFID_DETECTED,
+    0x02: RFID_LOST,
+    0x03: PHOTO_DETECTED,
+    0x04: PHOTO_LOST,
+}
+# text format of each UID byte, e.g. '0x4F'
+UID_BYTE_TO_TEXT = {chr(byte): '0x{:02X}'.format(byte) for byte in xrange(256)}
+
+
+def parse_sensor_line(line):
+    """
+    Return the SensorEvent of a stripped line received from the serial port, or None if the line is not a sensor message.
+    Raise ValueError if the line is a photo message with an invalid photoresistor ID.
+
+    """
+    # single pass on the prefix, then lookup of the message kind
+    prefix, separator, value = line.partition(': ')
+    kind = LINE_PREFIX_TO_KIND.get(prefix)
+    if kind is None or not separator:
+        return None
+
+    if kind in PHOTO_KINDS:
+        # photo ID from 1 to 3
+        return SensorEvent(kind, int(value))
+
+    # keep UID string value, invalid UIDs will not be found when looking up the RFID index
+    return SensorEvent(kind, value)
+
+
+def format_sensor_line(event):
+    """
+    Return the text sensor message of a SensorEvent, without line ending (inverse of parse_sensor_line)
+
+    """
+    return '{}: {}'.format(KIND_TO_LINE_PREFIX[event.kind], event.value)
+
+
+def parse_sensor_frame(frame_type, payload):
+    """
+    Return the SensorEvent of a binary frame received from the serial port, or None if the frame type is unknown.
+    UIDs are converted to the text format, so that they can be looked up the same way as in text messages.
+
+    """
+    kind = FRAME_TYPE_TO_KIND.get(frame_type)
+    if kind is None:
+        return None
+
+    if kind in PHOTO_KINDS:
+        return SensorEvent(kind, ord(payload[0]))
+
+    return SensorEvent(kind, ' '.join(UID_BYTE_TO_TEXT[byte] for byte in payload))
+
+
+class SerialReader(object):
+    """
+    Background thread reading the serial port, parsing sensor messages as they arrive and queuing sensor events,
+    so that the render thread never blocks on serial input. The thread also (re)connects to the first serial port
+    found when no port is open, or to the given port if any.
+
+    Attributes:
+        serial              [Serial] serial configuration to receive Arduino signal
+        port                [string] device or pySerial URL of the port to listen to (e.g. a pty simulating Arduino
+                            or 'loop://'), None to detect the first serial port connected
+        reconnect_interval  [float] time to wait between two serial port detections while no port is open, in seconds
+        events              [deque(SensorEvent)] events received and not polled yet. deque appends and pops are
+                            atomic, so the reader thread and the render thread can use it without lock.
+    """
+
+    def __init__(self, transmission_rate=9600, timeout=0.1, reconnect_interval=1., port=None):
+        # timeout only bounds the time needed to stop the reader thread, since it does not block rendering anymore
+        if port is not None:
+            self.serial = serial.serial_for_url(port, baudrate=transmission_rate, timeout=timeout, do_not_open=True)
+        else:
+            self.serial = serial.Serial(baudrate=transmission_rate, timeout=timeout)
+        self.port = port
+        self.reconnect_interval = reconnect_interval
+        self.events = deque()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        assert self._thread is None, 'Serial reader already started'
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._read_loop, name='SerialReader')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+        if self.serial.is_open:
+            self.serial.close()
+
+    def poll_events(self):
+        """
+        Yield all events received since last poll, without blocking
+
+        """
+        while True:
+            try:
+                yield self.events.popleft()
+            except IndexError:
+                return
+
+    def _read_loop(self):
+        while not self._stop_event.is_set():
+            if not self.serial.is_open:
+                # no port device connected yet or previous device connection was lost
+                # detect any existing serial port
+                self.open_connected_port()
+                if not self.serial.is_open:
+                    self._stop_event.wait(self.reconnect_interval)
+                    continue
+            self.read_serial()
+
+    def open_connected_port(self):
+        """
+        Check if a new port was connected or seek a new serial port (often '/dev/ttyACM0' or '/dev/ttyACM1' on Unix)
+        if the current port is not valid, and start listening to this port
+
+        """
+        if self.port is not None:
+            # fixed port, only reopen it
+            try:
+                self.serial.open()
+            except serial.SerialException as e:
+                print 'Could not open serial port {}: {}'.format(self.port, e)
+                return
+            print 'Open serial port: {}'.format(self.port)
+            return
+
+        ports = list(serial.tools.list_ports.comports())
+
+        if len(ports) == 0:
+            # print 'No serial ports found'
+            return
+
+        if self.serial.is_open and self.serial.port in (p.device for p in ports):
+            # Current port device still in list, keep it (if possible, do not call this method if already a port!)
+            print 'Keep current serial port ({})'.format(self.serial.port)
+        else:
+            # No current port device or the current device was lost, choose an arbitrary one
+            self.serial.port = ports[0].device
+            try:
+                self.serial.open()
+            except serial.SerialException as e:
+                print 'Could not open serial port {}: {}'.format(self.serial.port, e)
+                return
+            print 'Open serial port: {}'.format(self.serial.port)
+
+    def read_serial(self):
+        """
+        Read one message received at serial port, text line or binary frame, and queue the corresponding event
+
+        """
+        # try-catch adapted from http://stackoverflow.com/questions/28509398/handle-exception-in-pyserial-during-disconnection
+        try:
+            first_byte = self.serial.read(1)
+            if first_byte == FRAME_START:
+                self.read_serial_frame()
+                return
+            line = first_byte + self.serial.readline() if first_byte else ''
+        except serial.SerialException:
+            # Lost connection with Arduino
+            print 'Lost connection with Arduino'
+            # close port (port does not seem to close when plugging Arduino out); you can keep last port in self.serial.port
+            self.serial.close()
+            return
+        except TypeError as e:
+            # We lost connection with Arduino, close port and detect another port if possible
+            print 'Disconnect of USB->UART occured'
+            print 'error: {}'.format(e)
+            self.serial.close()
+            return
+
+        if not line:
+            return
+
+        # Some data was received
+        line = line.strip()
+
+        # DEBUG
+        # print 'line: {}'.format(line)
+
+        try:
+            event = parse_sensor_line(line)
+        except (IndexError, ValueError):
+            print 'Could not parse serial message: {}'.format(line)
+            return
+
+        if event is not None:
+            self.events.append(event)
+
+    def read_serial_frame(self):
+        """
+        Read the rest of a binary frame whose start byte has been received and queue the corresponding event
+
+        """
+        header = self.serial.read(2)
+        if len(header) < 2:
+            print 'Incomplete binary serial message'
+            return
+
+        frame_type, payload_length = ord(header[0]), ord(header[1])
+        payload = self.serial.read(payload_length)
+        if len(payload) < max(payload_length, 1):
+            print 'Incomplete binary serial message'
+            return
+
+        event = parse_sensor_frame(frame_type, payload)
+        if event is not None:
+            self.events.append(event)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests of the decoding backends on a generated clip, for each backend available in this environment (PyAV is only
+tested if it is installed). Enter the python directory and run `python -m unittest discover -p 'test_*.py'`.
+
+"""
+import os
+import unittest
+
+import cv2
+import numpy as np
+
+import decode_backend
+from clip_test_case import CLIP_FRAME_COUNT, CLIP_SIZE, AllocationCounter, ClipTestCase
+from decode_backend import OPENCV_BACKEND, PYAV_BACKEND, get_available_backends, get_capture_factory, \
+    measure_decode_throughput, select_decode_backend
+
+# maximum mean difference between the frames decoded by two backends, which may convert colours differently
+MAX_BACKEND_FRAME_DIFFERENCE = 4.
+
+
+def read_all_frames(capture):
+    """
+    Return copies of the frames of a capture from its current position to the end
+
+    """
+    frames = []
+    while True:
+        ret, frame = capture.read()
+        if not ret:
+            return frames
+        frames.append(frame.copy())
+
+
+def find_closest_frame(frames, frame):
+    """
+    Return index of the frame of the list closest to the given frame (encoding is lossy, so frames are not equal)
+
+    """
+    differences = [np.mean(cv2.absdiff(frame, other_frame)) for other_frame in frames]
+    return int(np.argmin(differences))
+
+
+class DecodeBackendTest(ClipTestCase):
+
+    def open_capture(self, backend):
+        capture = get_capture_factory(backend)(self.video_path)
+        self.assertTrue(capture.isOpened(), 'backend {} cannot open the clip'.format(backend))
+        self.addCleanup(capture.release)
+        return capture
+
+    def test_frame_count(self):
+        for backend in get_available_backends():
+            capture = self.open_capture(backend)
+            self.assertEqual(int(capture.get(cv2.CAP_PROP_FRAME_COUNT)), CLIP_FRAME_COUNT, backend)
+            self.assertEqual(len(read_all_frames(capture)), CLIP_FRAME_COUNT, backend)
+
+    def test_frame_size(self):
+        for backend in get_available_backends():
+            capture = self.open_capture(backend)
+            self.assertEqual((int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))),
+                             CLIP_SIZE, backend)
+            ret, frame = capture.read()
+            self.assertTrue(ret, backend)
+            self.assertEqual(frame.shape, (CLIP_SIZE[1], CLIP_SIZE[0], 3), backend)
+
+    def test_seek_is_frame_accurate(self):
+        for backend in get_available_backends():
+            capture = self.open_capture(backend)
+            frames = read_all_frames(capture)
+            # first frame, frames between keyframes, last frame, and backward seeks
+            for target_frame in (0, 7, 13, 29, 3):
+                self.assertTrue(capture.set(cv2.CAP_PROP_POS_FRAMES, target_frame), backend)
+                ret, frame = capture.read()
+                self.assertTrue(ret, '{}: cannot read frame {} after seek'.format(backend, target_frame))
+                self.assertEqual(find_closest_frame(frames, frame), target_frame,
+                                 '{}: seek to frame {} is not frame-accurate'.format(backend, target_frame))
+
+    def test_read_reuses_buffer(self):
+        for backend in get_available_backends():
+            capture = self.open_capture(backend)
+            buffer = np.empty((CLIP_SIZE[1], CLIP_SIZE[0], 3), np.uint8)
+            for _ in xrange(5):
+                ret, frame = capture.read(buffer)
+                self.assertTrue(ret, backend)
+                self.assertIs(frame, buffer, '{} did not decode into the given buffer'.format(backend))
+
+    @unittest.skipUnless(PYAV_BACKEND in get_available_backends(), 'PyAV is not installed')
+    def test_pyav_read_converts_into_buffer(self):
+        opencv_frames = read_all_frames(self.open_capture(OPENCV_BACKEND))
+        capture = self.open_capture(PYAV_BACKEND)
+        # the conversion by FFmpeg allocates a frame at each read, it must only be used to downscale
+        capture._convert_frame = lambda bgr_av_frame, frame: self.fail('frame was converted by FFmpeg')
+        buffer = np.empty((CLIP_SIZE[1], CLIP_SIZE[0], 3), np.uint8)
+        capture.read(buffer)
+        allocation_counter = AllocationCounter()
+        allocation_counter.install()
+        try:
+            for frame_idx in xrange(1, CLIP_FRAME_COUNT):
+                ret, frame = capture.read(buffer)
+                self.assertTrue(ret)
+                self.assertIs(frame, buffer)
+                self.assertLess(np.mean(cv2.absdiff(frame, opencv_frames[frame_idx])), MAX_BACKEND_FRAME_DIFFERENCE)
+        finally:
+            allocation_counter.uninstall()
+        self.assertEqual(allocation_counter.count, 0)
+
+    def test_measure_decode_throughput(self):
+        for backend in get_available_backends():
+            self.assertGreater(measure_decode_throughput(backend, self.video_path, frame_count=10), 0, backend)
+        self.assertIsNone(measure_decode_throughput(OPENCV_BACKEND, os.path.join(self.video_directory, 'missing.mp4')))
+
+    def test_select_fastest_backend(self):
+        original_measure_decode_throughput = decode_backend.measure_decode_throughput
+        self.addCleanup(setattr, decode_backend, 'measure_decode_throughput', original_measure_decode_throughput)
+        for fastest_backend in get_available_backends():
+            decode_backend.measure_decode_throughput = \
+                lambda backend, video_path, frame_count: 1000. if backend == fastest_backend else 10.
+            self.assertEqual(select_decode_backend(self.video_path, use_frame_cache=False), fastest_backend)
+
+    def test_select_backend_of_unplayable_video(self):
+        missing_video_path = os.path.join(self.video_directory, 'missing.mp4')
+        self.assertEqual(select_decode_backend(missing_video_path, use_frame_cache=False), OPENCV_BACKEND)
+
+
+if __name__ == '__main__':
+    unittest.main()
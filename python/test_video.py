@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests that the steady-state render path of Video reuses its frame buffers instead of allocating frames, on a
+generated clip, for the OpenCV and PyAV backends (if PyAV is installed), decoding on the render thread or in the
+background. Enter the python directory and run `python -m unittest discover -p 'test_*.py'`.
+
+"""
+import time
+import unittest
+
+from clip_test_case import CLIP_FRAME_COUNT, CLIP_SIZE, AllocationCounter, ClipTestCase
+from decode_backend import get_available_backends, get_capture_factory
+from video import Video
+
+# number of frames played before checking allocations, so that all buffers have been allocated once
+WARM_UP_FRAME_COUNT = 5
+# number of frames played while checking allocations, more than the clip so that looping is covered
+STEADY_FRAME_COUNT = 2 * CLIP_FRAME_COUNT
+
+# maximum time to wait for a frame decoded in the background, in s
+DECODE_TIMEOUT = 5.
+
+
+class RecordingDisplay(object):
+    """
+    Display keeping the frames shown, to check which buffers they are
+
+    Attributes:
+        frames      [list(ndarray)] frames shown, in order
+    """
+
+    def __init__(self):
+        self.frames = []
+
+    def open(self):
+        pass
+
+    def get_size(self):
+        return None
+
+    def show(self, frame):
+        self.frames.append(frame)
+
+    def wait_key(self, delay_ms):
+        return -1
+
+    def toggle_fullscreen(self):
+        pass
+
+
+class VideoAllocationTest(ClipTestCase):
+
+    def open_video(self, backend, threaded, target_size=None):
+        display = RecordingDisplay()
+        video = Video('test', display=display, threaded=threaded, capture_factory=get_capture_factory(backend),
+                      target_size=target_size)
+        video.open(self.video_path, looping=True)
+        self.assertTrue(video.is_open, backend)
+        self.addCleanup(video.close)
+        return video, display
+
+    def play_frames(self, video, display, frame_count):
+        """
+        Update video until frame_count more frames have been shown, waiting for background decoding if needed
+
+        """
+        shown_frame_count = len(display.frames) + frame_count
+        deadline = time.time() + DECODE_TIMEOUT
+        while len(display.frames) < shown_frame_count:
+            self.assertLess(time.time(), deadline, 'decoding timed out')
+            if not video.play_next_frame():
+                time.sleep(0.001)
+
+    def play_steady_frames(self, video, display):
+        """
+        Return (frames shown, number of allocations) while playing STEADY_FRAME_COUNT frames after warming up
+
+        """
+        self.play_frames(video, display, WARM_UP_FRAME_COUNT)
+        del display.frames[:]
+        allocation_counter = AllocationCounter()
+        allocation_counter.install()
+        try:
+            self.play_frames(video, display, STEADY_FRAME_COUNT)
+        finally:
+            allocation_counter.uninstall()
+        return display.frames, allocation_counter.count
+
+    def assert_same_buffers(self, frames, buffers, message):
+        buffer_ids = set(id(buffer) for buffer in buffers)
+        self.assertTrue(all(id(frame) in buffer_ids for frame in frames), message)
+
+    def test_decoding_reuses_buffer(self):
+        for backend in get_available_backends():
+            video, display = self.open_video(backend, threaded=False)
+            frames, allocation_count = self.play_steady_frames(video, display)
+            self.assertEqual(allocation_count, 0, backend)
+            self.assert_same_buffers(frames, [video.frame],
+                                     '{}: frames were not decoded into one buffer'.format(backend))
+
+    def test_threaded_decoding_reuses_ring(self):
+        for backend in get_available_backends():
+            video, display = self.open_video(backend, threaded=True)
+            ring_buffers = list(video.frame_reader.buffers)
+            frames, allocation_count = self.play_steady_frames(video, display)
+            self.assertEqual(allocation_count, 0, backend)
+            self.assertEqual([id(buffer) for buffer in video.frame_reader.buffers],
+                             [id(buffer) for buffer in ring_buffers],
+                             '{}: frame buffers of the ring were replaced'.format(backend))
+            self.assert_same_buffers(frames, ring_buffers, '{}: frames were not decoded into the ring'.format(backend))
+
+    def test_downscaling_reuses_buffer(self):
+        target_size = (CLIP_SIZE[0] // 2, CLIP_SIZE[1] // 2)
+        for backend in get_available_backends():
+            for threaded in (False, True):
+                video, display = self.open_video(backend, threaded, target_size)
+                frames, allocation_count = self.play_steady_frames(video, display)
+                self.assertEqual(allocation_count, 0, (backend, threaded))
+                self.assertTrue(all(frame.shape[:2] == (target_size[1], target_size[0]) for frame in frames),
+                                (backend, threaded))
+                # frames are downscaled into the ring in the background, or into one scratch buffer else
+                buffers = video.frame_reader.buffers if threaded else video.frame_buffers.scratch_buffers.values()
+                self.assert_same_buffers(frames, buffers, '{}: frames were not downscaled into the same buffers'
+                                         .format((backend, threaded)))
+
+    def test_blank_frame_is_reused(self):
+        video, display = self.open_video(get_available_backends()[0], threaded=False)
+        video.show_blank()
+        allocation_counter = AllocationCounter()
+        allocation_counter.install()
+        try:
+            for _ in xrange(3):
+                video.show_blank()
+        finally:
+            allocation_counter.uninstall()
+        self.assertEqual(allocation_counter.count, 0)
+        self.assertEqual(len(set(id(frame) for frame in display.frames)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,14 @@
 # -*- coding: utf-8 -*-
 import cv2
-import numpy as np
 
+from background_log import log
+from display import WindowDisplay
+from frame_buffers import FrameBuffers, get_fitting_size
+from frame_cache import load_frame_cache
+from frame_reader import FrameReader
+from keyframe_index import seek_frame
+from metrics import record_duration
+from presentation_clock import get_time
 from path import get_video_path
 
 
@@ -11,17 +18,53 @@ class Video(object):
 
     Attributes:
         window_name     [string] name of the OpenCV window to play this video in
+        display         [WindowDisplay or NullDisplay] where frames are shown, the window of window_name by default
         filename        [string] path to video file
         looping         [bool] is the video looping?
-        capture         [VideoCapture] OpenCV video capture of the video clip
+        capture_factory [function] function creating an empty video capture of the decoding backend, cv2.VideoCapture
+                        by default (see decode_backend.py)
+        capture         [VideoCapture or PyAVCapture] video capture of the video clip
+        frame           [ndarray] decoding buffer when not threaded, reused by OpenCV as long as the video size does not
+                        change
+        frame_buffers   [FrameBuffers] preallocated output frames per resolution (blank frames, blending buffers)
+        target_size     [(int, int)] maximum (width, height) of the frames shown, usually the display size, frames
+                        bigger than this being downscaled once (keeping their aspect ratio) instead of by the window at
+                        every show, None to show frames at their own size
         frame_counter   [int] next frame index to play
+        capture_pool    [CapturePool] optional pool of open captures used by open_same_frame, None to open files directly
+        pooled_capture  [PooledCapture] capture acquired from the pool and currently played, None if not using the pool
+        frame_reader    [FrameReader] background decoder of the capture in threaded mode, None to decode on update
+                        (its thread is pinned to decode_cpu_cores if given)
+        use_frame_cache [bool] should videos be played from raw frame caches on disk instead of being decoded?
+                        (capture pool and threaded mode are not used in this mode)
+        frame_cache     [FrameCache] frames of the current video in frame cache mode, None if no video is open
+        keyframe_index  [KeyframeIndex] optional index of keyframes used by open_same_frame for frame-accurate seeking
+        seek_latency_budget_ms
+                        [float] maximum time to spend decoding forward from a keyframe when seeking, None for no limit
+        last_switch_latency_ms
+                        [float] time spent in the last call to open_same_frame, -1 if it was not called yet
     """
 
-    def __init__(self, window_name, filename='', looping=False):
+    def __init__(self, window_name, filename='', looping=False, capture_pool=None, threaded=False, ring_size=4,
+                 use_frame_cache=False, keyframe_index=None, seek_latency_budget_ms=None, display=None,
+                 capture_factory=cv2.VideoCapture, target_size=None, decode_cpu_cores=None):
         self.window_name = window_name
+        self.display = display if display is not None else WindowDisplay(window_name)
         self.filename = filename
+        self.capture_factory = capture_factory
         # prepare an empty video wrapper (common usage in this application)
-        self.capture = cv2.VideoCapture()
+        self.capture = capture_factory()
+        self.frame = None
+        self.frame_buffers = FrameBuffers()
+        self.target_size = target_size
+        self.capture_pool = capture_pool
+        self.pooled_capture = None
+        self.frame_reader = FrameReader(ring_size, decode_cpu_cores) if threaded else None
+        self.use_frame_cache = use_frame_cache
+        self.frame_cache = None
+        self.keyframe_index = keyframe_index
+        self.seek_latency_budget_ms = seek_latency_budget_ms
+        self.last_switch_latency_ms = -1
         self.frame_counter = -1
         self.looping = looping
 
@@ -34,68 +77,212 @@ class Video(object):
         Open video at the beginning
 
         """
-        print 'Open video file {}'.format(filename)
+        log('Open video file {}'.format(filename))
+        if self.use_frame_cache:
+            self.open_frame_cache(filename, 0, looping)
+            return
+
+        self.stop_frame_reader()
+        self.release_pooled_capture()
+        start_time = get_time()
         success = self.capture.open(filename)  # will also release previous video if any still active
+        record_duration('open', (get_time() - start_time) * 1000)
         if not success:
-            print 'Could not open video file'
+            log('Could not open video file')
             return
 
         self.looping = looping
         self.frame_counter = 0
+        self.start_frame_reader()
 
-    def open_same_frame(self, filename, looping=False):
+    def open_same_frame(self, filename, looping=False, frame_counter=None):
         """
         Open video at same frame as the previous video, or 0 if no previous video.
         Prefer this method with looping and all videos, and with the same duration
+        If frame_counter is given, open video at this frame instead (e.g. the frame of a video played by another Video)
 
         """
         # absolute path with backslash on Windows
         # see http://stackoverflow.com/questions/21773850/error-opening-file-home-vaibhav-opencv-modules-highgui-src-cap-ffmpeg-impl-hpp
         filename = get_video_path(filename)
-        print 'Opening video file {} at same frame'.format(filename)
-        frame_counter = self.frame_counter if self.is_open else 0
-        success = self.capture.open(filename)  # will also release previous video if any still active
-        if not success:
-            print 'Could not open video file'
+        log('Opening video file {} at same frame'.format(filename))
+        start_tick = cv2.getTickCount()
+        if frame_counter is None:
+            frame_counter = self.frame_counter if self.is_open else 0
+        if self.use_frame_cache:
+            self.open_frame_cache(filename, frame_counter, looping)
+            return
+
+        self.stop_frame_reader()
+
+        if self.capture_pool is not None:
+            # flip to an already open capture, positioned at the same frame by the pool
+            pooled_capture = self.capture_pool.acquire(filename, frame_counter)
+            if pooled_capture is None:
+                log('Could not open video file')
+                # keep playing the previous video
+                self.start_frame_reader()
+                return
+            if self.pooled_capture is not None:
+                self.release_pooled_capture()
+            else:
+                self.capture.release()
+            self.pooled_capture = pooled_capture
+            self.capture = pooled_capture.capture
+            reached_frame_counter = pooled_capture.frame_counter
+        else:
+            open_start_time = get_time()
+            success = self.capture.open(filename)  # will also release previous video if any still active
+            record_duration('open', (get_time() - open_start_time) * 1000)
+            if not success:
+                log('Could not open video file')
+                return
+            # warp at same time as previous video
+            keyframes = self.keyframe_index.get_keyframes(filename) if self.keyframe_index is not None else None
+            reached_frame_counter = seek_frame(self.capture, 0, frame_counter, keyframes, self.seek_latency_budget_ms)
+
+        self.looping = looping
+        self.frame_counter = reached_frame_counter
+        self.start_frame_reader()
+
+        self.last_switch_latency_ms = (cv2.getTickCount() - start_tick) * 1000. / cv2.getTickFrequency()
+        record_duration('switch', self.last_switch_latency_ms)
+        log('Switched video in {:.1f} ms, at frame {} (target {})'.format(
+            self.last_switch_latency_ms, reached_frame_counter, frame_counter))
+
+    def open_frame_cache(self, filename, frame_counter, looping):
+        """
+        Open frame cache of video at given frame, building the cache first if needed
+
+        """
+        frame_cache = load_frame_cache(filename)
+        if frame_cache is None:
+            log('Could not open video file')
             return
 
+        self.frame_cache = frame_cache
         self.looping = looping
-        # warp at same time as previous video
-        self.capture.set(cv2.CAP_PROP_POS_FRAMES, frame_counter)
+        # seeking is just indexing
+        self.frame_counter = frame_counter % frame_cache.frame_count
 
-    def close(self):
+    def start_frame_reader(self):
         """
-        Close video and show blank image
+        Start decoding the current capture in the background, in threaded mode
 
         """
-        if self.is_open:
-            self.show_blank()
-            self.capture.release()
+        if self.frame_reader is not None and self.is_open:
+            # downscale in the background too
+            self.frame_reader.start(self.capture, self.frame_counter, self.looping, self.get_shown_size())
+
+    def stop_frame_reader(self):
+        """
+        Stop decoding the current capture in the background, so that it can be released or replaced
+
+        """
+        if self.frame_reader is not None:
+            self.frame_reader.stop()
+
+    def release_pooled_capture(self):
+        """
+        Give back the current capture to the pool, if any, and replace it with an empty capture
+
+        """
+        if self.pooled_capture is not None:
+            # in threaded mode, the capture has decoded ahead of the frame shown: give it back at its actual position,
+            # the pool does not sync it until the active video has caught up, so the lead does not last
+            if self.frame_reader is not None:
+                frame_counter = self.frame_reader.decode_frame_counter
+            else:
+                frame_counter = self.frame_counter
+            self.capture_pool.release(self.pooled_capture, frame_counter)
+            self.pooled_capture = None
+            self.capture = self.capture_factory()
+
+    def close(self, clear=True):
+        """
+        Close video and show blank image, unless clear is False (e.g. when another video is already shown)
+
+        """
+        if self.frame_cache is not None:
+            if clear:
+                self.show_blank()
+            self.frame_cache = None
+            self.frame_counter = -1
+        elif self.is_open:
+            if clear:
+                self.show_blank()
+            self.stop_frame_reader()
+            if self.pooled_capture is not None:
+                self.release_pooled_capture()
+            else:
+                self.capture.release()
             self.frame_counter = -1
 
     @property
     def is_open(self):
-        return self.capture.isOpened()
+        return self.frame_cache is not None or self.capture.isOpened()
+
+    @property
+    def fps(self):
+        """Frame rate of the current video, 0 if unknown or no video is open"""
+        if self.frame_cache is not None:
+            return self.frame_cache.fps
+        return self.capture.get(cv2.CAP_PROP_FPS) if self.capture.isOpened() else 0
+
+    def update(self, sync_pool=True):
+        """
+        Play next frame, and sync the idle captures of the pool to it unless sync_pool is False
+        (e.g. when another Video sharing the pool already does it)
 
-    def update(self):
-        if self.capture.isOpened():
-            self.play_next_frame()
+        """
+        if self.is_open:
+            advanced = self.play_next_frame()
+            if advanced and sync_pool and self.capture_pool is not None:
+                # keep idle captures at the same frame as this one (not when decoding was late, the video did not move)
+                self.capture_pool.sync(self.frame_counter)
+
+    def skip_frames(self, frame_count):
+        """
+        Advance video by frame_count frames without showing them, to catch up when presentation is late
 
-    def play_next_frame(self):
+        """
+        advanced = False
+        for _ in xrange(frame_count):
+            if not self.is_open:
+                break
+            advanced = self.play_next_frame(show=False) or advanced
+        if advanced and self.capture_pool is not None:
+            self.capture_pool.sync(self.frame_counter)
+
+    def play_next_frame(self, show=True):
         """
         Play next frame or video, or 1st frame if video is looping has reached its end
+        If show is False, only advance to the next frame (decoding it without retrieving it if needed)
+        Return True if the video advanced, False if it stayed at the same frame (ended, or decoding was late)
 
         """
-        ret, frame = self.capture.read()
+        if self.frame_cache is not None:
+            return self.play_next_cached_frame(show)
+
+        if self.frame_reader is not None:
+            return self.play_next_decoded_frame(show)
+
+        if show:
+            ret, frame = self.capture.read(self.frame)
+        else:
+            ret = self.capture.grab()
         # assert ret, 'Video capture: cannot read next frame; video seems to have ended without looping or closing'
 
         # if no frame could be read, it means the video has ended and is *not* looping
         # then clear window with a last empty frame
         if ret:
-            cv2.imshow(self.window_name, frame)
+            if show:
+                self.frame = frame
+                self.show_frame(frame)
         else:
-            self.show_blank()
-            return
+            if show:
+                self.show_blank()
+            return False
 
         # http://stackoverflow.com/questions/17158602/playback-loop-option-in-opencv-videos
         self.frame_counter += 1
@@ -107,6 +294,82 @@ class Video(object):
                 self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
             else:
                 pass
+        return True
+
+    def play_next_cached_frame(self, show=True):
+        """
+        Play next frame from the frame cache, restarting or showing a blank frame at the end
+        Return True if the video advanced
+
+        """
+        if self.frame_counter >= self.frame_cache.frame_count:
+            # the video has ended and is *not* looping
+            if show:
+                self.show_blank()
+            return False
+
+        if show:
+            self.show_frame(self.frame_cache.frames[self.frame_counter])
+
+        self.frame_counter += 1
+        if self.frame_counter == self.frame_cache.frame_count and self.looping:
+            self.frame_counter = 0
+        return True
+
+    def play_next_decoded_frame(self, show=True):
+        """
+        Play next frame decoded in the background, or keep showing the current frame if decoding is late
+        Return True if the video advanced
+
+        """
+        decoded_frame = self.frame_reader.take()
+        if decoded_frame is None:
+            if self.frame_reader.ended and show:
+                # the video has ended and is *not* looping
+                self.show_blank()
+            return False
+
+        slot, frame_counter = decoded_frame
+        if show:
+            self.display.show(self.frame_reader.buffers[slot])  # imshow copies the frame, so recycle it now
+        self.frame_reader.recycle(slot)
+
+        self.frame_counter = frame_counter + 1
+        if self.frame_counter == self.frame_reader.frame_count and self.looping:
+            self.frame_counter = 0
+        return True
+
+    def get_shown_size(self):
+        """
+        Return (width, height) of the frames of the current video once downscaled to the target size, None if no video
+        is open
+
+        """
+        if self.frame_cache is not None:
+            height, width = self.frame_cache.frames.shape[1:3]
+        elif self.capture.isOpened():
+            # VisibleDeprecationWarning: using a non-integer number instead of an integer will result in an error in the future
+            height = int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            width = int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+        else:
+            return None
+        return get_fitting_size((width, height), self.target_size)
+
+    def show_frame(self, frame):
+        """
+        Show frame, downscaling it first into a preallocated buffer if it is bigger than the target size
+
+        """
+        height, width = frame.shape[:2]
+        shown_width, shown_height = get_fitting_size((width, height), self.target_size)
+        if (shown_width, shown_height) != (width, height):
+            start_time = get_time()
+            shown_frame = self.frame_buffers.get_scratch_buffer('scaled', shown_height, shown_width)
+            # bilinear is fast and good enough for moderate ratios, transcode variants for large ones
+            cv2.resize(frame, (shown_width, shown_height), shown_frame, interpolation=cv2.INTER_LINEAR)
+            record_duration('scale', (get_time() - start_time) * 1000)
+            frame = shown_frame
+        self.display.show(frame)
 
     def show_blank(self):
         """
@@ -114,11 +377,8 @@ class Video(object):
         Useful to prevent window from showing the last frame of the video 'frozen' when a video stops
 
         """
-        if self.capture.isOpened:
-            height = self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT)
-            width = self.capture.get(cv2.CAP_PROP_FRAME_WIDTH)
-            # VisibleDeprecationWarning: using a non-integer number instead of an integer will result in an error in the future
-            # print height, width
-            white_frame = np.zeros((int(height), int(width), 3), np.uint8)
-            white_frame[:] = (255, 255, 255)
-            cv2.imshow(self.window_name, white_frame)
+        shown_size = self.get_shown_size()
+        if shown_size is not None:
+            width, height = shown_size
+            # the white frame is filled once per size, then reused at every close and end of video
+            self.display.show(self.frame_buffers.get_blank_frame(height, width))
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import subprocess
+
+import cv2
+
+from frame_buffers import get_fitting_size
+
+
+def get_variant_directory(video_directory, size):
+    """
+    Return path to the directory of the variants of the videos of video_directory transcoded for a display size,
+    next to it (e.g. 'videos_1920x1080')
+
+    """
+    return '{}_{}x{}'.format(os.path.normpath(video_directory), size[0], size[1])
+
+
+def find_variant_directory(video_directory, video_names, size):
+    """
+    Return path to the variant directory for the display size if it has an up-to-date variant of all the videos,
+    None else (it is not worth mixing variants and original videos of different sizes)
+
+    """
+    variant_directory = get_variant_directory(video_directory, size)
+    if not os.path.isdir(variant_directory):
+        return None
+    for video_name in video_names:
+        video_path = os.path.join(video_directory, video_name)
+        variant_path = os.path.join(variant_directory, video_name)
+        if not os.path.isfile(variant_path):
+            return None
+        if os.path.isfile(video_path) and os.path.getmtime(variant_path) < os.path.getmtime(video_path):
+            return None
+    return variant_directory
+
+
+def transcode_videos(video_directory, video_names, size, ffmpeg_path='ffmpeg'):
+    """
+    Write a variant of each video fitting in the display size into the variant directory, skipping the variants that
+    are up-to-date. This decodes and encodes all the videos, so run it offline, not on the show machine at startup.
+
+    """
+    variant_directory = get_variant_directory(video_directory, size)
+    if not os.path.isdir(variant_directory):
+        os.makedirs(variant_directory)
+
+    for video_name in video_names:
+        video_path = os.path.join(video_directory, video_name)
+        variant_path = os.path.join(variant_directory, video_name)
+        if not os.path.isfile(video_path):
+            print 'Video file {} not found, cannot transcode it'.format(video_path)
+            continue
+        if os.path.isfile(variant_path) and os.path.getmtime(variant_path) >= os.path.getmtime(video_path):
+            continue
+        transcode_video(video_path, variant_path, size, ffmpeg_path)
+
+
+def transcode_video(video_path, variant_path, size, ffmpeg_path='ffmpeg'):
+    """
+    Write a variant of a video downscaled to fit in size, keeping its aspect ratio, frame rate and frame count.
+    Encode it with ffmpeg, or with OpenCV if ffmpeg cannot be run. Return True on success.
+    The variant is written next to its final path and renamed at the end, so a partial variant is never used.
+
+    """
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        print 'Could not open video file {}'.format(video_path)
+        return False
+    video_size = (int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    width, height = get_fitting_size(video_size, size)
+    if (width, height) == video_size:
+        capture.release()
+        print 'Copy video file {} which already fits in {}x{}'.format(video_path, size[0], size[1])
+        shutil.copyfile(video_path, variant_path)
+        return True
+
+    # H.264 with 4:2:0 chroma subsampling requires even dimensions
+    width, height = max(width - width % 2, 2), max(height - height % 2, 2)
+    print 'Transcode video file {} from {}x{} to {}x{}'.format(video_path, video_size[0], video_size[1], width, height)
+    # keep the extension, so that ffmpeg and OpenCV choose the same container as the original video
+    temp_variant_path = os.path.join(os.path.dirname(variant_path), 'tmp_' + os.path.basename(variant_path))
+    command = [ffmpeg_path, '-v', 'error', '-y', '-i', video_path, '-vf', 'scale={}:{}'.format(width, height),
+               '-an', temp_variant_path]
+    try:
+        subprocess.check_call(command)
+        success = True
+    except (OSError, subprocess.CalledProcessError) as e:
+        print 'Could not transcode with ffmpeg ({}), transcode with OpenCV'.format(e)
+        success = transcode_video_with_opencv(capture, temp_variant_path, (width, height))
+    capture.release()
+
+    if not success:
+        if os.path.isfile(temp_variant_path):
+            os.remove(temp_variant_path)
+        return False
+
+    if os.path.isfile(variant_path):
+        # os.rename does not replace existing files on Windows
+        os.remove(variant_path)
+    os.rename(temp_variant_path, variant_path)
+    return True
+
+
+def transcode_video_with_opencv(capture, variant_path, size):
+    """
+    Write all frames of an opened capture downscaled to size into a new MPEG-4 video. Return True on success.
+
+    """
+    writer = cv2.VideoWriter(variant_path, cv2.VideoWriter_fourcc(*'mp4v'), capture.get(cv2.CAP_PROP_FPS), size)
+    if not writer.isOpened():
+        print 'Could not write video file {}'.format(variant_path)
+        return False
+
+    width, height = size
+    frame = None
+    scaled_frame = None
+    frame_count = 0
+    while True:
+        ret, frame_buffer = capture.read(frame)
+        if not ret:
+            break
+        frame = frame_buffer
+        # offline, so prefer quality to speed
+        scaled_frame = cv2.resize(frame, (width, height), scaled_frame, interpolation=cv2.INTER_AREA)
+        writer.write(scaled_frame)
+        frame_count += 1
+    writer.release()
+    return frame_count > 0